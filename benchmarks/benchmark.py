@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+"""Measure the throughput of the import scripts against local stand-ins.
+
+Each entry point is run as a subprocess against the stand-in servers in
+L{servers}, at each of the requested scales.  The records per second, the
+median and 99th percentile latency of each record, and the peak resident set
+size of the subprocess are reported, and saved as JSON so runs can be
+compared.  Latencies are taken from the elapsed time the import scripts print
+with each progress line, and from the C{fetch} histogram that C{download.py}
+exports with C{--metrics}.  The median and 99th percentile gap between
+progress lines are saved too, but they aren't latencies: scripts that batch or
+pipeline their writes print several progress lines at once, followed by a
+longer gap::
+
+  $ python benchmarks/benchmark.py --scales 1000 --output before.json
+  $ python benchmarks/benchmark.py --scales 1000 --baseline before.json
+"""
+
+from argparse import ArgumentParser
+from json import dump, dumps, load
+import os
+import platform
+import re
+from shutil import rmtree
+from subprocess import PIPE, STDOUT, Popen
+import sys
+from tempfile import mkdtemp
+import time
+
+from servers import (
+    FluidinfoHandler, PeerIndexHandler, getProfile, startServer)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The unthrottled call rate passed to the scripts that call PeerIndex.
+RATE = '1000000'
+
+ENTRY_POINTS = {
+    'download': {
+        'command': ['download.py', '--rate', RATE, '--metrics', '{metrics}',
+                    'benchmark', '{names}', '{output}'],
+        'progress': re.compile(r'Retrieved profile for '),
+        'latencyStage': 'fetch'},
+    'import': {
+        'command': ['import.py', '--rate', RATE],
+        'stdin': '{names}',
+        'progress': re.compile(r'^Processed \d+: .* \((\d+\.\d+)\)$')},
+    'import-json-data': {
+        'command': ['import-json-data.py', '{profiles}'],
+        'progress': re.compile(r'^Processed \d+: .* \((\d+\.\d+)\)$')},
+    }
+
+
+def writeInput(directory, records):
+    """Write the input files for a run.
+
+    @param directory: The directory to write the files in.
+    @param records: The number of users to write.
+    @return: A C{dict} with the C{names}, C{profiles}, C{output} and
+        C{metrics} paths, for substituting into L{ENTRY_POINTS} commands.
+    """
+    paths = {'names': os.path.join(directory, 'names.txt'),
+             'profiles': os.path.join(directory, 'profiles.json'),
+             'output': os.path.join(directory, 'output.json'),
+             'metrics': os.path.join(directory, 'metrics.json')}
+    with open(paths['names'], 'w') as names:
+        with open(paths['profiles'], 'w') as profiles:
+            for i in xrange(records):
+                name = 'user%d' % i
+                names.write(name + '\n')
+                profiles.write(dumps(getProfile(name)) + '\n')
+    return paths
+
+
+def getPercentile(values, fraction):
+    """Get a percentile of a sorted C{list} of values.
+
+    @return: The value, or C{None} if there are no values.
+    """
+    if not values:
+        return None
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def readLatency(path, stage):
+    """Read the median and 99th percentile time of a stage from the metrics
+    exported by a script.
+
+    @param path: The JSON metrics file written with C{--metrics}.
+    @param stage: The name of the stage, such as C{fetch}.
+    @return: A C{(p50, p99)} tuple, with C{None}s if the file wasn't written
+        or the stage wasn't observed.
+    """
+    if not os.path.exists(path):
+        return None, None
+    with open(path) as metricsFile:
+        histogram = load(metricsFile)['stages'].get(stage, {})
+    return histogram.get('p50'), histogram.get('p99')
+
+
+def run(entryPoint, paths, environment):
+    """Run an entry point and measure it.
+
+    @param entryPoint: The name of the entry point in L{ENTRY_POINTS}.
+    @param paths: The C{dict} returned by L{writeInput}.
+    @param environment: The environment to run the subprocess with.
+    @return: A C{dict} of measurements.
+    """
+    spec = ENTRY_POINTS[entryPoint]
+    command = [sys.executable] + [os.path.join(ROOT, spec['command'][0])]
+    command.extend(argument.format(**paths)
+                   for argument in spec['command'][1:])
+    stdin = None
+    if 'stdin' in spec:
+        stdin = open(spec['stdin'].format(**paths), 'rb')
+    for path in (paths['output'], paths['metrics']):
+        if os.path.exists(path):
+            os.remove(path)
+    start = last = time.time()
+    intervals = []
+    latencies = []
+    process = Popen(command, stdin=stdin, stdout=PIPE, stderr=STDOUT,
+                    env=environment, cwd=ROOT)
+    for line in iter(process.stdout.readline, ''):
+        match = spec['progress'].search(line.rstrip('\n'))
+        if match:
+            now = time.time()
+            intervals.append(now - last)
+            last = now
+            if match.groups():
+                latencies.append(float(match.group(1)))
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - start
+    if stdin is not None:
+        stdin.close()
+    intervals.sort()
+    latencies.sort()
+    latencyP50 = getPercentile(latencies, 0.5)
+    latencyP99 = getPercentile(latencies, 0.99)
+    if 'latencyStage' in spec:
+        latencyP50, latencyP99 = readLatency(paths['metrics'],
+                                             spec['latencyStage'])
+    return {'entryPoint': entryPoint, 'records': len(intervals),
+            'seconds': elapsed,
+            'recordsPerSecond': len(intervals) / elapsed if elapsed else None,
+            'latencyP50': latencyP50,
+            'latencyP99': latencyP99,
+            'gapP50': getPercentile(intervals, 0.5),
+            'gapP99': getPercentile(intervals, 0.99),
+            'peakRSSKilobytes': usage.ru_maxrss,
+            'exitStatus': os.WEXITSTATUS(status)}
+
+
+def compare(results, baselinePath):
+    """Print the change in throughput since a baseline run."""
+    with open(baselinePath) as baselineFile:
+        baseline = load(baselineFile)
+    previous = dict(((result['entryPoint'], result['scale']), result)
+                    for result in baseline['results'])
+    for result in results:
+        old = previous.get((result['entryPoint'], result['scale']))
+        if not old or not old['recordsPerSecond'] or \
+                not result['recordsPerSecond']:
+            continue
+        change = result['recordsPerSecond'] / old['recordsPerSecond'] - 1
+        print '%-16s %9d  %+7.1f%% records/s' % (
+            result['entryPoint'], result['scale'], change * 100)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Benchmark the import scripts against local stand-ins '
+                    'for PeerIndex and Fluidinfo.')
+    parser.add_argument('--scales', type=int, nargs='+',
+                        default=[1000, 100000, 1000000],
+                        help='The numbers of records to run with.')
+    parser.add_argument('--entry-points', nargs='+',
+                        choices=sorted(ENTRY_POINTS),
+                        default=sorted(ENTRY_POINTS),
+                        help='The scripts to benchmark.')
+    parser.add_argument('--peerindex-latency', type=float, default=0.005,
+                        help='The mean PeerIndex response time in seconds.')
+    parser.add_argument('--fluidinfo-latency', type=float, default=0.005,
+                        help='The mean Fluidinfo response time in seconds.')
+    parser.add_argument('--jitter', type=float, default=0.5,
+                        help='The fraction response times vary by.')
+    parser.add_argument('--output', dest='outputPath',
+                        default='benchmark-results.json',
+                        help='The file to save the results in.')
+    parser.add_argument('--baseline', dest='baselinePath',
+                        help='Earlier results to compare throughput with.')
+    args = parser.parse_args()
+
+    peerindex = startServer(PeerIndexHandler, args.peerindex_latency,
+                            args.jitter)
+    fluidinfo = startServer(FluidinfoHandler, args.fluidinfo_latency,
+                            args.jitter)
+    environment = dict(
+        os.environ, PYTHONUNBUFFERED='1', PEERINDEX_API_KEY='benchmark',
+        FLUIDINFO_PEERINDEX_PASSWORD='benchmark',
+        PEERINDEX_API_URL='http://%s:%d/1' % peerindex.server_address,
+        FLUIDINFO_URL='http://%s:%d' % fluidinfo.server_address)
+    results = []
+    for scale in args.scales:
+        directory = mkdtemp()
+        try:
+            paths = writeInput(directory, scale)
+            for entryPoint in args.entry_points:
+                result = run(entryPoint, paths, environment)
+                result['scale'] = scale
+                results.append(result)
+                print dumps(result, sort_keys=True)
+        finally:
+            rmtree(directory)
+    with open(args.outputPath, 'w') as outputFile:
+        dump({'time': time.time(), 'python': platform.python_version(),
+              'platform': platform.platform(),
+              'settings': {'peerindexLatency': args.peerindex_latency,
+                           'fluidinfoLatency': args.fluidinfo_latency,
+                           'jitter': args.jitter},
+              'results': results}, outputFile, indent=2, sort_keys=True)
+    if args.baselinePath is not None:
+        compare(results, args.baselinePath)
@@ -0,0 +1,153 @@
+"""Local HTTP stand-ins for the PeerIndex and Fluidinfo APIs.
+
+The stand-ins implement just enough of each API for the scripts in this
+repository to run against them, and sleep for a configurable time before
+each response to simulate network and server latency::
+
+  server = startServer(PeerIndexHandler, latency=0.05)
+  url = 'http://%s:%d/1' % server.server_address
+
+Point the scripts at them with the C{PEERINDEX_API_URL} and C{FLUIDINFO_URL}
+environment variables.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from json import dumps, loads
+import random
+from SocketServer import ThreadingMixIn
+from threading import Thread
+import time
+from urlparse import parse_qs, urlparse
+from uuid import NAMESPACE_URL, uuid5
+from zlib import crc32
+
+
+def getProfile(name):
+    """Get a synthetic PeerIndex profile for a Twitter user.
+
+    The same name always gets the same profile, so runs are repeatable.
+
+    @param name: The screen name of the Twitter user.
+    @return: A profile C{dict} with the keys returned by the API.
+    """
+    score = crc32(name) % 100
+    return {'name': name.title(), 'twitter': name, 'slug': name, 'known': 1,
+            'activity': score, 'audience': (score * 7) % 100,
+            'authority': (score * 13) % 100, 'peerindex': (score * 3) % 100,
+            'realness': (score * 11) % 100,
+            'url': 'http://pi.mu/%s' % name,
+            'topics': ['topic%d' % ((score + i) % 50) for i in range(5)]}
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server that handles each connection in its own thread."""
+
+    daemon_threads = True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Base class for request handlers that simulate latency.
+
+    @ivar latency: The mean number of seconds to sleep before responding.
+    @ivar jitter: The fraction of C{latency} each sleep can vary by.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    latency = 0.0
+    jitter = 0.0
+
+    def log_message(self, format, *args):
+        """Don't log requests, since there can be millions of them."""
+
+    def delay(self):
+        """Sleep for the simulated latency."""
+        if self.latency:
+            spread = self.latency * self.jitter
+            time.sleep(max(0.0, random.uniform(self.latency - spread,
+                                               self.latency + spread)))
+
+    def readBody(self):
+        """Read the body of the request.
+
+        @return: The body, as a C{str}.
+        """
+        return self.rfile.read(int(self.headers.get('content-length', 0)))
+
+    def respond(self, status, body=None):
+        """Send a response, keeping the connection open.
+
+        @param status: The HTTP status code.
+        @param body: Optionally, an object to send as JSON.
+        """
+        content = '' if body is None else dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class PeerIndexHandler(StandInHandler):
+    """A stand-in for the PeerIndex C{profile/show} call.
+
+    Names starting with C{unknown} get a 404 response, like users PeerIndex
+    doesn't know about.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.delay()
+        if url.path != '/1/profile/show.json':
+            self.respond(404, {'error': 'Not found'})
+            return
+        name = parse_qs(url.query).get('id', [''])[0]
+        if name.startswith('unknown'):
+            self.respond(404, [])
+        else:
+            self.respond(200, getProfile(name))
+
+
+class FluidinfoHandler(StandInHandler):
+    """A stand-in for the Fluidinfo C{objects} and C{values} endpoints."""
+
+    def do_POST(self):
+        body = loads(self.readBody() or '{}')
+        self.delay()
+        if urlparse(self.path).path != '/objects':
+            self.respond(404)
+            return
+        about = body.get('about', u'').encode('utf-8')
+        objectId = str(uuid5(NAMESPACE_URL, about))
+        self.respond(201, {'id': objectId,
+                           'URI': 'http://fluiddb/objects/%s' % objectId})
+
+    def do_PUT(self):
+        self.readBody()
+        self.delay()
+        if urlparse(self.path).path != '/values':
+            self.respond(404)
+            return
+        self.respond(204)
+
+
+def startServer(handlerClass, latency=0.0, jitter=0.0):
+    """Start a stand-in server on a free local port, in a daemon thread.
+
+    @param handlerClass: The L{StandInHandler} subclass to serve.
+    @param latency: Optionally, the mean number of seconds to sleep before
+        each response.
+    @param jitter: Optionally, the fraction of C{latency} each sleep can
+        vary by.
+    @return: The running L{ThreadedHTTPServer}.
+    """
+    class Handler(handlerClass):
+        pass
+
+    Handler.latency = latency
+    Handler.jitter = jitter
+    server = ThreadedHTTPServer(('127.0.0.1', 0), Handler)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
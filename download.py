@@ -1,59 +1,275 @@
 #!/usr/bin/env python
 
+from argparse import ArgumentParser
 import logging
-from json import dumps
-import sys
+import os
+import time
 
-from peerindex.client import PeerIndex, PeerIndexError, RateLimitError
+from peerindex.cache import ResponseCache
+from peerindex.client import BASE_URL
+from peerindex.keypool import createPeerIndex
+from peerindex.metrics import Metrics, MetricsExporter
+from peerindex.names import SeenSet, createSeenSet
+from peerindex.output import ProfileWriter
+from peerindex.pipeline import dedup, normalizeNames, readNames
+from peerindex.pool import ConnectionPool
+from peerindex.refresh import RefreshIndex
+from peerindex.resume import Checkpoint, loadCompletedNames, repairOutput
+from peerindex.retry import DeadLetters, RetryScheduler, fetchWithRetries
+from peerindex.shard import filterShard, getShardPath, parseShard
 
 
-def getProfiles(peerindex, names):
+def getProfiles(peerindex, names, scheduler=None, deadLetters=None,
+                onFailure=None, onPermanentFailure=None):
     """Download PeerIndex profiles for the specified Twitter users.
 
+    Users that fail with a retryable error are retried later, with
+    exponential backoff, while downloading continues with other users.
+
     @param peerindex: The L{PeerIndex} client instance to use.
     @param names: The Twitter users to download profiles for.
+    @param scheduler: Optionally, the L{RetryScheduler} to queue failed
+        users in.  Defaults to one that makes up to 4 attempts.
+    @param deadLetters: Optionally, the L{DeadLetters} to record users that
+        still fail after all their attempts in.
+    @param onFailure: Optionally, a function to call with the screen name
+        of each user that can't be downloaded.
+    @param onPermanentFailure: Optionally, a function to call with the
+        screen name of each user that can never be downloaded, such as an
+        unknown user.
     @return: Generator yields profiles for each Twitter user, as they're
         retrieved.
     """
-    for name in names:
-        for retry in range(3):
-            try:
-                yield peerindex.get(name)
-                logging.info('Retrieved profile for %s' % name)
-            except RateLimitError:
-                raise
-            except PeerIndexError as error:
-                logging.exception(error)
-            else:
-                break
-        else:
-            logging.warning("Couldn't get a profile for %s" % name)
-
-
-def main(key, inputPath, outputPath):
+    if scheduler is None:
+        scheduler = RetryScheduler()
+    return fetchWithRetries(peerindex, names, scheduler, deadLetters,
+                            onFailure, onPermanentFailure)
+
+
+def main(key, inputPath, outputPath, resume=False, checkpointPath=None,
+         cache=None, rate=1.0, baseURL=BASE_URL, metrics=None, seen=None,
+         shard=None, scheduler=None, deadLettersPath=None, refreshIndex=None,
+         spread=True, **writerOptions):
     """
     Load Twitter users from the specified file and download PeerIndex
-    profiles.
+    profiles.  The daily quota is spread until it resets, unless C{spread}
+    is C{False}, and downloading pauses until the next reset if it runs
+    out.
 
-    @param key: The L{PeerIndex} API key to use.
+    @param key: The L{PeerIndex} API key to use, or several separated by
+        commas to share the calls between them.
     @param inputPath: The path to the file containing a list of Twitter users,
         one per line.
     @param outputPath: The path to the file to write results to.
+    @param resume: Optionally, a flag indicating whether to skip users whose
+        profiles are already in the output file.  Defaults to C{False}.
+    @param checkpointPath: Optionally, the path to a checkpoint file listing
+        the users downloaded so far, and those that don't exist.  When
+        resuming, it's read instead of scanning the output file.
+    @param cache: Optionally, a L{ResponseCache} to use to avoid fetching
+        recently fetched profiles again.  It's closed when downloading
+        finishes.
+    @param rate: Optionally, the number of calls to make per second.
+        Defaults to 1.0.
+    @param baseURL: Optionally, the base URL of the PeerIndex API.
+    @param metrics: Optionally, the L{Metrics} to record timings and errors
+        in.
+    @param seen: Optionally, the L{SeenSet} or L{BloomFilter} used to skip
+        repeated users.  Defaults to a L{SeenSet}.  It's closed when
+        downloading finishes.
+    @param shard: Optionally, an C{(index, count)} 2-tuple to only download
+        the users in one of C{count} shards.
+    @param scheduler: Optionally, the L{RetryScheduler} used to retry users
+        whose calls fail.
+    @param deadLettersPath: Optionally, the path of a file to append users
+        that can't be downloaded to.
+    @param refreshIndex: Optionally, the L{RefreshIndex} to record
+        downloaded profiles, and users that can't be downloaded, in.
+    @param spread: Optionally, a flag indicating whether to spread the
+        remaining daily quota until it resets.  Defaults to C{True}.
+    @param writerOptions: Optionally, keyword arguments to pass to the
+        L{ProfileWriter} used to write the output file.
     """
-    peerindex = PeerIndex(key)
-    with open(inputPath, 'r') as inputFile:
-        names = [line.strip() for line in inputFile]
-    for result in getProfiles(peerindex, names):
-        with open(outputPath, 'a') as outputFile:
-            print >> outputFile, dumps(result)
+    peerindex = createPeerIndex(key, rate=rate, spread=spread,
+                                client=ConnectionPool(),
+                                cache=cache, baseURL=baseURL,
+                                metrics=metrics)
+    completed = set()
+    if resume:
+        if not writerOptions.get('compress'):
+            repairOutput(outputPath)
+        completed = loadCompletedNames(outputPath, checkpointPath)
+        logging.info('Resuming with %d profiles already downloaded'
+                     % len(completed))
+    if seen is None:
+        seen = SeenSet()
+    inputFile = open(inputPath, 'r')
+    names = normalizeNames(readNames(inputFile))
+    if shard is not None:
+        names = filterShard(names, *shard)
+    names = (name for name in dedup(names, seen=seen)
+             if name not in completed)
+    checkpoint = None
+    if checkpointPath is not None:
+        checkpoint = Checkpoint(checkpointPath, completed)
+        writerOptions['onFlush'] = checkpoint.flush
+    writer = ProfileWriter(outputPath, **writerOptions)
+    deadLetters = None
+    if deadLettersPath is not None:
+        deadLetters = DeadLetters(deadLettersPath)
+
+    def recordFailure(name):
+        refreshIndex.recordFailure(name, time.time())
+
+    onFailure = recordFailure if refreshIndex is not None else None
+    onPermanentFailure = None
+    if checkpoint is not None:
+        onPermanentFailure = checkpoint.addFailure
+    profiles = getProfiles(peerindex, names, scheduler, deadLetters,
+                           onFailure, onPermanentFailure)
+    try:
+        for result in profiles:
+            # The name is added first, so it's in the checkpoint flush run
+            # when writing its profile fills the buffer.
+            if checkpoint is not None:
+                checkpoint.add(result['twitter'])
+            writer.write(result)
+            if refreshIndex is not None:
+                refreshIndex.recordProfile(result, time.time())
+    finally:
+        profiles.close()
+        if deadLetters is not None:
+            deadLetters.close()
+            if deadLetters.count:
+                logging.warning('Wrote %d users to %s' % (deadLetters.count,
+                                                          deadLettersPath))
+        inputFile.close()
+        seen.close()
+        writer.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if refreshIndex is not None:
+            refreshIndex.close()
+        if cache is not None:
+            logging.info('Cache statistics: %r' % cache.getStats())
+            cache.close()
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 4:
-        sys.exit('Need to pass KEY, INPUT_PATH and OUTPUT_PATH arguments.')
+    parser = ArgumentParser(
+        description='Download PeerIndex profiles for Twitter users.')
+    parser.add_argument('key',
+                        help='The PeerIndex API key to use, or several '
+                             'separated by commas.')
+    parser.add_argument('inputPath', metavar='INPUT_PATH',
+                        help='A file with one Twitter user per line.')
+    parser.add_argument('outputPath', metavar='OUTPUT_PATH',
+                        help='The file to append JSON profiles to.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip users already in the output file.')
+    parser.add_argument('--checkpoint', dest='checkpointPath',
+                        help='A file to record completed users in, which is '
+                             'read instead of the output file to resume.')
+    parser.add_argument('--cache', dest='cachePath',
+                        help='A database to cache API responses in.')
+    parser.add_argument('--cache-ttl', type=float, default=24 * 60 * 60,
+                        help='The number of seconds to cache profiles for.')
+    parser.add_argument('--negative-ttl', type=float,
+                        default=7 * 24 * 60 * 60,
+                        help='The number of seconds to cache unknown users '
+                             'for.')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='The number of PeerIndex calls to make per '
+                             'second with each key.')
+    parser.add_argument('--no-spread', dest='spread', action='store_false',
+                        help="Make calls as fast as --rate allows instead "
+                             "of spreading the daily quota until it resets, "
+                             "for runs that don't need all of it.")
+    parser.add_argument('--metrics', dest='metricsPath',
+                        help='A file to export timing histograms and error '
+                             'counts to while running.')
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                        default='json',
+                        help='The format of the metrics file.')
+    parser.add_argument('--metrics-interval', type=float, default=60,
+                        help='The number of seconds between metrics '
+                             'exports.')
+    parser.add_argument('--shard', type=parseShard, metavar='I/N',
+                        help='Only download the users in shard I of N, to '
+                             'OUTPUT_PATH.shard-I-of-N.')
+    parser.add_argument('--attempts', type=int, default=4,
+                        help='The number of calls to make for a user before '
+                             'giving up on it.')
+    parser.add_argument('--retry-delay', type=float, default=5.0,
+                        help='The number of seconds before the first retry.  '
+                             'It doubles for each further retry.')
+    parser.add_argument('--dead-letters', dest='deadLettersPath',
+                        help='A file to append users that still fail after '
+                             'all their attempts to, one per line.')
+    parser.add_argument('--refresh-index', dest='refreshIndexPath',
+                        help='A database to record the time of each '
+                             'download in, for refresh-worklist.py.')
+    parser.add_argument('--dedup-memory', type=int, default=1000000,
+                        help='The number of names to remember in memory '
+                             'before spilling to disk to skip repeats.')
+    parser.add_argument('--bloom', type=int, metavar='CAPACITY',
+                        help='Skip repeated names with a Bloom filter sized '
+                             'for this many names, which may also skip a '
+                             'few unique ones.')
+    parser.add_argument('--buffer-size', type=int, default=65536,
+                        help='The size of the output buffer in bytes.')
+    parser.add_argument('--flush-every', type=int, default=100,
+                        help='The number of profiles to write between '
+                             'flushes.')
+    parser.add_argument('--fsync', action='store_true',
+                        help='Sync the output to disk when flushing.')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Compress the output with gzip.')
+    parser.add_argument('--max-bytes', type=int,
+                        help='Rotate the output after this many bytes.')
+    parser.add_argument('--max-records', type=int,
+                        help='Rotate the output after this many profiles.')
+    args = parser.parse_args()
     logging.basicConfig(format='%(asctime)s %(levelname)8s  %(message)s',
                         level=logging.INFO)
-    key = sys.argv[1]
-    inputPath = sys.argv[2]
-    outputPath = sys.argv[3]
-    main(key, inputPath, outputPath)
+    if args.shard is not None:
+        args.outputPath = getShardPath(args.outputPath, *args.shard)
+        if args.checkpointPath is not None:
+            args.checkpointPath = getShardPath(args.checkpointPath,
+                                               *args.shard)
+        if args.deadLettersPath is not None:
+            args.deadLettersPath = getShardPath(args.deadLettersPath,
+                                                *args.shard)
+    refreshIndex = None
+    if args.refreshIndexPath is not None:
+        # Shards usually share the index, so each change is committed
+        # straight away rather than holding a lock on it.
+        refreshIndex = RefreshIndex(args.refreshIndexPath, commitEvery=1)
+    cache = None
+    if args.cachePath is not None:
+        cache = ResponseCache(args.cachePath, ttl=args.cache_ttl,
+                              negativeTTL=args.negative_ttl)
+    metrics = exporter = None
+    if args.metricsPath is not None:
+        metrics = Metrics()
+        exporter = MetricsExporter(metrics, args.metricsPath,
+                                   args.metrics_format, args.metrics_interval)
+        exporter.start()
+    try:
+        main(args.key, args.inputPath, args.outputPath, args.resume,
+             args.checkpointPath, cache, rate=args.rate,
+             baseURL=os.environ.get('PEERINDEX_API_URL', BASE_URL),
+             metrics=metrics,
+             seen=createSeenSet(args.dedup_memory, args.bloom),
+             shard=args.shard,
+             scheduler=RetryScheduler(maxAttempts=args.attempts,
+                                      baseDelay=args.retry_delay),
+             deadLettersPath=args.deadLettersPath,
+             refreshIndex=refreshIndex, spread=args.spread,
+             bufferSize=args.buffer_size,
+             flushEvery=args.flush_every, fsync=args.fsync,
+             compress=args.gzip, maxBytes=args.max_bytes,
+             maxRecords=args.max_records)
+    finally:
+        if exporter is not None:
+            exporter.stop()
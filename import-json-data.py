@@ -2,47 +2,173 @@
 
 # See README.markdown for usage instructions.
 
-from datetime import datetime
-import json
+from argparse import ArgumentParser
+from json import loads
 import os
 import sys
-import time
 
+from fom.db import BASE_URL
 from fom.session import Fluid
-from fom.errors import FluidError
+
+from peerindex.fluidinfo import BatchWriter, ConcurrentBatchWriter
+from peerindex.follow import Follower, OffsetCheckpoint
+from peerindex.metrics import Metrics, MetricsExporter
+from peerindex.offsets import IndexedProfiles, OffsetIndex
+from peerindex.pipeline import (
+    getProfileName, mapTags, normalizeNames, readNames, readPaths,
+    readProfiles, writeFluidinfo)
+from peerindex.pool import ConnectionPool, usePool
+from peerindex.shard import filterShard, getShardPath, parseShard
+from peerindex.store import ChangedValuesWriter, ValueStore
 
 
 if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Import JSON PeerIndex profiles into Fluidinfo.')
+    parser.add_argument('paths', metavar='PATH', nargs='*',
+                        help='Files to read profiles from, instead of stdin.')
+    parser.add_argument('--follow', dest='followPath', metavar='PATH',
+                        help='Import the profiles written to the output of '
+                             'a running download as they arrive.')
+    parser.add_argument('--follow-checkpoint', dest='checkpointPath',
+                        help='The file recording how far --follow has got.  '
+                             'Defaults to PATH.offset.')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='The number of seconds to wait for more '
+                             'profiles when following.')
+    parser.add_argument('--names', dest='namesPath',
+                        help='A file of Twitter users, one per line, to '
+                             'import from a single indexed PATH.')
+    parser.add_argument('--index', dest='indexPath',
+                        help='The index built by index-profiles.py for '
+                             '--names.  Defaults to PATH.index.')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='The number of profiles to write per request.')
+    parser.add_argument('--max-batch-size', type=int,
+                        help='Adapt the batch size to the observed latency, '
+                             'up to this many profiles per request.')
+    parser.add_argument('--target-latency', type=float, default=2.0,
+                        help='The number of seconds a batch should take '
+                             'when adapting the batch size.')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='The number of batches to write at once, each '
+                             'with its own Fluidinfo session.')
+    parser.add_argument('--shard', type=parseShard, metavar='I/N',
+                        help='Only import the users in shard I of N.  The '
+                             '--store path gets a .shard-I-of-N suffix.')
+    parser.add_argument('--store', dest='storePath',
+                        help='A database of the values last written, used '
+                             'to only write values that have changed.')
+    parser.add_argument('--refresh-updated-at', type=float,
+                        help='Rewrite peerindex.com/updated-at for unchanged '
+                             'profiles after this many seconds.')
+    parser.add_argument('--metrics', dest='metricsPath',
+                        help='A file to export timing histograms and error '
+                             'counts to while running.')
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                        default='json',
+                        help='The format of the metrics file.')
+    parser.add_argument('--metrics-interval', type=float, default=60,
+                        help='The number of seconds between metrics '
+                             'exports.')
+    args = parser.parse_args()
+    if args.followPath is not None and (args.paths or
+                                        args.namesPath is not None):
+        parser.error("--follow can't be used with PATHs or --names")
+    if args.namesPath is not None and len(args.paths) != 1:
+        parser.error('--names requires a single PATH')
+
     password = os.environ['FLUIDINFO_PEERINDEX_PASSWORD']
     assert password, 'Please set FLUIDINFO_PEERINDEX_PASSWORD in your env.'
-    fdb = Fluid()
-    fdb.login('peerindex.com', password)
-    totalTime = 0.0
-
-    for i, line in enumerate(sys.stdin.readlines()):
-        start = time.time()
-        info = json.loads(line[:-1])
-        screenname = info['twitter']
-        updatedAt = time.mktime(datetime.utcnow().timetuple())
-        about = '@%s' % screenname.lower()
-        values = {
-            'peerindex.com/updated-at': {'value': updatedAt},
-            }
-        for var in ('activity', 'audience', 'authority', 'peerindex',
-                    'realness', 'name', 'slug', 'url', 'topics'):
-            try:
-                values['peerindex.com/%s' % var] = {'value': info[var]}
-            except KeyError:
-                pass
+
+    connections = ConnectionPool(maxPerHost=args.concurrency)
+
+    def createSession():
+        fdb = usePool(Fluid(os.environ.get('FLUIDINFO_URL', BASE_URL)),
+                      connections)
+        fdb.login('peerindex.com', password)
+        return fdb
+
+    metrics = exporter = None
+    if args.metricsPath is not None:
+        metrics = Metrics()
+        exporter = MetricsExporter(metrics, args.metricsPath,
+                                   args.metrics_format, args.metrics_interval)
+        exporter.start()
+    writerOptions = dict(batchSize=args.batch_size,
+                         maxBatchSize=args.max_batch_size,
+                         targetLatency=args.target_latency,
+                         metrics=metrics)
+    if args.concurrency > 1:
+        writer = ConcurrentBatchWriter(createSession, args.concurrency,
+                                       **writerOptions)
+    else:
+        writer = BatchWriter(createSession(), **writerOptions)
+    store = None
+    if args.storePath is not None:
+        if args.shard is not None:
+            args.storePath = getShardPath(args.storePath, *args.shard)
+        store = ValueStore(args.storePath,
+                           refreshAfter=args.refresh_updated_at)
+        writer = ChangedValuesWriter(writer, store)
+    state = dict(count=0, errors=0, totalTime=0.0)
+
+    def report(results):
+        for result in results:
+            state['count'] += 1
+            if result.error is not None:
+                state['errors'] += 1
+                print 'Error processing %s' % result.key
+                print getattr(result.error, 'response', result.error)
+                continue
+            state['totalTime'] += result.elapsed
+            print 'Processed %d: %s (%.3f)' % (
+                state['count'], result.key, result.elapsed)
+
+    index = indexed = None
+    if args.followPath is not None:
+        checkpoint = OffsetCheckpoint(args.checkpointPath or
+                                      args.followPath + '.offset')
+
+        def onIdle(position):
+            report(writer.sync())
+            checkpoint.save(position)
+
+        follower = Follower(args.followPath, checkpoint.load(),
+                            pollInterval=args.poll_interval, onIdle=onIdle)
+        profiles = (loads(line) for line in follower.lines() if line.strip())
+    elif args.namesPath is not None:
+        [path] = args.paths
+        index = OffsetIndex(args.indexPath or path + '.index')
+        indexed = IndexedProfiles(path, index)
+        names = normalizeNames(readPaths([args.namesPath], readNames))
+        profiles = indexed.lookup(names)
+    else:
+        profiles = readPaths(args.paths, readProfiles)
+    if args.shard is not None:
+        profiles = filterShard(profiles, *args.shard, key=getProfileName)
+    try:
         try:
-            fdb.values.put(query='fluiddb/about="%s"' % about, values=values)
-        except FluidError, e:
-            print 'Error processing %s' % screenname
-            print e.args[0].response
-            raise
-        else:
-            elapsed = time.time() - start
-            totalTime += elapsed
-            print 'Processed %d: %s (%.3f)' % (i + 1, screenname, elapsed)
-    av = totalTime / (i + 1)
-    print 'Average time per user: %.3f' % av
+            report(writeFluidinfo(writer, mapTags(profiles)))
+        finally:
+            # writeFluidinfo only closes the writer when the profiles are
+            # exhausted, so close it here too, in case it was interrupted.
+            # Closing it again has no further effect.
+            report(writer.close())
+    except KeyboardInterrupt as e:
+        print >>sys.stderr, 'Stopping: %r' % e
+    finally:
+        if indexed is not None:
+            indexed.close()
+            index.close()
+        if exporter is not None:
+            exporter.stop()
+        if store is not None:
+            store.close()
+    if state['count']:
+        av = state['totalTime'] / state['count']
+        print 'Average time per user: %.3f' % av
+    if store is not None:
+        print 'Unchanged: %d' % writer.skipped
+    if state['errors']:
+        print 'Errors: %d' % state['errors']
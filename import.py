@@ -2,77 +2,254 @@
 
 # See README.markdown for usage instructions.
 
-from datetime import datetime
-import json
+from argparse import ArgumentParser
+from collections import namedtuple
+from functools import partial
 import os
 import sys
 import time
-import urllib
 
+from fom.db import BASE_URL
 from fom.session import Fluid
-from fom.errors import FluidError
+
+from peerindex.cache import ResponseCache
+from peerindex.client import (
+    BASE_URL as PEERINDEX_URL, CredentialsError, PeerIndexError,
+    RateLimitError)
+from peerindex.fluidinfo import (
+    WriterPool, getTagValues, getUpdatedAt, writeProfile)
+from peerindex.keypool import createPeerIndex
+from peerindex.metrics import Metrics, MetricsExporter
+from peerindex.names import createSeenSet
+from peerindex.objects import ObjectIndex, warmObjectIndex
+from peerindex.pipeline import dedup, normalizeNames, readNames
+from peerindex.pool import ConnectionPool, usePool
+from peerindex.refresh import RefreshIndex
+from peerindex.retry import getErrorKind
+from peerindex.store import ValueStore
+
+
+def fetchProfiles(peerindex, screennames, onFailure=None):
+    """Fetch PeerIndex profiles, as fast as the rate limit allows.
+
+    Users that can't be fetched are reported on stderr and skipped.
+
+    @param peerindex: The L{PeerIndex} client to use.
+    @param screennames: An iterable of Twitter screen names.
+    @param onFailure: Optionally, a function to call with the screen name
+        of each user that can't be fetched.  It isn't called for fatal
+        errors, which aren't the user's fault.
+    @raise RateLimitError: Raised if the daily quota is exhausted and the
+        client can't pause until it resets.
+    @raise CredentialsError: Raised if the API key, or every key, is
+        invalid.
+    @return: A generator that yields C{(screenname, info, elapsed)}
+        3-tuples, where C{elapsed} is the number of seconds spent fetching
+        the profile, including any rate limit sleep.
+    """
+    for screenname in screennames:
+        start = time.time()
+        try:
+            info = peerindex.get(screenname)
+        except PeerIndexError as e:
+            if getErrorKind(e) == 'fatal':
+                raise
+            print >>sys.stderr, 'Error for %r: %s' % (screenname, e)
+            if onFailure is not None:
+                onFailure(screenname)
+            continue
+        yield screenname, info, time.time() - start
+
+
+class ImportTask(namedtuple('ImportTask', ['screenname', 'values',
+                                           'objectId', 'score', 'fetchTime'])):
+    """A profile waiting to be written to Fluidinfo.
+
+    @ivar screenname: The normalized screen name of the Twitter user.
+    @ivar values: The tag values to write, as returned by L{getTagValues}.
+    @ivar objectId: The ID of the user's object, or C{None} if it isn't
+        known.
+    @ivar score: The user's C{peerindex} score.
+    @ivar fetchTime: The number of seconds spent fetching the profile.
+    """
+
+
+def writeTask(fdb, task, metrics=None):
+    """Write a profile to Fluidinfo in a L{WriterPool} worker.
+
+    @param fdb: The worker's C{fom.session.Fluid} session.
+    @param task: The L{ImportTask} to write.
+    @param metrics: Optionally, the L{Metrics} to record timings and errors
+        in.
+    @return: A C{(objectId, elapsed)} 2-tuple, with the ID of the object
+        and the number of seconds spent writing.
+    """
+    start = time.time()
+    objectId = writeProfile(fdb, task.screenname, task.values, metrics,
+                            task.objectId)
+    return objectId, time.time() - start
 
 
 if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Import PeerIndex profiles for the Twitter users named '
+                    'on stdin into Fluidinfo.')
+    parser.add_argument('--store', dest='storePath',
+                        help='A database of the values last written, used '
+                             'to only write values that have changed.')
+    parser.add_argument('--refresh-updated-at', type=float,
+                        help='Rewrite peerindex.com/updated-at for unchanged '
+                             'profiles after this many seconds.')
+    parser.add_argument('--refresh-index', dest='refreshIndexPath',
+                        help='A database to record the time of each '
+                             'refresh in, for refresh-worklist.py.')
+    parser.add_argument('--object-ids', dest='objectIndexPath',
+                        help='A database of Fluidinfo object IDs, used to '
+                             'skip creating objects that already exist.')
+    parser.add_argument('--warm-object-ids', action='store_true',
+                        help='Fetch the IDs of all the objects with '
+                             'PeerIndex tags into the --object-ids database '
+                             'before importing.')
+    parser.add_argument('--cache', dest='cachePath',
+                        help='A database to cache API responses in.')
+    parser.add_argument('--cache-ttl', type=float, default=24 * 60 * 60,
+                        help='The number of seconds to cache profiles for.')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='The number of PeerIndex calls to make per '
+                             'second with each key.')
+    parser.add_argument('--metrics', dest='metricsPath',
+                        help='A file to export timing histograms and error '
+                             'counts to while running.')
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                        default='json',
+                        help='The format of the metrics file.')
+    parser.add_argument('--metrics-interval', type=float, default=60,
+                        help='The number of seconds between metrics '
+                             'exports.')
+    parser.add_argument('--dedup-memory', type=int, default=1000000,
+                        help='The number of names to remember in memory '
+                             'before spilling to disk to skip repeats.')
+    parser.add_argument('--bloom', type=int, metavar='CAPACITY',
+                        help='Skip repeated names with a Bloom filter sized '
+                             'for this many names, which may also skip a '
+                             'few unique ones.')
+    parser.add_argument('--writers', type=int, default=2,
+                        help='The number of Fluidinfo writers.')
+    parser.add_argument('--queue-size', type=int, default=10,
+                        help='The number of fetched profiles that can wait '
+                             'to be written before fetching pauses.')
+    args = parser.parse_args()
+    if args.warm_object_ids and args.objectIndexPath is None:
+        parser.error('--warm-object-ids requires --object-ids')
+
     password = os.environ['FLUIDINFO_PEERINDEX_PASSWORD']
     assert password, 'Please set FLUIDINFO_PEERINDEX_PASSWORD in your env.'
     apikey = os.environ['PEERINDEX_API_KEY']
     assert apikey, 'Please set PEERINDEX_API_KEY in your env.'
 
-    fdb = Fluid()
-    fdb.login('peerindex.com', password)
-    totalTime = 0.0
-    screennames = sys.stdin.readlines()
-    assert len(screennames) <= 10000, 'Too many input lines (max is 10,000).'
+    connections = ConnectionPool(maxPerHost=args.writers)
 
-    for i, screenname in enumerate(s[:-1].lower() for s in screennames):
-        start = time.time()
-        try:
-            request = urllib.urlopen(
-                'http://api.peerindex.net/1/profile/show.json?id=%s&api_key=%s'
-                % (screenname, apikey))
-        except IOError, e:
-            print >>sys.stderr, 'IOError for %r (%s)' % (screenname, e)
-            time.sleep(1.0)
-            continue
-        data = request.read()
-        if not data:
-            print >>sys.stderr, 'No data returned for %r' % screenname
-            time.sleep(1.0)
-            continue
-        info = json.loads(data)
-        if 'error' in info:
-            print >>sys.stderr, 'Error for %r: %r' % (
-                screenname, info['error'])
-            time.sleep(1.0)
-            continue
-        updatedAt = time.mktime(datetime.utcnow().timetuple())
-        about = '@%s' % screenname.lower()
-        response = fdb.objects.post(about=about)
-        objectId = response.value['id']
-        values = {
-            'peerindex.com/updated-at': {'value': updatedAt},
-            }
-        for var in ('activity', 'audience', 'authority', 'peerindex',
-                    'realness', 'name', 'slug', 'url', 'topics'):
-            try:
-                values['peerindex.com/%s' % var] = {'value': info[var]}
-            except KeyError:
-                pass
-        try:
-            fdb.values.put(query='fluiddb/id="%s"' % objectId, values=values)
-        except FluidError, e:
-            print 'Error processing %s' % screenname
-            print e.args[0].response
-            raise
-        else:
-            elapsed = time.time() - start
-            totalTime += elapsed
-            print 'Processed %d: %s (%.3f)' % (i + 1, screenname, elapsed)
-            # Sleep (if needed) to make sure 1 second has passed since the
-            # start of processing so as not to call the PeerIndex API too
-            # often.
-            if elapsed < 1.0:
-                time.sleep(1.0 - elapsed)
-    av = totalTime / (i + 1)
-    print 'Average time per user: %.3f' % av
+    def createSession():
+        fdb = usePool(Fluid(os.environ.get('FLUIDINFO_URL', BASE_URL)),
+                      connections)
+        fdb.login('peerindex.com', password)
+        return fdb
+
+    metrics = exporter = None
+    if args.metricsPath is not None:
+        metrics = Metrics()
+        exporter = MetricsExporter(metrics, args.metricsPath,
+                                   args.metrics_format, args.metrics_interval)
+        exporter.start()
+    cache = None
+    if args.cachePath is not None:
+        cache = ResponseCache(args.cachePath, ttl=args.cache_ttl)
+    # Imports are usually small, so calls are made as fast as the rate
+    # allows rather than spread over the daily quota.
+    peerindex = createPeerIndex(
+        apikey, rate=args.rate, spread=False, client=connections, cache=cache,
+        baseURL=os.environ.get('PEERINDEX_API_URL', PEERINDEX_URL),
+        metrics=metrics)
+    pool = WriterPool(createSession, partial(writeTask, metrics=metrics),
+                      concurrency=args.writers, maxPending=args.queue_size)
+    store = None
+    if args.storePath is not None:
+        store = ValueStore(args.storePath,
+                           refreshAfter=args.refresh_updated_at)
+    objectIndex = None
+    if args.objectIndexPath is not None:
+        objectIndex = ObjectIndex(args.objectIndexPath)
+        if args.warm_object_ids:
+            print 'Warmed up %d object IDs' % warmObjectIndex(
+                createSession(), objectIndex)
+    refreshIndex = None
+    if args.refreshIndexPath is not None:
+        refreshIndex = RefreshIndex(args.refreshIndexPath)
+    seen = createSeenSet(args.dedup_memory, args.bloom)
+    state = dict(count=0, totalTime=0.0)
+
+    def report(completed):
+        for task, result, error in completed:
+            state['count'] += 1
+            if error is not None:
+                print 'Error processing %s' % task.screenname
+                print getattr(error, 'response', error)
+                continue
+            objectId, elapsed = result
+            if objectIndex is not None and task.objectId is None:
+                objectIndex.add(task.screenname, objectId)
+            if store is not None:
+                store.record(task.screenname, task.values, time.time())
+            if refreshIndex is not None:
+                refreshIndex.record(task.screenname, time.time(), task.score)
+            elapsed += task.fetchTime
+            state['totalTime'] += elapsed
+            print 'Processed %d: %s (%.3f)' % (state['count'],
+                                               task.screenname, elapsed)
+
+    screennames = dedup(normalizeNames(readNames(sys.stdin)), seen=seen)
+
+    def recordFailure(name):
+        refreshIndex.recordFailure(name, time.time())
+
+    onFailure = recordFailure if refreshIndex is not None else None
+    profiles = fetchProfiles(peerindex, screennames, onFailure)
+    try:
+        for screenname, info, elapsed in profiles:
+            values = getTagValues(info, getUpdatedAt())
+            score = info.get('peerindex')
+            if store is not None:
+                values = store.getChangedValues(screenname, values,
+                                                time.time())
+                if not values:
+                    print 'Unchanged: %s' % screenname
+                    if refreshIndex is not None:
+                        refreshIndex.record(screenname, time.time(), score)
+                    continue
+            objectId = None
+            if objectIndex is not None:
+                objectId = objectIndex.get(screenname)
+            report(pool.submit(ImportTask(screenname, values, objectId,
+                                          score, elapsed)))
+    except (RateLimitError, CredentialsError, KeyboardInterrupt) as e:
+        print >>sys.stderr, 'Stopping: %r' % e
+    finally:
+        # Let the writers finish the profiles that have already been
+        # fetched before exiting.
+        report(pool.close())
+        seen.close()
+        if store is not None:
+            store.close()
+        if objectIndex is not None:
+            objectIndex.close()
+        if refreshIndex is not None:
+            refreshIndex.close()
+        if cache is not None:
+            cache.close()
+        if exporter is not None:
+            exporter.stop()
+    if state['count']:
+        av = state['totalTime'] / state['count']
+        print 'Average time per user: %.3f' % av
+    if cache is not None:
+        print 'Cache statistics: %r' % cache.getStats()
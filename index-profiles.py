@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+# See README.markdown for usage instructions.
+
+from argparse import ArgumentParser
+import logging
+
+from peerindex.offsets import OffsetIndex
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Index a file of JSON PeerIndex profiles by Twitter '
+                    'user, for import-json-data.py --names.')
+    parser.add_argument('path', metavar='PATH',
+                        help='The file of JSON profiles to index.')
+    parser.add_argument('--index', dest='indexPath',
+                        help='The index to create or update.  Defaults to '
+                             'PATH.index.')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Index the whole file again, such as after '
+                             'it has been replaced.')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)8s  %(message)s',
+                        level=logging.INFO)
+
+    index = OffsetIndex(args.indexPath or args.path + '.index')
+    try:
+        if args.rebuild:
+            index.clear()
+        count = index.update(args.path)
+    finally:
+        index.close()
+    logging.info('Indexed %d profiles' % count)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+# See README.markdown for usage instructions.
+
+from argparse import ArgumentParser
+import logging
+import sys
+
+from peerindex.archive import ArchiveWriter
+from peerindex.pipeline import readPaths, readProfiles
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Convert JSON PeerIndex profiles to a compact columnar '
+                    'archive.')
+    parser.add_argument('paths', metavar='PATH', nargs='*',
+                        help='Files to read, instead of stdin.')
+    parser.add_argument('--output', dest='outputPath', required=True,
+                        help='The archive to write.')
+    parser.add_argument('--block-size', type=int, default=65536,
+                        help='The number of profiles per block.')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)8s  %(message)s',
+                        level=logging.INFO)
+
+    count = 0
+    with open(args.outputPath, 'wb') as outputFile:
+        writer = ArchiveWriter(outputFile, blockSize=args.block_size)
+        try:
+            for profile in readPaths(args.paths, readProfiles):
+                writer.write(profile)
+                count += 1
+        except KeyboardInterrupt as e:
+            print >>sys.stderr, 'Stopping: %r' % e
+        finally:
+            writer.close()
+    logging.info('Archived %d profiles' % count)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# See README.markdown for usage instructions.
+
+from argparse import ArgumentParser
+import logging
+import os
+
+from peerindex.archive import ArchiveWriter
+from peerindex.names import createSeenSet
+from peerindex.output import ProfileWriter
+from peerindex.shard import mergeShards
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Merge the outputs of a sharded download.py run into one '
+                    'file, skipping repeated users.')
+    parser.add_argument('path', metavar='PATH',
+                        help='The OUTPUT_PATH given to each shard.')
+    parser.add_argument('count', metavar='N', type=int,
+                        help='The number of shards.')
+    parser.add_argument('outputPath', metavar='OUTPUT_PATH',
+                        help='The file to write the merged profiles to.')
+    parser.add_argument('--archive', action='store_true',
+                        help='Write a compact columnar archive instead of '
+                             'JSON.')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Compress JSON output with gzip.')
+    parser.add_argument('--dedup-memory', type=int, default=1000000,
+                        help='The number of users to remember in memory '
+                             'before spilling to disk.')
+    args = parser.parse_args()
+    if os.path.exists(args.outputPath):
+        parser.error('%s already exists.' % args.outputPath)
+    logging.basicConfig(format='%(asctime)s %(levelname)8s  %(message)s',
+                        level=logging.INFO)
+
+    seen = createSeenSet(args.dedup_memory)
+    profiles = mergeShards(args.path, args.count, seen=seen)
+    count = 0
+    if args.archive:
+        with open(args.outputPath, 'wb') as outputFile:
+            writer = ArchiveWriter(outputFile)
+            for profile in profiles:
+                writer.write(profile)
+                count += 1
+            writer.close()
+    else:
+        writer = ProfileWriter(args.outputPath, compress=args.gzip)
+        try:
+            for profile in profiles:
+                writer.write(profile)
+                count += 1
+        finally:
+            writer.close()
+    seen.close()
+    logging.info('Merged %d profiles from %d shards' % (count, args.count))
@@ -0,0 +1,326 @@
+"""A compact columnar archive of PeerIndex profiles.
+
+Profiles are stored in blocks of up to C{blockSize} records.  Within a
+block each profile key is stored as a column:
+
+  - integer and float scores, such as C{peerindex} and C{activity}, as
+    typed arrays, if every value in the column has the same type,
+  - strings, such as C{name} and C{url}, as indexes into a dictionary of
+    the distinct values in the block,
+  - lists of strings, such as C{topics}, as offsets into an array of
+    interned string IDs,
+  - anything else, including columns that mix integers and floats, as
+    dictionary-encoded JSON.
+
+Missing values are recorded in a presence array, so profiles are read back
+with exactly the keys they were written with.  Each block is compressed
+with C{zlib}.  An archive is written with L{ArchiveWriter} and read with
+L{readArchive}, or one column at a time with L{readArchiveColumns}::
+
+  with open('profiles.archive', 'wb') as outputFile:
+      writer = ArchiveWriter(outputFile)
+      for profile in profiles:
+          writer.write(profile)
+      writer.close()
+
+The file starts with L{ARCHIVE_MAGIC}, followed by blocks, each a 4-byte
+little-endian length and then the compressed block.  A block starts with a
+4-byte little-endian length and a JSON header describing its columns,
+followed by the column data.  Typed arrays are stored little-endian, and
+swapped on big-endian machines.
+"""
+
+from array import array
+from json import dumps, loads
+import struct
+import sys
+import zlib
+
+
+ARCHIVE_MAGIC = '\x89PIA\r\n\x1a\n'
+
+LENGTH = struct.Struct('<I')
+
+# Marks a value missing from a profile.
+MISSING = object()
+
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+
+def getColumnType(values):
+    """Choose the encoding for the present values of a column.
+
+    @param values: A C{list} of the values, without missing ones.
+    @return: C{'int'}, C{'float'}, C{'string'}, C{'strings'} or C{'json'}.
+    """
+    if all(isinstance(value, (int, long)) and
+           not isinstance(value, bool) and INT_MIN <= value <= INT_MAX
+           for value in values):
+        return 'int'
+    if all(isinstance(value, float) for value in values):
+        return 'float'
+    if all(isinstance(value, basestring) for value in values):
+        return 'string'
+    if all(isinstance(value, list) and
+           all(isinstance(item, basestring) for item in value)
+           for value in values):
+        return 'strings'
+    return 'json'
+
+
+def encodeColumn(values):
+    """Encode a column of values.
+
+    @param values: A C{list} of values, with C{MISSING} for missing ones.
+    @return: A C{(description, data)} 2-tuple, with a C{dict} describing the
+        column for the block header and a C{list} of C{str}s holding its
+        data.
+    """
+    present = [value for value in values if value is not MISSING]
+    columnType = getColumnType(present)
+    description = {'type': columnType}
+    data = []
+    if len(present) < len(values):
+        description['missing'] = True
+        data.append(array('B', [value is not MISSING for value in values])
+                    .tostring())
+    if columnType == 'int':
+        data.append(writeArray(array('i', present)))
+    elif columnType == 'float':
+        data.append(writeArray(array('d', present)))
+    elif columnType == 'strings':
+        dictionary, ids = {}, array('I')
+        offsets = array('I', [0])
+        for value in present:
+            for item in value:
+                ids.append(dictionary.setdefault(item, len(dictionary)))
+            offsets.append(len(ids))
+        description['dictionary'] = sorted(dictionary, key=dictionary.get)
+        description['items'] = len(ids)
+        data.extend([writeArray(offsets), writeArray(ids)])
+    else:
+        if columnType == 'json':
+            present = [dumps(value) for value in present]
+        dictionary, ids = {}, array('I')
+        for value in present:
+            ids.append(dictionary.setdefault(value, len(dictionary)))
+        description['dictionary'] = sorted(dictionary, key=dictionary.get)
+        data.append(writeArray(ids))
+    description['size'] = sum(len(chunk) for chunk in data)
+    return description, data
+
+
+def decodeColumn(description, data, count):
+    """Decode a column encoded by L{encodeColumn}.
+
+    @param description: The C{dict} describing the column.
+    @param data: The C{str} holding the column data.
+    @param count: The number of records in the block.
+    @return: A C{list} of values, with C{MISSING} for missing ones.
+    """
+    position = 0
+    presence = None
+    if description.get('missing'):
+        presence = data[:count]
+        position = count
+        present = presence.count('\x01')
+    else:
+        present = count
+    columnType = description['type']
+    if columnType == 'int':
+        values = readArray('i', data, position, present).tolist()
+    elif columnType == 'float':
+        values = readArray('d', data, position, present).tolist()
+    elif columnType == 'strings':
+        offsets = readArray('I', data, position, present + 1)
+        position += len(offsets) * offsets.itemsize
+        ids = readArray('I', data, position, description['items'])
+        dictionary = description['dictionary']
+        values = [[dictionary[id] for id in ids[offsets[i]:offsets[i + 1]]]
+                  for i in xrange(present)]
+    else:
+        dictionary = description['dictionary']
+        if columnType == 'json':
+            dictionary = [loads(value) for value in dictionary]
+        values = [dictionary[id]
+                  for id in readArray('I', data, position, present)]
+    if presence is None:
+        return values
+    values = iter(values)
+    return [next(values) if flag == '\x01' else MISSING
+            for flag in presence]
+
+
+def writeArray(values):
+    """Convert a typed array to little-endian bytes.
+
+    @param values: The C{array} to convert.  It isn't changed.
+    @return: A C{str}.
+    """
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+
+def readArray(typecode, data, position, length):
+    """Read a little-endian typed array from a C{str}.
+
+    @param typecode: The C{array} type code.
+    @param data: The C{str} to read from.
+    @param position: The offset of the array in C{data}.
+    @param length: The number of items in the array.
+    @return: An C{array}.
+    """
+    values = array(typecode)
+    values.fromstring(data[position:position + length * values.itemsize])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def encodeBlock(profiles):
+    """Encode a block of profiles.
+
+    @param profiles: A C{list} of profile C{dict}s.
+    @return: The compressed block, without its length prefix.
+    """
+    names = []
+    for profile in profiles:
+        for name in profile:
+            if name not in names:
+                names.append(name)
+    columns = []
+    chunks = []
+    for name in names:
+        description, data = encodeColumn(
+            [profile.get(name, MISSING) for profile in profiles])
+        description['name'] = name
+        columns.append(description)
+        chunks.extend(data)
+    header = dumps({'count': len(profiles), 'columns': columns})
+    return zlib.compress(LENGTH.pack(len(header)) + header + ''.join(chunks))
+
+
+def decodeBlock(block, names=None):
+    """Decode the columns of a block.
+
+    @param block: The compressed block.
+    @param names: Optionally, the names of the columns to decode.  Defaults
+        to all of them.
+    @return: A C{(count, columns)} 2-tuple, where C{columns} is a C{list} of
+        C{(name, values)} 2-tuples.
+    """
+    payload = zlib.decompress(block)
+    headerLength = LENGTH.unpack_from(payload)[0]
+    position = LENGTH.size + headerLength
+    header = loads(payload[LENGTH.size:position])
+    count = header['count']
+    columns = []
+    for description in header['columns']:
+        size = description['size']
+        if names is None or description['name'] in names:
+            values = decodeColumn(description,
+                                  payload[position:position + size], count)
+            columns.append((description['name'], values))
+        position += size
+    return count, columns
+
+
+def readBlocks(inputFile, skipMagic=False):
+    """Read the compressed blocks of an archive.
+
+    A truncated block at the end of the file is ignored.
+
+    @param inputFile: The file-like object to read from.
+    @param skipMagic: Optionally, a flag indicating that L{ARCHIVE_MAGIC}
+        has already been read from the file.
+    @raise ValueError: Raised if the file isn't an archive.
+    @return: A generator that yields compressed blocks.
+    """
+    if not skipMagic and inputFile.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+        raise ValueError('Not a profile archive.')
+    while True:
+        prefix = inputFile.read(LENGTH.size)
+        if len(prefix) < LENGTH.size:
+            return
+        length = LENGTH.unpack(prefix)[0]
+        block = inputFile.read(length)
+        if len(block) < length:
+            return
+        yield block
+
+
+def readArchive(inputFile, skipMagic=False):
+    """Read the profiles in an archive.
+
+    @param inputFile: The file-like object to read from.
+    @param skipMagic: Optionally, a flag indicating that L{ARCHIVE_MAGIC}
+        has already been read from the file.
+    @raise ValueError: Raised if the file isn't an archive.
+    @return: A generator that yields profile C{dict}s, in the order they
+        were written.
+    """
+    for block in readBlocks(inputFile, skipMagic):
+        count, columns = decodeBlock(block)
+        profiles = [{} for i in xrange(count)]
+        for name, values in columns:
+            for profile, value in zip(profiles, values):
+                if value is not MISSING:
+                    profile[name] = value
+        for profile in profiles:
+            yield profile
+
+
+def readArchiveColumns(inputFile, names):
+    """Read only some columns of an archive, without building profiles.
+
+    @param inputFile: The file-like object to read from.
+    @param names: The names of the columns to read.
+    @raise ValueError: Raised if the file isn't an archive.
+    @return: A generator that yields a C{dict} for each block, mapping each
+        column name to a C{list} of values, with C{None} for missing values.
+    """
+    for block in readBlocks(inputFile):
+        count, columns = decodeBlock(block, names)
+        result = dict((name, [None] * count) for name in names)
+        for name, values in columns:
+            result[name] = [None if value is MISSING else value
+                            for value in values]
+        yield result
+
+
+class ArchiveWriter(object):
+    """Write profiles to an archive.
+
+    @param outputFile: The file-like object to write to.
+    @param blockSize: Optionally, the number of profiles per block.  Larger
+        blocks compress better but use more memory.  Defaults to 65536.
+    """
+
+    def __init__(self, outputFile, blockSize=65536):
+        self._outputFile = outputFile
+        self._blockSize = blockSize
+        self._profiles = []
+        outputFile.write(ARCHIVE_MAGIC)
+
+    def write(self, profile):
+        """Add a profile, writing a block if it's full.
+
+        @param profile: The profile C{dict}.
+        """
+        self._profiles.append(profile)
+        if len(self._profiles) >= self._blockSize:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered profiles as a block."""
+        if self._profiles:
+            block = encodeBlock(self._profiles)
+            self._outputFile.write(LENGTH.pack(len(block)) + block)
+            self._profiles = []
+
+    def close(self):
+        """Write any buffered profiles.  The file isn't closed."""
+        self.flush()
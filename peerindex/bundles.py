@@ -0,0 +1,241 @@
+"""Bundles of Fluidinfo writes, prepared offline and replayed later.
+
+Writing to Fluidinfo while profiles are fetched or parsed ties the speed of
+the whole import to Fluidinfo.  L{BundleWriter} has the same interface as
+L{BatchWriter}, but instead of writing each batch it saves the C{values}
+C{PUT} payload to a compressed bundle file in a directory::
+
+  writer = BundleWriter('bundles', bundleSize=100)
+  for result in writeFluidinfo(writer, mapTags(profiles)):
+      ...
+
+The bundles are written to Fluidinfo later, whenever it has capacity, with
+L{replayBundles}.  Each bundle written successfully is recorded in a
+L{ReplayLog}, so an interrupted replay can be run again and only sends the
+bundles that weren't written.  Writing the same tag values twice has no
+further effect, so a bundle that was written just before an interruption,
+but not yet logged, is safe to send again.
+
+Bundles are named after the time their writer started, a random writer ID
+and a sequence number, such as::
+
+  bundle-20111019T142503-3f2a9c1e-000001.json.gz
+
+so the bundles of several exports, even concurrent ones, never share a name
+and a bundle isn't mistaken for one that was replayed and deleted.  Each is
+written to a temporary file and linked to its name, so a bundle is never
+replayed half written and an existing bundle is never replaced.
+"""
+
+from gzip import GzipFile
+from json import dumps, loads
+import os
+import re
+import time
+from uuid import uuid4
+
+from peerindex.fluidinfo import WriteResult
+
+
+BUNDLE_PATTERN = re.compile(
+    r'^bundle-(\d{8}T\d{6})-([0-9a-f]+)-(\d+)\.json\.gz$')
+
+
+def getBundlePaths(directory):
+    """Get the paths of the bundles in a directory.
+
+    @param directory: The directory bundles were written to.
+    @return: A C{list} of paths, in the order the bundles were written.
+    """
+    bundles = []
+    for filename in os.listdir(directory):
+        match = BUNDLE_PATTERN.match(filename)
+        if match is not None:
+            started, writerID, number = match.groups()
+            bundles.append((started, writerID, int(number),
+                            os.path.join(directory, filename)))
+    return [bundle[-1] for bundle in sorted(bundles)]
+
+
+def readBundle(path):
+    """Read the queries and tag values in a bundle.
+
+    @param path: The path of the bundle.
+    @return: A C{list} of C{[query, values]} pairs, as sent in a C{values}
+        C{PUT}.
+    """
+    with open(path, 'rb') as bundleFile:
+        return loads(GzipFile(fileobj=bundleFile).read())['queries']
+
+
+class BundleWriter(object):
+    """Save batches of tag values to bundle files instead of writing them.
+
+    Bundle names include the time the writer was created and a random ID,
+    so several runs can export to the same directory, one after the other
+    or at the same time.
+
+    @param directory: The directory to write bundles to.  It's created if it
+        doesn't exist.
+    @param bundleSize: Optionally, the number of objects per bundle.  It's
+        the number of objects written by each C{PUT} when the bundle is
+        replayed.  Defaults to 100.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @ivar bundles: The number of bundles written.
+    """
+
+    def __init__(self, directory, bundleSize=100, timeModule=None):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._bundleSize = bundleSize
+        self._timeModule = timeModule or time
+        self._batch = []
+        self._prefix = 'bundle-%s-%s' % (
+            time.strftime('%Y%m%dT%H%M%S',
+                          time.gmtime(self._timeModule.time())),
+            uuid4().hex[:8])
+        self._number = 0
+        self.bundles = 0
+
+    def add(self, key, query, values):
+        """Add an object to the current bundle, writing it if it's full.
+
+        @param key: A value identifying the object in L{WriteResult}s, such
+            as the screen name of the Twitter user.
+        @param query: The Fluidinfo query matching the object.
+        @param values: The tag values to write, as returned by
+            L{getTagValues}.
+        @return: A C{list} of L{WriteResult}s for any objects saved.
+        """
+        self._batch.append((key, query, values))
+        if len(self._batch) >= self._bundleSize:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Save the objects in the current bundle.
+
+        @return: A C{list} of L{WriteResult}s, in the order the objects were
+            added.
+        """
+        batch, self._batch = self._batch, []
+        if not batch:
+            return []
+        start = self._timeModule.time()
+        self._number += 1
+        path = os.path.join(self._directory, '%s-%06d.json.gz'
+                            % (self._prefix, self._number))
+        temporaryPath = path + '.tmp'
+        descriptor = os.open(temporaryPath,
+                             os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0644)
+        with os.fdopen(descriptor, 'wb') as bundleFile:
+            compressedFile = GzipFile(fileobj=bundleFile, mode='wb')
+            compressedFile.write(dumps(
+                {'queries': [[query, values]
+                             for key, query, values in batch]},
+                separators=(',', ':')))
+            compressedFile.close()
+            bundleFile.flush()
+            os.fsync(bundleFile.fileno())
+        try:
+            os.link(temporaryPath, path)
+        finally:
+            os.unlink(temporaryPath)
+        self.bundles += 1
+        elapsed = self._timeModule.time() - start
+        return [WriteResult(key, None, elapsed / len(batch))
+                for key, query, values in batch]
+
+    def sync(self):
+        """Save the objects in the current bundle.
+
+        @return: A C{list} of L{WriteResult}s, in the order the objects were
+            added.
+        """
+        return self.flush()
+
+    def close(self):
+        """Save any remaining objects.
+
+        @return: A C{list} of L{WriteResult}s, in the order the objects were
+            added.
+        """
+        return self.flush()
+
+
+class ReplayLog(object):
+    """A file listing the bundles that have been written to Fluidinfo.
+
+    @param path: The path of the log.  It's created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self._replayed = set()
+        if os.path.exists(path):
+            with open(path) as logFile:
+                self._replayed.update(line.strip() for line in logFile)
+        self._file = open(path, 'a')
+
+    def __contains__(self, path):
+        return os.path.basename(path) in self._replayed
+
+    def add(self, path):
+        """Record that a bundle has been written, syncing the log to disk.
+
+        @param path: The path of the bundle.
+        """
+        filename = os.path.basename(path)
+        self._replayed.add(filename)
+        self._file.write(filename + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Close the log."""
+        self._file.close()
+
+
+def writeBundle(fdb, path):
+    """Write the tag values in a bundle to Fluidinfo with a single request.
+
+    This is suitable for use as the function of a L{WriterPool}.
+
+    @param fdb: The C{fom.session.Fluid} session to write with.
+    @param path: The path of the bundle.
+    @raise FluidError: Raised if the bundle can't be written.
+    @return: The number of objects written.
+    """
+    queries = readBundle(path)
+    fdb.values('PUT', payload={'queries': queries})
+    return len(queries)
+
+
+def replayBundles(pool, paths, log):
+    """Write bundles to Fluidinfo, skipping those already written.
+
+    Bundles that are written successfully are added to the log.  Bundles
+    that fail aren't, so they're sent again by the next replay.  The pool
+    is closed once all the bundles have been submitted.
+
+    @param pool: The L{WriterPool} to write with, using L{writeBundle}.
+    @param paths: An iterable of bundle paths, as returned by
+        L{getBundlePaths}.
+    @param log: The L{ReplayLog} recording the bundles written.
+    @return: A generator that yields a C{(path, count, error)} 3-tuple for
+        each bundle as it completes, where C{count} is the number of objects
+        written and C{error} is the exception raised, or C{None}.
+    """
+    def record(completed):
+        for path, count, error in completed:
+            if error is None:
+                log.add(path)
+        return completed
+
+    for path in paths:
+        if path not in log:
+            for result in record(pool.submit(path)):
+                yield result
+    for result in record(pool.close()):
+        yield result
@@ -0,0 +1,174 @@
+"""A persistent cache of PeerIndex API responses.
+
+The PeerIndex API allows a limited number of calls per day, so fetching the
+same profile twice wastes quota.  A L{ResponseCache} can be passed to
+L{PeerIndex} to reuse profiles fetched recently::
+
+  cache = ResponseCache('responses.db', ttl=24 * 60 * 60)
+  peerindex = PeerIndex('your-api-key', cache=cache)
+
+Users unknown to PeerIndex are cached too, with a separate time to live, so
+L{UnknownUserError} is raised again without making a call.
+"""
+
+from json import dumps, loads
+import sqlite3
+from threading import Lock
+import time
+
+from peerindex.names import normalizeName
+
+
+class ResponseCache(object):
+    """An SQLite cache of PeerIndex profiles, keyed by normalized name.
+
+    When the cache holds more than C{maxEntries} responses the least
+    recently used are evicted.  The access times of cache hits are kept in
+    memory and written in batches, so a hit doesn't cost a write to disk.
+
+    @param path: The path to the SQLite database file.  It's created if it
+        doesn't exist.
+    @param ttl: Optionally, the number of seconds a profile is cached for.
+        Defaults to one day.
+    @param negativeTTL: Optionally, the number of seconds an unknown user is
+        cached for.  Defaults to one week.
+    @param maxEntries: Optionally, the maximum number of responses to keep.
+        Defaults to 1,000,000.
+    @param touchEvery: Optionally, the number of hits whose access times
+        are written together.  Defaults to 100.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @ivar hits: The number of lookups that found a cached profile.
+    @ivar negativeHits: The number of lookups that found a cached unknown
+        user.
+    @ivar misses: The number of lookups that found nothing, or an expired
+        response.
+    @ivar evictions: The number of responses evicted to stay within
+        C{maxEntries}.
+    """
+
+    def __init__(self, path, ttl=24 * 60 * 60, negativeTTL=7 * 24 * 60 * 60,
+                 maxEntries=1000000, touchEvery=100, timeModule=None):
+        self._connection = sqlite3.connect(path, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'name TEXT PRIMARY KEY, result TEXT, stored_at REAL, '
+            'accessed_at REAL)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed_at '
+            'ON responses (accessed_at)')
+        self._lock = Lock()
+        self._ttl = ttl
+        self._negativeTTL = negativeTTL
+        self._maxEntries = maxEntries
+        self._touchEvery = touchEvery
+        self._touched = {}
+        self._timeModule = timeModule or time
+        self._size = self._connection.execute(
+            'SELECT COUNT(*) FROM responses').fetchone()[0]
+        self.hits = 0
+        self.negativeHits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name):
+        """Look up the cached response for a user.
+
+        @param name: The screen name of the Twitter user.
+        @return: A C{(found, result)} 2-tuple.  C{found} is C{False} if
+            nothing valid is cached.  Otherwise C{result} is the cached
+            profile C{dict}, or C{None} if the user is unknown.
+        """
+        name = normalizeName(name)
+        now = self._timeModule.time()
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT result, stored_at FROM responses WHERE name = ?',
+                (name,)).fetchone()
+            if row is not None:
+                result, storedAt = row
+                ttl = self._negativeTTL if result is None else self._ttl
+                if now - storedAt < ttl:
+                    self._touched[name] = now
+                    if len(self._touched) >= self._touchEvery:
+                        self._writeTouches()
+                    if result is None:
+                        self.negativeHits += 1
+                        return True, None
+                    self.hits += 1
+                    return True, loads(result)
+            self.misses += 1
+            return False, None
+
+    def put(self, name, result):
+        """Cache a profile.
+
+        @param name: The screen name of the Twitter user.
+        @param result: The profile C{dict} returned by the API.
+        """
+        self._store(name, dumps(result))
+
+    def putUnknown(self, name):
+        """Cache the fact that PeerIndex doesn't know about a user.
+
+        @param name: The screen name of the Twitter user.
+        """
+        self._store(name, None)
+
+    def getStats(self):
+        """Get the cache counters.
+
+        @return: A C{dict} with C{hits}, C{negativeHits}, C{misses},
+            C{evictions} and C{size} keys.
+        """
+        return {'hits': self.hits, 'negativeHits': self.negativeHits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'size': self._size}
+
+    def close(self):
+        """Write the access times of recent hits and close the database."""
+        with self._lock:
+            self._writeTouches()
+            self._connection.close()
+
+    def _store(self, name, result):
+        """Store a response and evict old ones if the cache is full."""
+        name = normalizeName(name)
+        now = self._timeModule.time()
+        with self._lock:
+            self._touched.pop(name, None)
+            cursor = self._connection.execute(
+                'UPDATE responses SET result = ?, stored_at = ?, '
+                'accessed_at = ? WHERE name = ?', (result, now, now, name))
+            if cursor.rowcount == 0:
+                self._connection.execute(
+                    'INSERT INTO responses VALUES (?, ?, ?, ?)',
+                    (name, result, now, now))
+                self._size += 1
+            if self._size > self._maxEntries:
+                self._evict(self._size - self._maxEntries)
+
+    def _writeTouches(self):
+        """Write the access times of recent hits in one transaction."""
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        self._connection.execute('BEGIN')
+        self._connection.executemany(
+            'UPDATE responses SET accessed_at = ? WHERE name = ?',
+            [(accessedAt, name) for name, accessedAt in touched.iteritems()])
+        self._connection.execute('COMMIT')
+
+    def _evict(self, count):
+        """Evict the least recently used responses.
+
+        @param count: The number of responses to evict.
+        """
+        self._writeTouches()
+        self._connection.execute(
+            'DELETE FROM responses WHERE name IN ('
+            'SELECT name FROM responses ORDER BY accessed_at LIMIT ?)',
+            (count,))
+        self._size -= count
+        self.evictions += count
@@ -11,14 +11,19 @@ The C{dict} returned by this method includes the keys described here:
   http://dev.peerindex.com/docs/profile/show
 
 The PeerIndex API has a one call per second rate limit.  Calls to
-L{PeerIndex.get} will sleep to ensure this limit is honoured.
+L{PeerIndex.get} will sleep to ensure this limit is honoured.  A
+L{QuotaScheduler} can be passed to also honour the daily quota reported by
+the API, and a L{ResponseCache} can be passed to avoid spending quota on
+profiles that were fetched recently.
 """
 
 from json import loads
-import time
 
 from httplib2 import Http
 
+from peerindex.metrics import Metrics
+from peerindex.ratelimit import TokenBucket
+
 
 class PeerIndexError(Exception):
     """Raised if an error occurs while interacting with the PeerIndex API."""
@@ -36,6 +41,65 @@ class UnknownUserError(PeerIndexError):
     """Raised if a request for an unknown user is made."""
 
 
+BASE_URL = 'http://api.peerindex.net/1'
+
+ERRORS = {'Rate limit exceeded': RateLimitError,
+          'Invalid API key': CredentialsError}
+
+
+def stripName(name):
+    """Prepare a Twitter screen name for use in a PeerIndex API call.
+
+    Surrounding whitespace and a leading C{@} sign are removed, since passing
+    either to the API results in a 404 or strange behaviour.
+
+    @param name: The screen name of the Twitter user.
+    @return: The stripped screen name.
+    """
+    name = name.strip()
+    if name.startswith('@'):
+        name = name[1:]
+    return name
+
+
+def getProfileURI(name, key, baseURL=BASE_URL):
+    """Get the URI for a C{profile/show} call.
+
+    @param name: The stripped screen name of the Twitter user.
+    @param key: The API key to use.
+    @param baseURL: Optionally, the base URL of the PeerIndex API.
+    @return: The URI to request.
+    """
+    return ('%s/profile/show.json?id=%s&api_key=%s'
+            % (baseURL, name, key))
+
+
+def parseResponse(name, headers, contents):
+    """Convert a C{profile/show} response into a result or an error.
+
+    @param name: The stripped screen name of the Twitter user.
+    @param headers: The C{httplib2}-style response headers, including the
+        C{status} key.
+    @param contents: The body of the response.
+    @raise RateLimitError: Raised if the rate limit has been exceeded.
+    @raise CredentialsError: Raised if an invalid API key is used.
+    @raise UnknownUserError: Raised if information about the specified
+        Twitter user isn't available.
+    @raise PeerIndexError: Raised for any other type of error.
+    @return: A C{dict} representing data about the user.
+    """
+    if headers['status'] == '400' or headers['status'] == '403':
+        message = loads(contents)['error']
+        exceptionClass = ERRORS.get(message, PeerIndexError)
+        raise exceptionClass(message)
+    elif headers['status'] == '404' or '404 Not Found' in contents:
+        raise UnknownUserError(name)
+    elif headers['status'] != '200':
+        raise PeerIndexError('%s: %s' % (headers, contents))
+    else:
+        return loads(contents)
+
+
 class PeerIndex(object):
     """A client for the PeerIndex API.
 
@@ -44,23 +108,36 @@ class PeerIndex(object):
         used for testing purposes.
     @param timeModule: Optionally, a C{time}-compatible module object.  It's
         used for testing purposes.
+    @param limiter: Optionally, the L{Limiter} to use.  Defaults to a
+        L{TokenBucket} that allows one call per second.
+    @param cache: Optionally, a L{ResponseCache} used to avoid fetching
+        recently fetched profiles again.
+    @param baseURL: Optionally, the base URL of the PeerIndex API, such as
+        the URL of a local stand-in used for benchmarking.
+    @param metrics: Optionally, the L{Metrics} to record the time spent
+        fetching, decoding and sleeping, and errors, in.
     """
 
-    errors = {'Rate limit exceeded': RateLimitError,
-              'Invalid API key': CredentialsError}
+    errors = ERRORS
 
-    def __init__(self, key, client=None, timeModule=None):
+    def __init__(self, key, client=None, timeModule=None, limiter=None,
+                 cache=None, baseURL=BASE_URL, metrics=None):
         self._key = key
+        self._baseURL = baseURL
+        self._metrics = metrics or Metrics(timeModule)
         self._client = client or Http()
-        self._timeModule = timeModule or time
-        self._lastCallTime = None
+        self._limiter = limiter or TokenBucket(timeModule=timeModule)
+        self._cache = cache
 
     def get(self, name):
         """Get the PeerIndex profile for a Twitter user.
 
         The PeerIndex API has a rate limit of one call per second and a
         maximum of 10000 calls per day.  This method will invoke C{time.sleep}
-        to ensure the per second limit isn't exceeded.
+        to ensure the per second limit isn't exceeded.  If the limiter
+        supports it, the call will also sleep until the daily quota resets
+        instead of raising L{RateLimitError}.  If a cache is used, cached
+        profiles and unknown users are returned without making a call.
 
         @param name: The screen name of the Twitter user.
         @raise RateLimitError: Raised if the rate limit has been exceeded.
@@ -72,34 +149,43 @@ class PeerIndex(object):
             docs<http://dev.peerindex.com/docs/profile/show>} for information
             about the returned keys.
         """
-        name = name.strip()
-        if name.startswith('@'):
-            name = name[1:]
-
-        self._limitCallRate()
-        uri = ('http://api.peerindex.net/1/profile/show.json?'
-               'id=%s&api_key=%s' % (name, self._key))
-        headers, contents = self._client.request(uri)
-        if headers['status'] == '400' or headers['status'] == '403':
-            message = loads(contents)['error']
-            exceptionClass = self.errors.get(message, PeerIndexError)
-            raise exceptionClass(message)
-        elif headers['status'] == '404' or '404 Not Found' in contents:
-            raise UnknownUserError(name)
-        elif headers['status'] != '200':
-            raise PeerIndexError('%s: %s' % (headers, contents))
-        else:
-            return loads(contents)
-
-    def _limitCallRate(self):
-        """Ensure we don't exceed one call per second.
-
-        If this is the first API call, nothing is done, otherwise, a sleep
-        will be performed to ensure we don't exceed the one call per second
-        rate limit.
+        name = stripName(name)
+        if self._cache is not None:
+            found, result = self._cache.get(name)
+            if found:
+                if result is None:
+                    raise UnknownUserError(name)
+                return result
+        try:
+            result = self._fetch(name)
+        except UnknownUserError:
+            if self._cache is not None:
+                self._cache.putUnknown(name)
+            raise
+        if self._cache is not None:
+            self._cache.put(name, result)
+        return result
+
+    def _fetch(self, name):
+        """Make a C{profile/show} call, honouring the rate limit.
+
+        @param name: The stripped screen name of the Twitter user.
+        @return: A C{dict} representing data about the user.
         """
-        if self._lastCallTime is not None:
-            delta = self._timeModule.time() - self._lastCallTime
-            if delta < 1.0:
-                self._timeModule.sleep(1.0 - delta)
-        self._lastCallTime = self._timeModule.time()
+        uri = getProfileURI(name, self._key, self._baseURL)
+        metrics = self._metrics
+        while True:
+            metrics.observe('sleep', self._limiter.wait())
+            with metrics.time('fetch'):
+                headers, contents = self._client.request(uri)
+            self._limiter.update(headers)
+            try:
+                with metrics.time('decode'):
+                    return parseResponse(name, headers, contents)
+            except RateLimitError as error:
+                metrics.countError(error)
+                if not self._limiter.exhausted():
+                    raise
+            except PeerIndexError as error:
+                metrics.countError(error)
+                raise
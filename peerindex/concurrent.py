@@ -0,0 +1,155 @@
+"""An asynchronous client for the PeerIndex API.
+
+L{ConcurrentPeerIndex} has the same interface as L{PeerIndex}, except that
+L{ConcurrentPeerIndex.get} returns a C{Deferred}::
+
+  peerindex = ConcurrentPeerIndex('your-api-key')
+  deferred = peerindex.get('twitter-user')
+
+Several requests can be in flight at once.  The one call per second rate
+limit is enforced on the time each request is started, so a slow response
+doesn't delay the next call.  Any L{Limiter} can be used to schedule calls,
+as long as it's given a time module backed by the reactor, such as
+L{ClockTimeModule}.
+"""
+
+from twisted.internet.defer import DeferredSemaphore, fail, succeed
+from twisted.internet.task import deferLater
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+
+from peerindex.client import (
+    BASE_URL, RateLimitError, UnknownUserError, getProfileURI, parseResponse,
+    stripName)
+from peerindex.ratelimit import TokenBucket
+
+
+class AgentClient(object):
+    """An HTTP client that returns C{httplib2}-style results in C{Deferred}s.
+
+    @param reactor: The reactor to use when making requests.
+    @param maxConnections: Optionally, the maximum number of persistent
+        connections to keep open per host.  Defaults to 4.
+    """
+
+    def __init__(self, reactor, maxConnections=4):
+        pool = HTTPConnectionPool(reactor, persistent=True)
+        pool.maxPersistentPerHost = maxConnections
+        self._agent = Agent(reactor, pool=pool)
+
+    def request(self, uri):
+        """Make a C{GET} request.
+
+        @param uri: The URI to request.
+        @return: A C{Deferred} that fires with a C{(headers, contents)}
+            2-tuple.  The headers are a C{dict} with lowercase header names
+            and an extra C{status} key, as returned by C{httplib2.Http}.
+        """
+        deferred = self._agent.request('GET', uri)
+        deferred.addCallback(self._readResponse)
+        return deferred
+
+    def _readResponse(self, response):
+        """Read the body of a response and convert its headers."""
+        headers = dict((name.lower(), values[-1])
+                       for name, values in response.headers.getAllRawHeaders())
+        headers['status'] = str(response.code)
+        deferred = readBody(response)
+        deferred.addCallback(lambda contents: (headers, contents))
+        return deferred
+
+
+class ClockTimeModule(object):
+    """A C{time}-compatible module object backed by an C{IReactorTime}.
+
+    Only the C{time} function is provided, since limiters used with
+    L{ConcurrentPeerIndex} never sleep.
+
+    @param clock: The C{IReactorTime} provider to use.
+    """
+
+    def __init__(self, clock):
+        self._clock = clock
+
+    def time(self):
+        """Get the current time."""
+        return self._clock.seconds()
+
+
+class ConcurrentPeerIndex(object):
+    """An asynchronous client for the PeerIndex API.
+
+    @param key: The API key to use when making requests to PeerIndex.
+    @param client: Optionally, an object with a C{request(uri)} method that
+        returns a C{Deferred} firing with C{(headers, contents)}.  Defaults
+        to an L{AgentClient}.
+    @param clock: Optionally, an C{IReactorTime} provider used to schedule
+        calls.  Defaults to the global reactor.  It's used for testing
+        purposes.
+    @param maxConcurrency: Optionally, the maximum number of requests in
+        flight at once.  Defaults to 4.
+    @param limiter: Optionally, the L{Limiter} used to schedule the start of
+        each request.  Defaults to a L{TokenBucket} that allows one call per
+        second.
+    @param cache: Optionally, a L{ResponseCache} used to avoid fetching
+        recently fetched profiles again.
+    @param baseURL: Optionally, the base URL of the PeerIndex API.
+    """
+
+    def __init__(self, key, client=None, clock=None, maxConcurrency=4,
+                 limiter=None, cache=None, baseURL=BASE_URL):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._key = key
+        self._baseURL = baseURL
+        self._client = client or AgentClient(clock, maxConcurrency)
+        self._clock = clock
+        self._semaphore = DeferredSemaphore(maxConcurrency)
+        self._limiter = limiter or TokenBucket(
+            timeModule=ClockTimeModule(clock))
+        self._cache = cache
+
+    def get(self, name):
+        """Get the PeerIndex profile for a Twitter user.
+
+        @param name: The screen name of the Twitter user.
+        @return: A C{Deferred} that fires with a C{dict} representing data
+            about the user, or errbacks with one of the L{PeerIndexError}
+            subclasses raised by L{PeerIndex.get}.
+        """
+        name = stripName(name)
+        if self._cache is not None:
+            found, result = self._cache.get(name)
+            if found:
+                if result is None:
+                    return fail(UnknownUserError(name))
+                return succeed(result)
+        return self._semaphore.run(self._get, name)
+
+    def _get(self, name):
+        """Wait for the next free call slot and then make the request."""
+        uri = getProfileURI(name, self._key, self._baseURL)
+        deferred = deferLater(self._clock, self._limiter.reserve(),
+                              self._client.request, uri)
+        deferred.addCallback(self._parseResponse, name)
+        return deferred
+
+    def _parseResponse(self, result, name):
+        """
+        Convert a response into a result or an error, retrying the call if
+        the quota is exhausted and the limiter will pause until it resets.
+        """
+        headers, contents = result
+        self._limiter.update(headers)
+        try:
+            result = parseResponse(name, headers, contents)
+        except RateLimitError:
+            if not self._limiter.exhausted():
+                raise
+            return self._get(name)
+        except UnknownUserError:
+            if self._cache is not None:
+                self._cache.putUnknown(name)
+            raise
+        if self._cache is not None:
+            self._cache.put(name, result)
+        return result
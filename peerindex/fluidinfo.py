@@ -0,0 +1,423 @@
+"""Helpers for writing PeerIndex profiles to Fluidinfo.
+
+Each profile is stored on the Fluidinfo object about the lowercase screen
+name of the Twitter user, preceded by an C{@} sign, using the tags in the
+C{peerindex.com} namespace listed in the README.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+from Queue import Queue
+from threading import Thread
+import time
+
+from fom.errors import FluidError
+
+from peerindex.metrics import Metrics
+
+
+TAGS = ('activity', 'audience', 'authority', 'peerindex', 'realness', 'name',
+        'slug', 'url', 'topics')
+
+
+def getAbout(screenname):
+    """Get the about tag value of the object for a Twitter user.
+
+    @param screenname: The screen name of the Twitter user.
+    @return: The about tag value.
+    """
+    return '@%s' % screenname.lower()
+
+
+def getAboutQuery(screenname):
+    """Get a Fluidinfo query matching the object for a Twitter user.
+
+    @param screenname: The screen name of the Twitter user.
+    @return: The query.
+    """
+    return 'fluiddb/about="%s"' % getAbout(screenname)
+
+
+def getUpdatedAt():
+    """Get the value to store in the C{peerindex.com/updated-at} tag.
+
+    @return: The current UTC time as a C{float} number of seconds from the
+        epoch.
+    """
+    return time.mktime(datetime.utcnow().timetuple())
+
+
+def getTagValues(info, updatedAt):
+    """Get the Fluidinfo tag values for a PeerIndex profile.
+
+    @param info: The C{dict} returned by the PeerIndex API.
+    @param updatedAt: The value for the C{peerindex.com/updated-at} tag.
+    @return: A C{dict} mapping tag paths to C{{'value': ...}} C{dict}s,
+        suitable for passing to C{values.put}.  Keys missing from the profile
+        are left out.
+    """
+    values = {
+        'peerindex.com/updated-at': {'value': updatedAt},
+        }
+    for var in TAGS:
+        try:
+            values['peerindex.com/%s' % var] = {'value': info[var]}
+        except KeyError:
+            pass
+    return values
+
+
+def writeProfile(fdb, screenname, values, metrics=None, objectId=None):
+    """Create the object for a Twitter user and write its tag values.
+
+    @param fdb: The C{fom.session.Fluid} session to write with.
+    @param screenname: The screen name of the Twitter user.
+    @param values: The tag values to write, as returned by L{getTagValues}.
+    @param metrics: Optionally, the L{Metrics} to record the time spent in
+        the C{post} and C{put} requests, and errors, in.
+    @param objectId: Optionally, the ID of the object, if it's already
+        known.  The object isn't created if it's given.
+    @raise FluidError: Raised if the object can't be created or written.
+    @return: The ID of the object.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    try:
+        if objectId is None:
+            with metrics.time('post'):
+                response = fdb.objects.post(about=getAbout(screenname))
+            objectId = response.value['id']
+        with metrics.time('put'):
+            fdb.values.put(query='fluiddb/id="%s"' % objectId, values=values)
+    except FluidError as error:
+        metrics.countError(error)
+        raise
+    return objectId
+
+
+class WriteResult(namedtuple('WriteResult', ['key', 'error', 'elapsed'])):
+    """The result of writing the tag values for an object.
+
+    @ivar key: The key passed to L{BatchWriter.add}.
+    @ivar error: The C{FluidError} raised while writing, or C{None} if the
+        write succeeded.
+    @ivar elapsed: The number of seconds spent writing the object.  For a
+        batch, the elapsed time is shared evenly between its objects.
+    """
+
+    __slots__ = ()
+
+
+class BatchWriter(object):
+    """Write tag values for many objects with a single C{values} PUT.
+
+    Fluidinfo's C{/values} endpoint accepts a list of queries, each with its
+    own tag values, in one request.  Objects are buffered until a batch is
+    full and then written together.  If a batch fails, each of its objects
+    is written individually, so one bad object only affects itself.
+
+    The batch size can adapt to the observed latency: it's doubled while
+    batches complete in less than half the target latency, and halved when
+    they take longer than the target.
+
+    @param fdb: The C{fom.session.Fluid} session to write with.
+    @param batchSize: Optionally, the initial number of objects per batch.
+        Defaults to 50.
+    @param maxBatchSize: Optionally, the largest batch size to adapt to.
+        Defaults to C{batchSize}, which disables adaptation.
+    @param minBatchSize: Optionally, the smallest batch size to adapt to.
+        Defaults to 1.
+    @param targetLatency: Optionally, the number of seconds a batch should
+        take.  Defaults to 2.0.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @param metrics: Optionally, the L{Metrics} to record the time spent in
+        C{put} requests, and errors, in.
+    """
+
+    def __init__(self, fdb, batchSize=50, maxBatchSize=None, minBatchSize=1,
+                 targetLatency=2.0, timeModule=None, metrics=None):
+        self._fdb = fdb
+        self.batchSize = batchSize
+        self._maxBatchSize = maxBatchSize or batchSize
+        self._minBatchSize = min(minBatchSize, batchSize)
+        self._targetLatency = targetLatency
+        self._timeModule = timeModule or time
+        self._metrics = metrics or Metrics(self._timeModule)
+        self._batch = []
+
+    def add(self, key, query, values):
+        """Add an object to the current batch, writing it if it's full.
+
+        @param key: A value identifying the object in L{WriteResult}s, such
+            as the screen name of the Twitter user.
+        @param query: The Fluidinfo query matching the object.
+        @param values: The tag values to write, as returned by
+            L{getTagValues}.
+        @return: A C{list} of L{WriteResult}s for any objects written.
+        """
+        self._batch.append((key, query, values))
+        if len(self._batch) >= self.batchSize:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Write the objects in the current batch.
+
+        @return: A C{list} of L{WriteResult}s, in the order the objects were
+            added.
+        """
+        batch, self._batch = self._batch, []
+        return self._write(self._fdb, batch)
+
+    def sync(self):
+        """Write the objects in the current batch and wait until they're
+        written.
+
+        @return: A C{list} of L{WriteResult}s, in the order the objects were
+            added.
+        """
+        return self.flush()
+
+    def close(self):
+        """Write any remaining objects.
+
+        @return: A C{list} of L{WriteResult}s, in the order the objects were
+            added.
+        """
+        return self.flush()
+
+    def _write(self, fdb, batch):
+        """Write a batch of objects with the specified session.
+
+        @param fdb: The C{fom.session.Fluid} session to write with.
+        @param batch: A C{list} of C{(key, query, values)} 3-tuples.
+        @return: A C{list} of L{WriteResult}s.
+        """
+        if not batch:
+            return []
+        elif len(batch) == 1:
+            result = self._writeOne(fdb, *batch[0])
+            if result.error is None:
+                self._adapt(result.elapsed)
+            return [result]
+        start = self._timeModule.time()
+        try:
+            with self._metrics.time('put'):
+                fdb.values('PUT', payload={'queries': [
+                    [query, values] for key, query, values in batch]})
+        except FluidError as error:
+            self._metrics.countError(error)
+            return [self._writeOne(fdb, key, query, values)
+                    for key, query, values in batch]
+        elapsed = self._timeModule.time() - start
+        self._adapt(elapsed)
+        return [WriteResult(key, None, elapsed / len(batch))
+                for key, query, values in batch]
+
+    def _writeOne(self, fdb, key, query, values):
+        """Write the tag values for a single object.
+
+        @return: A L{WriteResult}.
+        """
+        start = self._timeModule.time()
+        try:
+            with self._metrics.time('put'):
+                fdb.values.put(query=query, values=values)
+        except FluidError as error:
+            self._metrics.countError(error)
+            return WriteResult(key, error, self._timeModule.time() - start)
+        return WriteResult(key, None, self._timeModule.time() - start)
+
+    def _adapt(self, elapsed):
+        """Adjust the batch size based on the latency of the last batch."""
+        if elapsed < self._targetLatency / 2:
+            self.batchSize = min(self._maxBatchSize, self.batchSize * 2)
+        elif elapsed > self._targetLatency:
+            self.batchSize = max(self._minBatchSize, self.batchSize // 2)
+
+
+class WriterPool(object):
+    """Run tasks concurrently with a bounded pool of worker threads.
+
+    Each worker creates its own session when it starts, so sessions are
+    never shared between threads.  Tasks can complete in any order, but
+    their results are returned in the order the tasks were submitted.
+
+    @param sessionFactory: A function that takes no arguments and returns a
+        new, logged in, C{fom.session.Fluid} session.
+    @param function: The function to run for each task.  It's called with a
+        session and the task.
+    @param concurrency: Optionally, the number of worker threads.  Defaults
+        to 4.
+    @param maxPending: Optionally, the number of tasks that can be submitted
+        but not yet returned.  L{submit} blocks when the limit is reached.
+        Defaults to twice C{concurrency}.
+    """
+
+    def __init__(self, sessionFactory, function, concurrency=4,
+                 maxPending=None):
+        self._sessionFactory = sessionFactory
+        self._function = function
+        self._maxPending = maxPending or concurrency * 2
+        self._tasks = Queue()
+        self._results = Queue()
+        self._completed = {}
+        self._submitted = 0
+        self._returned = 0
+        self._threads = []
+        for i in range(concurrency):
+            thread = Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, task):
+        """Submit a task to the pool.
+
+        @param task: The task to pass to the function.
+        @return: A C{list} of C{(task, value, error)} 3-tuples for tasks that
+            have completed, in the order they were submitted.  C{error} is the
+            exception raised by the function, or C{None} if it returned
+            C{value}.
+        """
+        self._tasks.put((self._submitted, task))
+        self._submitted += 1
+        ready = []
+        while self._submitted - self._returned >= self._maxPending:
+            self._receive(block=True)
+            ready.extend(self._getReady())
+        return ready + self.poll()
+
+    def poll(self):
+        """Get the results of completed tasks without blocking.
+
+        @return: A C{list} of C{(task, value, error)} 3-tuples, as returned
+            by L{submit}.
+        """
+        while self._receive(block=False):
+            pass
+        return self._getReady()
+
+    def wait(self):
+        """Wait for all submitted tasks to complete.
+
+        @return: A C{list} of C{(task, value, error)} 3-tuples, as returned
+            by L{submit}.
+        """
+        ready = []
+        while self._returned < self._submitted:
+            self._receive(block=True)
+            ready.extend(self._getReady())
+        return ready
+
+    def close(self):
+        """Wait for all submitted tasks to complete and stop the workers.
+
+        @return: A C{list} of C{(task, value, error)} 3-tuples, as returned
+            by L{submit}.
+        """
+        for thread in self._threads:
+            self._tasks.put(None)
+        ready = self.wait()
+        for thread in self._threads:
+            thread.join()
+        return ready
+
+    def _work(self):
+        """Run tasks until told to stop."""
+        session = None
+        while True:
+            entry = self._tasks.get()
+            if entry is None:
+                return
+            sequence, task = entry
+            value = error = None
+            try:
+                if session is None:
+                    session = self._sessionFactory()
+                value = self._function(session, task)
+            except Exception as error:
+                pass
+            self._results.put((sequence, task, value, error))
+
+    def _receive(self, block):
+        """Move a completed task from the results queue.
+
+        @return: C{True} if a result was received, otherwise C{False}.
+        """
+        if not block and self._results.empty():
+            return False
+        sequence, task, value, error = self._results.get()
+        self._completed[sequence] = (task, value, error)
+        return True
+
+    def _getReady(self):
+        """Get the completed results that are next in submission order."""
+        ready = []
+        while self._returned in self._completed:
+            ready.append(self._completed.pop(self._returned))
+            self._returned += 1
+        return ready
+
+
+class ConcurrentBatchWriter(BatchWriter):
+    """A L{BatchWriter} that writes several batches at once.
+
+    Batches are written by a L{WriterPool}, with a session per worker.
+    L{add} and L{flush} return the results of batches that have completed,
+    in the order the objects were added, so the results of a batch may be
+    returned by a later call.  L{sync} and L{close} wait for all batches to
+    complete.
+
+    @param sessionFactory: A function that takes no arguments and returns a
+        new, logged in, C{fom.session.Fluid} session.
+    @param concurrency: Optionally, the number of batches to write at once.
+        Defaults to 4.
+    @param kwargs: Optionally, keyword arguments for L{BatchWriter}.
+    """
+
+    def __init__(self, sessionFactory, concurrency=4, **kwargs):
+        super(ConcurrentBatchWriter, self).__init__(None, **kwargs)
+        self._pool = WriterPool(sessionFactory, self._write, concurrency)
+
+    def flush(self):
+        """Submit the objects in the current batch to the pool.
+
+        @return: A C{list} of L{WriteResult}s for completed batches.
+        """
+        batch, self._batch = self._batch, []
+        if batch:
+            return self._getResults(self._pool.submit(batch))
+        return self._getResults(self._pool.poll())
+
+    def sync(self):
+        """Write any remaining objects and wait for all batches to complete.
+
+        @return: A C{list} of L{WriteResult}s for completed batches.
+        """
+        results = self.flush()
+        return results + self._getResults(self._pool.wait())
+
+    def close(self):
+        """Write any remaining objects and wait for all batches to complete.
+
+        @return: A C{list} of L{WriteResult}s for completed batches.
+        """
+        results = self.flush()
+        return results + self._getResults(self._pool.close())
+
+    def _getResults(self, completed):
+        """Convert completed pool tasks to L{WriteResult}s.
+
+        An unexpected error in a worker is reported for every object in its
+        batch.
+        """
+        results = []
+        for batch, value, error in completed:
+            if error is not None:
+                results.extend(WriteResult(key, error, 0.0)
+                               for key, query, values in batch)
+            else:
+                results.extend(value)
+        return results
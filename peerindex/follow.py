@@ -0,0 +1,222 @@
+"""Follow a growing file of JSON profiles, as C{tail -f} does.
+
+L{Follower} reads the lines appended to the output of a running download as
+they're written.  When the output is rotated by its L{ProfileWriter}, the
+rest of the rotated file is read before moving on to the next one.  Only
+complete lines are read, so a profile that's half written isn't read until
+its newline arrives::
+
+  checkpoint = OffsetCheckpoint('profiles.json.offset')
+  follower = Follower('profiles.json', checkpoint.load())
+  for line in follower.lines():
+      ...
+      checkpoint.save(follower.position)
+
+A position is a C{(device, inode, offset)} 3-tuple.  It identifies the file
+by its inode, so it stays valid after the file is renamed by rotation, and
+a restarted follower picks up where it left off.  A file that's renamed or
+removed while the files are being listed is picked up at the next poll.
+Compressed output can't be followed.
+"""
+
+from errno import ENOENT
+from json import dump, load
+import logging
+import os
+import time
+
+from peerindex.output import GZIP_MAGIC, getOutputPaths
+
+
+class OffsetCheckpoint(object):
+    """A file recording the position a L{Follower} has reached.
+
+    The position is written to a temporary file, synced to disk and renamed
+    into place, so the checkpoint is never left half written.
+
+    @param path: The path of the checkpoint file.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def load(self):
+        """Load the saved position.
+
+        @return: A C{(device, inode, offset)} 3-tuple, or C{None} if no
+            position has been saved.
+        """
+        if not os.path.exists(self._path):
+            return None
+        with open(self._path) as checkpointFile:
+            return tuple(load(checkpointFile))
+
+    def save(self, position):
+        """Save a position.
+
+        @param position: A C{(device, inode, offset)} 3-tuple.
+        """
+        temporaryPath = self._path + '.tmp'
+        with open(temporaryPath, 'w') as checkpointFile:
+            dump(list(position), checkpointFile)
+            checkpointFile.flush()
+            os.fsync(checkpointFile.fileno())
+        os.rename(temporaryPath, self._path)
+
+
+def getIdentity(path):
+    """Get the C{(device, inode)} 2-tuple identifying a file."""
+    status = os.stat(path)
+    return status.st_dev, status.st_ino
+
+
+class Follower(object):
+    """Read the complete lines appended to a file and its rotations.
+
+    @param path: The path given to the L{ProfileWriter} writing the file.
+    @param position: Optionally, a position to start from, as returned by
+        L{OffsetCheckpoint.load}.  By default, or if the file it refers to
+        no longer exists, reading starts at the beginning of the oldest
+        rotated file.
+    @param pollInterval: Optionally, the number of seconds to wait for more
+        data when the end of the file is reached.  Defaults to 1.0.
+    @param onIdle: Optionally, a function called with the current position
+        when the end of the file is reached and new lines have been read
+        since it was last called.  It's a good time to save a checkpoint.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @ivar position: The position after the last line read.
+    """
+
+    def __init__(self, path, position=None, pollInterval=1.0, onIdle=None,
+                 timeModule=None):
+        self._path = path
+        self._pollInterval = pollInterval
+        self._onIdle = onIdle
+        self._timeModule = timeModule or time
+        self._stopped = False
+        self.position = position
+
+    def stop(self):
+        """Stop following once the current line has been processed."""
+        self._stopped = True
+
+    def lines(self):
+        """Read lines as they're appended.
+
+        @raise ValueError: Raised if the file is compressed.
+        @return: A generator that yields lines, including their trailing
+            newline, until L{stop} is called.
+        """
+        inputFile = self._open()
+        idlePosition = None
+        try:
+            while not self._stopped:
+                if inputFile is None:
+                    inputFile = self._open()
+                    if inputFile is None:
+                        self._timeModule.sleep(self._pollInterval)
+                        continue
+                device, inode, offset = self.position
+                line = inputFile.readline()
+                if line.endswith('\n'):
+                    self.position = (device, inode, offset + len(line))
+                    yield line
+                    continue
+                inputFile.seek(offset)
+                nextIdentity = self._getNextIdentity((device, inode))
+                if nextIdentity is not None:
+                    if line:
+                        logging.warning('Skipping a partial line at the end '
+                                        'of a rotated file')
+                    inputFile.close()
+                    inputFile = None
+                    self.position = nextIdentity + (0,)
+                    continue
+                if self._onIdle is not None and self.position != idlePosition:
+                    idlePosition = self.position
+                    self._onIdle(self.position)
+                if not self._stopped:
+                    self._timeModule.sleep(self._pollInterval)
+        finally:
+            if inputFile is not None:
+                inputFile.close()
+
+    def _open(self):
+        """Open the file at the current position.
+
+        @return: The open file, or C{None} if no output has been written
+            yet, or if the files changed while they were being listed or
+            opened.
+        """
+        files = self._listFiles()
+        if not files:
+            return None
+        identities = [identity for path, identity in files]
+        if (self.position is not None and
+                self.position[:2] not in identities):
+            logging.warning('The checkpointed file no longer exists, '
+                            'starting from the oldest file')
+            self.position = None
+        if self.position is None:
+            path, identity = files[0]
+        else:
+            identity = self.position[:2]
+            path = files[identities.index(identity)][0]
+        try:
+            inputFile = open(path, 'rb')
+        except IOError as error:
+            if error.errno != ENOENT:
+                raise
+            return None
+        status = os.fstat(inputFile.fileno())
+        if (status.st_dev, status.st_ino) != identity:
+            inputFile.close()
+            return None
+        if inputFile.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+            inputFile.close()
+            raise ValueError("Compressed output can't be followed.")
+        if self.position is None:
+            self.position = identity + (0,)
+        inputFile.seek(self.position[2])
+        return inputFile
+
+    def _getNextIdentity(self, identity):
+        """Get the identity of the file written after the one being read.
+
+        @param identity: The C{(device, inode)} of the file being read.
+        @return: The C{(device, inode)} of the next file, or C{None} if the
+            file being read is still the current one, or if the files
+            changed while they were being listed.
+        """
+        files = self._listFiles()
+        if files is None:
+            return None
+        identities = [fileIdentity for path, fileIdentity in files]
+        if identity not in identities:
+            return identities[0] if identities else None
+        index = identities.index(identity)
+        if index + 1 < len(identities):
+            return identities[index + 1]
+        return None
+
+    def _listFiles(self):
+        """Get the output files, oldest first, with their identities.
+
+        @return: A C{list} of C{(path, identity)} 2-tuples, or C{None} if a
+            file was renamed or removed while they were being listed, as
+            happens during a rotation.
+        """
+        files = []
+        for path in self._getOutputPaths():
+            try:
+                files.append((path, getIdentity(path)))
+            except OSError as error:
+                if error.errno != ENOENT:
+                    raise
+                return None
+        return files
+
+    def _getOutputPaths(self):
+        """Get the paths of the output files, oldest first."""
+        return getOutputPaths(self._path)
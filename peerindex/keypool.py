@@ -0,0 +1,214 @@
+"""A PeerIndex client that shares work between several API keys.
+
+Each PeerIndex key is limited to one call per second and a daily quota, so
+L{KeyPool} holds several keys, each with its own L{QuotaScheduler}, and
+sends each call to the idle key that can make it soonest::
+
+  peerindex = KeyPool(['key-1', 'key-2', 'key-3'])
+  result = peerindex.get('twitter-user')
+
+A key that raises L{RateLimitError} or L{CredentialsError} is retired, until
+its quota resets or for a day, and the call is retried with another key.
+L{KeyPool} is thread-safe, and each key makes one call at a time, so up to
+one thread per key can fetch profiles at once.
+"""
+
+import logging
+from threading import Condition
+import time
+
+from peerindex.client import (
+    BASE_URL, CredentialsError, PeerIndex, RateLimitError)
+from peerindex.ratelimit import QuotaScheduler, TokenBucket
+
+
+DAY = 24 * 60 * 60
+
+
+class PooledKey(object):
+    """An API key in a L{KeyPool}.
+
+    @ivar key: The API key.
+    @ivar limiter: The L{QuotaScheduler} for the key.
+    @ivar peerindex: The L{PeerIndex} client that uses the key.
+    @ivar busy: C{True} while a call is being made with the key.
+    @ivar retiredUntil: The time the key can be used again after it was
+        retired, or C{None} if it's never been retired.
+    @ivar invalid: C{True} if the key was last retired because PeerIndex
+        rejected it.
+    @ivar calls: The number of calls made with the key.
+    """
+
+    def __init__(self, key, limiter, peerindex):
+        self.key = key
+        self.limiter = limiter
+        self.peerindex = peerindex
+        self.busy = False
+        self.retiredUntil = None
+        self.invalid = False
+        self.calls = 0
+
+    def isRetired(self, now):
+        """Determine whether the key is retired.
+
+        @param now: The current time, in seconds since the epoch.
+        @return: C{True} if the key can't be used yet, otherwise C{False}.
+        """
+        return self.retiredUntil is not None and self.retiredUntil > now
+
+
+class KeyPool(object):
+    """A client for the PeerIndex API that uses several API keys.
+
+    L{KeyPool} has the same C{get} method as L{PeerIndex}, so it can be used
+    in its place.
+
+    @param keys: A C{list} of PeerIndex API keys.
+    @param client: Optionally, an C{httplib2.Http}-compatible object shared
+        by the keys, such as a L{ConnectionPool}.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @param rate: Optionally, the number of calls to make per second with
+        each key.  Defaults to 1.0.
+    @param cache: Optionally, a L{ResponseCache} used to avoid fetching
+        recently fetched profiles again.
+    @param baseURL: Optionally, the base URL of the PeerIndex API.
+    @param metrics: Optionally, the L{Metrics} to record timings and errors
+        in.
+    @param pause: Optionally, a flag indicating whether to wait until a key
+        can be used again when all of them are retired.  Defaults to
+        C{True}.  If C{False}, L{RateLimitError} is raised instead.
+    @param spread: Optionally, a flag indicating whether to spread each
+        key's remaining daily quota until it resets.  Defaults to C{True}.
+    """
+
+    def __init__(self, keys, client=None, timeModule=None, rate=1.0,
+                 cache=None, baseURL=BASE_URL, metrics=None, pause=True,
+                 spread=True):
+        if not keys:
+            raise ValueError('At least one API key is needed.')
+        self._timeModule = timeModule or time
+        self._pause = pause
+        self._condition = Condition()
+        self.keys = []
+        for key in keys:
+            limiter = QuotaScheduler(
+                bucket=TokenBucket(rate=rate, timeModule=self._timeModule),
+                pause=False, spread=spread, timeModule=self._timeModule)
+            peerindex = PeerIndex(key, client=client,
+                                  timeModule=self._timeModule,
+                                  limiter=limiter, cache=cache,
+                                  baseURL=baseURL, metrics=metrics)
+            self.keys.append(PooledKey(key, limiter, peerindex))
+
+    def get(self, name):
+        """Get the PeerIndex profile for a Twitter user.
+
+        @param name: The screen name of the Twitter user.
+        @raise RateLimitError: Raised if all the keys are retired and
+            pausing is disabled.
+        @raise CredentialsError: Raised if all the keys are retired because
+            PeerIndex rejected them.
+        @raise UnknownUserError: Raised if information about the specified
+            Twitter user isn't available.
+        @raise PeerIndexError: Raised for any other type of error.
+        @return: A C{dict} representing data about the user.
+        """
+        while True:
+            key = self._checkout()
+            try:
+                key.calls += 1
+                return key.peerindex.get(name)
+            except (RateLimitError, CredentialsError) as error:
+                self._retire(key, error)
+            finally:
+                self._checkin(key)
+
+    def _checkout(self):
+        """Wait for the idle key that can make a call soonest.
+
+        @raise RateLimitError: Raised if all the keys are retired and
+            pausing is disabled.
+        @raise CredentialsError: Raised if all the keys are retired because
+            PeerIndex rejected them, since waiting won't help.
+        @return: A L{PooledKey}, marked as busy.
+        """
+        while True:
+            with self._condition:
+                now = self._timeModule.time()
+                active = [key for key in self.keys
+                          if not key.isRetired(now)]
+                idle = [key for key in active if not key.busy]
+                if idle:
+                    key = min(idle, key=lambda key: key.limiter.peek())
+                    key.busy = True
+                    return key
+                if active:
+                    self._condition.wait()
+                    continue
+                limited = [pooled for pooled in self.keys
+                           if not pooled.invalid]
+                if not limited:
+                    raise CredentialsError('All API keys are invalid.')
+                if not self._pause:
+                    raise RateLimitError('All API keys are retired.')
+                delay = min(pooled.retiredUntil for pooled in limited) - now
+            logging.warning('All API keys are retired, pausing for %d '
+                            'seconds' % delay)
+            self._timeModule.sleep(delay)
+
+    def _checkin(self, key):
+        """Return a key to the pool, waking the threads waiting for one.
+
+        Every waiting thread is woken, since the first to wake may raise
+        instead of taking the key, and the others must then check the pool
+        again.
+        """
+        with self._condition:
+            key.busy = False
+            self._condition.notify_all()
+
+    def _retire(self, key, error):
+        """Stop using a key until its quota resets, or for a day.
+
+        @param key: The L{PooledKey} to retire.
+        @param error: The L{RateLimitError} or L{CredentialsError} it
+            raised.
+        """
+        now = self._timeModule.time()
+        reset = key.limiter.tracker.reset
+        if (isinstance(error, RateLimitError) and reset is not None and
+                reset > now):
+            retiredUntil = reset
+        else:
+            retiredUntil = now + DAY
+        with self._condition:
+            key.retiredUntil = retiredUntil
+            key.invalid = isinstance(error, CredentialsError)
+            self._condition.notify_all()
+        logging.warning('Retiring API key %s...%s for %d seconds: %r'
+                        % (key.key[:4], key.key[-2:], retiredUntil - now,
+                           error))
+
+
+def createPeerIndex(keys, rate=1.0, spread=True, **kwargs):
+    """Create a client for one or several comma-separated API keys.
+
+    @param keys: A C{str} with one API key, or several separated by commas.
+    @param rate: Optionally, the number of calls to make per second with
+        each key.  Defaults to 1.0.
+    @param spread: Optionally, a flag indicating whether to spread the
+        remaining daily quota until it resets.  Defaults to C{True}.  If
+        C{False}, calls are made as fast as C{rate} allows until the quota
+        runs out.
+    @param kwargs: Keyword arguments to pass to the client, such as
+        C{client}, C{cache}, C{baseURL} and C{metrics}.
+    @return: A L{PeerIndex} that pauses until its quota resets, for a single
+        key, or a L{KeyPool}.
+    """
+    keys = [key.strip() for key in keys.split(',') if key.strip()]
+    if len(keys) == 1:
+        limiter = QuotaScheduler(bucket=TokenBucket(rate=rate),
+                                 spread=spread)
+        return PeerIndex(keys[0], limiter=limiter, **kwargs)
+    return KeyPool(keys, rate=rate, spread=spread, **kwargs)
@@ -0,0 +1,240 @@
+"""Timing histograms and error counters for long running imports.
+
+A single L{Metrics} instance is shared by the PeerIndex client and the
+Fluidinfo writers, which record the time spent in each stage of an import::
+
+  metrics = Metrics()
+  peerindex = PeerIndex('your-api-key', metrics=metrics)
+  writer = BatchWriter(fdb, metrics=metrics)
+
+The stages recorded are C{fetch} (the PeerIndex API call), C{decode}
+(parsing its response), C{sleep} (waiting for the rate limiter), and
+C{post} and C{put} (the Fluidinfo C{objects} and C{values} requests).
+Errors are counted by exception class.  A L{MetricsExporter} writes the
+metrics to a file periodically, as JSON or in the Prometheus text format,
+so progress can be watched while an import runs.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from json import dump
+import os
+from threading import Event, Lock, Thread
+import time
+
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, 30.0, 60.0, 300.0, float('inf'))
+
+
+class Histogram(object):
+    """A histogram of durations with fixed bucket boundaries.
+
+    Memory use doesn't grow with the number of observations, so percentiles
+    are estimated by interpolating within the bucket they fall in.
+
+    @param buckets: Optionally, the sorted upper bounds of the buckets, in
+        seconds.  The last should be infinity.  Defaults to L{BUCKETS}.
+    @ivar count: The number of observations.
+    @ivar sum: The sum of the observed durations.
+    @ivar max: The largest observed duration.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Record a duration.
+
+        @param value: The duration in seconds.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def getPercentile(self, fraction):
+        """Estimate a percentile of the observed durations.
+
+        @param fraction: The percentile as a fraction, such as C{0.99}.
+        @return: The estimated duration, or C{None} if nothing has been
+            observed.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def getSnapshot(self):
+        """Get a summary of the histogram.
+
+        @return: A C{dict} with C{count}, C{sum}, C{max}, C{p50}, C{p90} and
+            C{p99} keys.
+        """
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'p50': self.getPercentile(0.5),
+                'p90': self.getPercentile(0.9),
+                'p99': self.getPercentile(0.99)}
+
+
+class Metrics(object):
+    """Per-stage timing histograms and error counts.
+
+    It's safe to record metrics from several threads.
+
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @ivar histograms: A C{dict} mapping stage names to L{Histogram}s.
+    @ivar errors: A C{dict} mapping exception class names to counts.
+    """
+
+    def __init__(self, timeModule=None):
+        self._timeModule = timeModule or time
+        self._lock = Lock()
+        self.histograms = {}
+        self.errors = {}
+
+    def observe(self, stage, seconds):
+        """Record the time spent in a stage.
+
+        @param stage: The name of the stage, such as C{fetch}.
+        @param seconds: The duration.
+        """
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """Record the time spent running a block of code.
+
+        The time is recorded even if the block raises an exception::
+
+          with metrics.time('fetch'):
+              headers, contents = client.request(uri)
+
+        @param stage: The name of the stage.
+        """
+        start = self._timeModule.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, self._timeModule.time() - start)
+
+    def countError(self, error):
+        """Count an error by its exception class.
+
+        @param error: The exception.
+        """
+        name = error.__class__.__name__
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def getSnapshot(self):
+        """Get the current metrics.
+
+        @return: A C{dict} with a C{stages} C{dict} mapping stage names to
+            histogram snapshots, and an C{errors} C{dict} mapping exception
+            class names to counts.
+        """
+        with self._lock:
+            return {'time': self._timeModule.time(),
+                    'stages': dict((stage, histogram.getSnapshot())
+                                   for stage, histogram
+                                   in self.histograms.iteritems()),
+                    'errors': dict(self.errors)}
+
+    def getPrometheusText(self):
+        """Get the current metrics in the Prometheus text format.
+
+        @return: The metrics as a C{str}, with a histogram of the time spent
+            in each stage and a counter of errors by exception class.
+        """
+        lines = ['# TYPE peerindex_stage_seconds histogram']
+        with self._lock:
+            for stage in sorted(self.histograms):
+                histogram = self.histograms[stage]
+                total = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    total += count
+                    bound = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('peerindex_stage_seconds_bucket'
+                                 '{stage="%s",le="%s"} %d'
+                                 % (stage, bound, total))
+                lines.append('peerindex_stage_seconds_sum{stage="%s"} %r'
+                             % (stage, histogram.sum))
+                lines.append('peerindex_stage_seconds_count{stage="%s"} %d'
+                             % (stage, histogram.count))
+            lines.append('# TYPE peerindex_errors_total counter')
+            for name in sorted(self.errors):
+                lines.append('peerindex_errors_total{class="%s"} %d'
+                             % (name, self.errors[name]))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(object):
+    """Periodically write metrics to a file.
+
+    The file is replaced atomically, so readers never see a partial write.
+
+    @param metrics: The L{Metrics} to export.
+    @param path: The path of the file to write.
+    @param format: Optionally, C{'json'} or C{'prometheus'}.  Defaults to
+        C{'json'}.
+    @param interval: Optionally, the number of seconds between exports.
+        Defaults to 60.
+    """
+
+    def __init__(self, metrics, path, format='json', interval=60):
+        if format not in ('json', 'prometheus'):
+            raise ValueError('Unknown metrics format: %r' % format)
+        self._metrics = metrics
+        self._path = path
+        self._format = format
+        self._interval = interval
+        self._stopped = Event()
+        self._thread = None
+
+    def export(self):
+        """Write the current metrics to the file."""
+        temporaryPath = '%s.tmp' % self._path
+        with open(temporaryPath, 'w') as outputFile:
+            if self._format == 'json':
+                dump(self._metrics.getSnapshot(), outputFile, indent=2,
+                     sort_keys=True)
+            else:
+                outputFile.write(self._metrics.getPrometheusText())
+        os.rename(temporaryPath, self._path)
+
+    def start(self):
+        """Start exporting every C{interval} seconds in a daemon thread."""
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop exporting and write the final metrics."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self.export()
+
+    def _run(self):
+        """Export until stopped."""
+        while not self._stopped.wait(self._interval):
+            self.export()
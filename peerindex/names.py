@@ -0,0 +1,179 @@
+"""Helpers for working with Twitter screen names.
+
+Name lists can be much larger than memory, so the seen-sets used to skip
+repeated names are bounded.  L{SeenSet} is exact, and keeps the most recent
+names in memory while spilling older ones to a temporary SQLite database.
+L{BloomFilter} uses a fixed amount of memory for a given capacity, at the
+cost of occasionally treating a new name as already seen::
+
+  seen = SeenSet(maxMemory=1000000)
+  for name in dedup(normalizeNames(readNames(inputFile)), seen=seen):
+      ...
+  seen.close()
+"""
+
+from hashlib import md5
+from math import ceil, log
+import sqlite3
+import struct
+
+from peerindex.client import stripName
+
+
+# Two 32-bit hashes are taken from each digest, which keeps the arithmetic
+# for the bit positions in native integers.
+HASHES = struct.Struct('<II')
+
+
+def normalizeName(name):
+    """Normalize a Twitter screen name for comparison.
+
+    Twitter screen names are case insensitive, and the importers store data
+    on the Fluidinfo object about the lowercase name.  The same name with or
+    without a leading C{@} sign, in any case, normalizes to the same value.
+
+    @param name: The screen name of the Twitter user.
+    @return: The stripped, lowercase screen name.
+    """
+    return stripName(name).lower()
+
+
+class SeenSet(object):
+    """An exact set of names that spills to disk when it gets large.
+
+    @param maxMemory: Optionally, the number of names to hold in memory
+        before moving them to the database.  Defaults to 1,000,000.
+    @param path: Optionally, the path to the SQLite database.  Names
+        already in it are treated as seen.  By default a temporary database
+        is used, which is deleted when the set is closed.
+    @ivar spilled: The number of names moved to the database.
+    """
+
+    def __init__(self, maxMemory=1000000, path=''):
+        self._maxMemory = maxMemory
+        self._path = path
+        self._memory = set()
+        self._connection = None
+        self.spilled = 0
+        if path:
+            self._connect()
+
+    def __contains__(self, name):
+        if name in self._memory:
+            return True
+        if self._connection is None:
+            return False
+        row = self._connection.execute(
+            'SELECT 1 FROM names WHERE name = ?', (name,)).fetchone()
+        return row is not None
+
+    def add(self, name):
+        """Add a name to the set.
+
+        @param name: The name, as a C{str} or C{unicode}.
+        """
+        self._memory.add(name)
+        if len(self._memory) >= self._maxMemory:
+            self._spill()
+
+    def _connect(self):
+        """Open the database, creating the table if it doesn't exist."""
+        self._connection = sqlite3.connect(self._path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY)')
+
+    def _spill(self):
+        """Move the names held in memory to the database."""
+        if self._connection is None:
+            self._connect()
+        self._connection.executemany(
+            'INSERT OR IGNORE INTO names VALUES (?)',
+            ((name,) for name in self._memory))
+        self._connection.commit()
+        self.spilled += len(self._memory)
+        self._memory.clear()
+
+    def close(self):
+        """Close the database, deleting it if it's temporary.
+
+        Names still held in memory are moved to a persistent database
+        first, so they're treated as seen when it's opened again.
+        """
+        if self._path and self._memory:
+            self._spill()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._memory.clear()
+
+
+class BloomFilter(object):
+    """A probabilistic set of names with a fixed memory footprint.
+
+    A name that hasn't been added is reported as present with a probability
+    of about C{errorRate}, as long as no more than C{capacity} names have
+    been added.  Names that have been added are always reported as present.
+
+    @param capacity: The number of names the filter is sized for.
+    @param errorRate: Optionally, the false positive rate at capacity.
+        Defaults to 0.001.
+    """
+
+    def __init__(self, capacity, errorRate=0.001):
+        self.size = int(ceil(-capacity * log(errorRate) / log(2) ** 2))
+        self.hashes = max(1, int(round(self.size * log(2) / capacity)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._last = (None, None)
+
+    def _getPositions(self, name):
+        """Get the bit positions for a name, using double hashing.
+
+        The positions for the last name are kept, since a name is usually
+        checked and then added.
+        """
+        if self._last[0] == name:
+            return self._last[1]
+        if isinstance(name, unicode):
+            data = name.encode('utf-8')
+        else:
+            data = name
+        first, second = HASHES.unpack_from(md5(data).digest())
+        size = self.size
+        positions = [(first + i * second) % size
+                     for i in xrange(self.hashes)]
+        self._last = (name, positions)
+        return positions
+
+    def __contains__(self, name):
+        bits = self._bits
+        for position in self._getPositions(name):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, name):
+        """Add a name to the filter.
+
+        @param name: The name, as a C{str} or C{unicode}.
+        """
+        bits = self._bits
+        for position in self._getPositions(name):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def close(self):
+        """Release the filter's memory."""
+        self._bits = bytearray()
+
+
+def createSeenSet(maxMemory=1000000, bloomCapacity=None):
+    """Create the seen-set for the C{--dedup-memory} and C{--bloom} options.
+
+    @param maxMemory: Optionally, the number of names a L{SeenSet} holds in
+        memory before spilling to disk.
+    @param bloomCapacity: Optionally, the capacity of a L{BloomFilter} to
+        use instead of a L{SeenSet}.
+    @return: A L{SeenSet} or L{BloomFilter}.
+    """
+    if bloomCapacity is not None:
+        return BloomFilter(bloomCapacity)
+    return SeenSet(maxMemory)
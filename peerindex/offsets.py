@@ -0,0 +1,218 @@
+"""Random access to the profiles in a file of JSON profiles.
+
+Finding a few users in a large file written by L{ProfileWriter} means
+scanning and parsing every line.  L{OffsetIndex} is a sidecar index from
+each normalized screen name to the offset and length of its line, so
+L{IndexedProfiles} can read just those lines from a memory map of the
+file::
+
+  index = OffsetIndex('profiles.json.index')
+  index.update('profiles.json')
+  profiles = IndexedProfiles('profiles.json', index)
+  for profile in profiles.lookup(['terrycojones', 'fluidinfo']):
+      ...
+  profiles.close()
+  index.close()
+
+An index can be updated as the file grows, in which case only the lines
+appended since the last update are read.  If a user appears more than once,
+the last profile in the file is indexed.  Compressed files and archives
+can't be indexed.
+
+The index records a checksum of the start of the file as well as the
+number of bytes indexed, so a file that's been replaced or rewritten,
+rather than appended to, is rejected instead of being read at the wrong
+offsets.
+"""
+
+from hashlib import sha1
+from json import loads
+import logging
+from mmap import ACCESS_READ, mmap
+import os
+import sqlite3
+
+from peerindex.archive import ARCHIVE_MAGIC
+from peerindex.names import normalizeName
+from peerindex.output import GZIP_MAGIC
+from peerindex.pipeline import getProfileName
+
+
+HEAD_SIZE = 4096
+
+
+class OffsetIndex(object):
+    """A persistent map of screen names to the position of their profiles.
+
+    @param path: The path to the SQLite database file.  It's created if it
+        doesn't exist.
+    @param commitEvery: Optionally, the number of lines to index between
+        commits.  Defaults to 10000.
+    """
+
+    def __init__(self, path, commitEvery=10000):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS offsets ('
+            'name TEXT PRIMARY KEY, offset INTEGER, length INTEGER)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS indexed ('
+            'size INTEGER, head_size INTEGER, head TEXT)')
+        self._commitEvery = commitEvery
+
+    def getSize(self):
+        """Get the number of bytes of the file that have been indexed."""
+        row = self._connection.execute('SELECT size FROM indexed').fetchone()
+        return 0 if row is None else row[0]
+
+    def verify(self, inputFile):
+        """Check that a file is the one that's been indexed.
+
+        @param inputFile: The file of JSON profiles, open for reading.  It's
+            read from the start, so its position changes.
+        @raise ValueError: Raised if the file is shorter than the part
+            already indexed, or if its start has changed since it was
+            indexed.
+        """
+        row = self._connection.execute(
+            'SELECT size, head_size, head FROM indexed').fetchone()
+        if row is None:
+            return
+        size, headSize, head = row
+        if os.fstat(inputFile.fileno()).st_size < size:
+            raise ValueError('The file is shorter than its index.')
+        inputFile.seek(0)
+        if sha1(inputFile.read(headSize)).hexdigest() != head:
+            raise ValueError("The file doesn't match its index.")
+
+    def clear(self):
+        """Remove every entry, so the next L{update} indexes the whole file.
+        """
+        self._connection.execute('DELETE FROM offsets')
+        self._connection.execute('DELETE FROM indexed')
+        self._connection.commit()
+
+    def update(self, path):
+        """Index the lines appended to a file since the last update.
+
+        A partial line at the end of the file isn't indexed until it's
+        complete.
+
+        @param path: The path of the file of JSON profiles.
+        @raise ValueError: Raised if the file is compressed or an archive,
+            or doesn't match the part already indexed.
+        @return: The number of lines indexed.
+        """
+        size = self.getSize()
+        count = 0
+        with open(path, 'rb') as inputFile:
+            head = inputFile.read(HEAD_SIZE)
+            if (head.startswith(GZIP_MAGIC) or
+                    head.startswith(ARCHIVE_MAGIC)):
+                raise ValueError("Compressed files and archives can't be "
+                                 "indexed.")
+            self.verify(inputFile)
+            inputFile.seek(size)
+            offset = size
+            for line in inputFile:
+                if not line.endswith('\n'):
+                    break
+                if line.strip():
+                    self._connection.execute(
+                        'INSERT OR REPLACE INTO offsets VALUES (?, ?, ?)',
+                        (getProfileName(loads(line)), offset, len(line)))
+                    count += 1
+                    if count % self._commitEvery == 0:
+                        self._setSize(offset + len(line), head)
+                offset += len(line)
+            self._setSize(offset, head)
+        return count
+
+    def get(self, name):
+        """Get the position of a user's profile.
+
+        @param name: The screen name of the Twitter user.
+        @return: An C{(offset, length)} 2-tuple, or C{None} if the user
+            isn't in the index.
+        """
+        return self._connection.execute(
+            'SELECT offset, length FROM offsets WHERE name = ?',
+            (normalizeName(name),)).fetchone()
+
+    def close(self):
+        """Close the database."""
+        self._connection.close()
+
+    def _setSize(self, size, head):
+        """Record the number of bytes indexed and commit.
+
+        @param size: The number of bytes indexed.
+        @param head: The first bytes of the file, up to L{HEAD_SIZE}.  A
+            checksum of those that have been indexed is recorded.
+        """
+        head = head[:size]
+        self._connection.execute('DELETE FROM indexed')
+        self._connection.execute('INSERT INTO indexed VALUES (?, ?, ?)',
+                                 (size, len(head), sha1(head).hexdigest()))
+        self._connection.commit()
+
+
+class IndexedProfiles(object):
+    """Read profiles from a file of JSON profiles using an L{OffsetIndex}.
+
+    @param path: The path of the file of JSON profiles.
+    @param index: The L{OffsetIndex} for the file.
+    @raise ValueError: Raised if the file doesn't match the part that's
+        been indexed.
+    """
+
+    def __init__(self, path, index):
+        self._index = index
+        self._file = open(path, 'rb')
+        try:
+            index.verify(self._file)
+        except ValueError:
+            self._file.close()
+            raise
+        self._map = None
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap(self._file.fileno(), 0, access=ACCESS_READ)
+
+    def get(self, name):
+        """Get a user's profile.
+
+        @param name: The screen name of the Twitter user.
+        @raise ValueError: Raised if the indexed line isn't the user's
+            profile, because the file has changed since it was indexed.
+        @return: The profile C{dict}, or C{None} if the user isn't in the
+            index.
+        """
+        position = self._index.get(name)
+        if position is None:
+            return None
+        offset, length = position
+        profile = loads(self._map[offset:offset + length])
+        if getProfileName(profile) != normalizeName(name):
+            raise ValueError("The file doesn't match its index.")
+        return profile
+
+    def lookup(self, names):
+        """Get the profiles of many users.
+
+        Users that aren't in the index are logged and skipped.
+
+        @param names: An iterable of screen names.
+        @return: A generator that yields profile C{dict}s.
+        """
+        for name in names:
+            profile = self.get(name)
+            if profile is None:
+                logging.warning('No profile for %s in the index' % name)
+                continue
+            yield profile
+
+    def close(self):
+        """Close the file."""
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
@@ -0,0 +1,212 @@
+"""Reading and writing files of JSON profiles, one per line.
+
+L{ProfileWriter} keeps its output file open, buffers writes, and can
+compress its output with C{gzip} and rotate it when it grows too large.
+Rotated files are renamed with a numeric suffix, so the file being written
+always has the same path::
+
+  profiles.json.1
+  profiles.json.2
+  profiles.json
+
+L{getOutputPaths} finds all the files written for a path, in order, and
+L{readLines} reads plain and C{gzip} compressed files transparently.
+"""
+
+from gzip import GzipFile
+from json import dumps
+import os
+import re
+import zlib
+
+
+GZIP_MAGIC = '\x1f\x8b'
+
+
+def getOutputPaths(path):
+    """Get the paths of all the files written by a L{ProfileWriter}.
+
+    @param path: The path given to the L{ProfileWriter}.
+    @return: A C{list} of existing paths, with rotated files first in the
+        order they were written, and then C{path} itself.
+    """
+    directory, name = os.path.split(path)
+    pattern = re.compile(r'^%s\.(\d+)$' % re.escape(name))
+    segments = []
+    for filename in os.listdir(directory or '.'):
+        match = pattern.match(filename)
+        if match is not None:
+            segments.append((int(match.group(1)),
+                             os.path.join(directory, filename)))
+    paths = [segmentPath for number, segmentPath in sorted(segments)]
+    if os.path.exists(path):
+        paths.append(path)
+    return paths
+
+
+def readLines(inputFile, blockSize=65536, prefix=''):
+    """Read lines from a plain or C{gzip} compressed file.
+
+    Compressed data is detected by its magic number, so it can be read from
+    a pipe.  Files with several concatenated C{gzip} members are read in
+    full, and a truncated compressed file is read up to the point where the
+    data ends.
+
+    @param inputFile: The file-like object to read from.
+    @param blockSize: Optionally, the number of bytes to read at a time from
+        a compressed file.
+    @param prefix: Optionally, data already read from the start of the file,
+        for callers that need to sniff its format first.
+    @return: A generator that yields lines, including their trailing
+        newline.  The last line may not have one.
+    """
+    head = prefix
+    if len(head) < len(GZIP_MAGIC):
+        head += inputFile.read(len(GZIP_MAGIC) - len(head))
+    if not head.startswith(GZIP_MAGIC):
+        if head:
+            for line in (head + inputFile.readline()).splitlines(True):
+                yield line
+        for line in inputFile:
+            yield line
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = ''
+    data = head + inputFile.read(blockSize)
+    while data:
+        try:
+            pending += decompressor.decompress(data)
+        except zlib.error:
+            break
+        data = decompressor.unused_data
+        if data:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            data = inputFile.read(blockSize)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+
+def readOutputLines(path):
+    """Read lines from all the files written by a L{ProfileWriter}.
+
+    @param path: The path given to the L{ProfileWriter}.
+    @return: A generator that yields lines, in the order they were written.
+    """
+    for outputPath in getOutputPaths(path):
+        with open(outputPath, 'rb') as outputFile:
+            for line in readLines(outputFile):
+                yield line
+
+
+class ProfileWriter(object):
+    """A persistent, buffered writer for JSON profiles.
+
+    @param path: The path to write profiles to.  An existing file is
+        appended to.
+    @param bufferSize: Optionally, the size of the write buffer in bytes.
+        Defaults to 64KB.
+    @param flushEvery: Optionally, the number of profiles to write between
+        flushes.  By default the buffer is only flushed when it's full.
+    @param fsync: Optionally, a flag indicating whether to C{fsync} the file
+        when it's flushed.  Defaults to C{False}.
+    @param compress: Optionally, a flag indicating whether to C{gzip} the
+        output.  Defaults to C{False}.  An existing compressed file is
+        rotated rather than appended to, since it may be truncated.
+    @param maxBytes: Optionally, the number of uncompressed bytes to write
+        to a file before rotating it.
+    @param maxRecords: Optionally, the number of profiles to write to a file
+        before rotating it.
+    @param onFlush: Optionally, a function to call with no arguments after
+        each flush, when written profiles are known to be on disk.
+    """
+
+    def __init__(self, path, bufferSize=65536, flushEvery=None, fsync=False,
+                 compress=False, maxBytes=None, maxRecords=None,
+                 onFlush=None):
+        self._path = path
+        self._bufferSize = bufferSize
+        self._flushEvery = flushEvery
+        self._fsync = fsync
+        self._compress = compress
+        self._maxBytes = maxBytes
+        self._maxRecords = maxRecords
+        self._onFlush = onFlush
+        self._file = None
+        self._gzipFile = None
+        self._unflushed = 0
+        self._bytes = 0
+        self._records = 0
+        if compress and os.path.exists(path) and os.path.getsize(path):
+            self._rename()
+        self._open()
+
+    def write(self, profile):
+        """Write a profile.
+
+        @param profile: The C{dict} to write as JSON.
+        """
+        data = dumps(profile) + '\n'
+        (self._gzipFile or self._file).write(data)
+        self._bytes += len(data)
+        self._records += 1
+        self._unflushed += 1
+        if ((self._maxBytes is not None and self._bytes >= self._maxBytes) or
+                (self._maxRecords is not None and
+                 self._records >= self._maxRecords)):
+            self.rotate()
+        elif (self._flushEvery is not None and
+              self._unflushed >= self._flushEvery):
+            self.flush()
+
+    def flush(self):
+        """Flush buffered profiles to the file."""
+        if self._gzipFile is not None:
+            self._gzipFile.flush(zlib.Z_SYNC_FLUSH)
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        self._unflushed = 0
+        if self._onFlush is not None:
+            self._onFlush()
+
+    def rotate(self):
+        """Close the current file, rename it and start a new one."""
+        self._close()
+        self._rename()
+        self._open()
+
+    def close(self):
+        """Flush buffered profiles and close the file."""
+        self._close()
+
+    def _open(self):
+        """Open the output file."""
+        self._file = open(self._path, 'ab', self._bufferSize)
+        if self._compress:
+            self._gzipFile = GzipFile(fileobj=self._file, mode='ab')
+            self._bytes = 0
+        else:
+            self._bytes = os.path.getsize(self._path)
+        self._records = 0
+
+    def _close(self):
+        """Finish the current file and close it."""
+        if self._gzipFile is not None:
+            self._gzipFile.close()
+            self._gzipFile = None
+        self.flush()
+        self._file.close()
+
+    def _rename(self):
+        """Rename the current file with the next free numeric suffix."""
+        paths = getOutputPaths(self._path)
+        number = 1
+        if len(paths) > 1:
+            number = int(paths[-2].rsplit('.', 1)[1]) + 1
+        os.rename(self._path, '%s.%d' % (self._path, number))
@@ -0,0 +1,207 @@
+"""Composable streaming stages for moving PeerIndex profiles around.
+
+Each stage is a generator function that takes an iterable and yields items
+for the next stage, so stages can be chained to stream data from a source
+to one or more sinks in a single pass, holding only a bounded number of
+items in memory::
+
+  names = dedup(normalizeNames(readNames(open('names.txt'))))
+  profiles = writeJSONL(writer, fetchProfiles(peerindex, names))
+  for result in writeFluidinfo(batchWriter, mapTags(profiles)):
+      ...
+
+Sources yield screen names or profile C{dict}s, transforms rewrite the
+stream, and sinks write each item and pass it, or the result of writing it,
+on to the next stage.
+"""
+
+from json import loads
+import logging
+import sys
+
+from peerindex.archive import ARCHIVE_MAGIC, readArchive
+from peerindex.client import PeerIndexError, RateLimitError
+from peerindex.fluidinfo import getAboutQuery, getTagValues, getUpdatedAt
+from peerindex.names import normalizeName
+from peerindex.output import readLines
+
+
+def readNames(inputFile):
+    """Read Twitter screen names, one per line.
+
+    Blank lines are skipped.
+
+    @param inputFile: The file-like object to read from.  Plain and C{gzip}
+        compressed input are both supported.
+    @return: A generator that yields stripped screen names.
+    """
+    for line in readLines(inputFile):
+        name = line.strip()
+        if name:
+            yield name
+
+
+def readProfiles(inputFile):
+    """Read PeerIndex profiles from an archive or a file of JSON profiles.
+
+    Archives written by L{ArchiveWriter} are detected by their magic number.
+    Otherwise there's one JSON profile per line, and blank lines are
+    skipped.
+
+    @param inputFile: The file-like object to read from.  Archives, and
+        plain and C{gzip} compressed JSON, are supported.
+    @return: A generator that yields profile C{dict}s.
+    """
+    head = inputFile.read(len(ARCHIVE_MAGIC))
+    if head == ARCHIVE_MAGIC:
+        for profile in readArchive(inputFile, skipMagic=True):
+            yield profile
+        return
+    for line in readLines(inputFile, prefix=head):
+        if line.strip():
+            yield loads(line)
+
+
+def readPaths(paths, source):
+    """Read items from the specified files, or from stdin if there are none.
+
+    @param paths: A C{list} of paths to read.  C{-} reads stdin.
+    @param source: The source stage to read each file with, such as
+        L{readNames} or L{readProfiles}.
+    @return: A generator that yields the items from each file in turn.
+    """
+    for path in paths or ['-']:
+        if path == '-':
+            for item in source(sys.stdin):
+                yield item
+            continue
+        with open(path, 'rb') as inputFile:
+            for item in source(inputFile):
+                yield item
+
+
+def normalizeNames(names):
+    """Normalize Twitter screen names with L{normalizeName}.
+
+    @param names: An iterable of screen names.
+    @return: A generator that yields normalized screen names.
+    """
+    for name in names:
+        yield normalizeName(name)
+
+
+def dedup(items, key=None, seen=None):
+    """Skip items that have already been seen.
+
+    @param items: An iterable of hashable items.
+    @param key: Optionally, a function that returns the value to compare
+        for an item.  Defaults to comparing the items themselves.
+    @param seen: Optionally, the set-like object to record values in, such
+        as a L{SeenSet} or L{BloomFilter} to bound memory use.  Defaults to
+        a new C{set}.
+    @return: A generator that yields the first occurrence of each item.
+    """
+    if seen is None:
+        seen = set()
+    for item in items:
+        value = item if key is None else key(item)
+        if value not in seen:
+            seen.add(value)
+            yield item
+
+
+def getProfileName(profile):
+    """Get the normalized screen name from a PeerIndex profile.
+
+    This is suitable for use as the C{key} for L{dedup}.
+
+    @param profile: A profile C{dict}.
+    @return: The normalized screen name.
+    """
+    return normalizeName(profile['twitter'])
+
+
+def fetchProfiles(peerindex, names):
+    """Fetch the PeerIndex profile for each Twitter user.
+
+    Users that can't be fetched are logged and skipped.
+
+    @param peerindex: The L{PeerIndex} client to use.
+    @param names: An iterable of screen names.
+    @raise RateLimitError: Raised if the daily quota is exhausted and the
+        client can't pause until it resets.
+    @return: A generator that yields profile C{dict}s.
+    """
+    for name in names:
+        try:
+            profile = peerindex.get(name)
+        except RateLimitError:
+            raise
+        except PeerIndexError as error:
+            logging.warning("Couldn't get a profile for %s: %r"
+                            % (name, error))
+            continue
+        yield profile
+
+
+def writeJSONL(writer, profiles):
+    """Write profiles to a file of JSON profiles and pass them on.
+
+    The writer isn't closed, so it can be shared with other stages.
+
+    @param writer: The L{ProfileWriter} to write with.
+    @param profiles: An iterable of profile C{dict}s.
+    @return: A generator that yields each profile after it's written.
+    """
+    for profile in profiles:
+        writer.write(profile)
+        yield profile
+
+
+def mapTags(profiles, updatedAt=None):
+    """Map PeerIndex profiles to Fluidinfo tag values.
+
+    @param profiles: An iterable of profile C{dict}s.
+    @param updatedAt: Optionally, the value for the
+        C{peerindex.com/updated-at} tag.  Defaults to the time each profile
+        is mapped.
+    @return: A generator that yields C{(screenname, values)} 2-tuples, with
+        values as returned by L{getTagValues}.
+    """
+    for profile in profiles:
+        values = getTagValues(
+            profile, getUpdatedAt() if updatedAt is None else updatedAt)
+        yield profile['twitter'], values
+
+
+def writeFluidinfo(writer, items):
+    """Write tag values to Fluidinfo.
+
+    The writer is closed once all the items have been added, so any objects
+    still buffered are written.
+
+    @param writer: The L{BatchWriter}, L{ConcurrentBatchWriter} or
+        L{ChangedValuesWriter} to write with.
+    @param items: An iterable of C{(screenname, values)} 2-tuples, as
+        yielded by L{mapTags}.
+    @return: A generator that yields a L{WriteResult} for each object, keyed
+        by screen name, as it's written.
+    """
+    for screenname, values in items:
+        for result in writer.add(screenname, getAboutQuery(screenname),
+                                 values):
+            yield result
+    for result in writer.close():
+        yield result
+
+
+def consume(items):
+    """Run a pipeline to completion.
+
+    @param items: The iterable returned by the last stage.
+    @return: The number of items it yielded.
+    """
+    count = 0
+    for item in items:
+        count += 1
+    return count
@@ -0,0 +1,224 @@
+"""A pool of persistent HTTP connections shared by the API clients.
+
+Connection setup is a large part of the latency of a small API call, so
+L{ConnectionPool} keeps connections open between requests and shares them
+between the PeerIndex client and the Fluidinfo sessions::
+
+  pool = ConnectionPool(maxPerHost=4)
+  peerindex = PeerIndex('your-api-key', client=pool)
+  fdb = Fluid()
+  usePool(fdb, pool)
+
+Each connection is an C{httplib2.Http} instance, which keeps one keep-alive
+connection per host open, and is only used by one thread at a time.
+"""
+
+import httplib
+import socket
+from threading import BoundedSemaphore, Lock
+import time
+from urlparse import urlparse
+
+from httplib2 import DEFAULT_MAX_REDIRECTS, Http
+
+
+# Errors raised when a request is made on a connection the server has
+# closed.
+STALE_CONNECTION_ERRORS = (socket.error, httplib.HTTPException)
+
+
+class PooledConnection(object):
+    """An C{httplib2.Http} instance checked out of a L{ConnectionPool}.
+
+    @ivar http: The C{httplib2.Http}-compatible object.
+    @ivar lastUsed: The time the connection was last returned to the pool,
+        or C{None} if it's never been used.
+    """
+
+    def __init__(self, http):
+        self.http = http
+        self.lastUsed = None
+
+    def close(self):
+        """Close the underlying connections, if the client supports it."""
+        close = getattr(self.http, 'close', None)
+        if close is not None:
+            close()
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of keep-alive HTTP connections.
+
+    The pool has the same C{request} method as C{httplib2.Http}, so it can
+    be passed to L{PeerIndex} as its client.  At most C{maxPerHost} requests
+    are made to a host at once, and callers block until a connection is
+    free.
+
+    Servers close idle keep-alive connections.  If a request fails on a
+    connection that's been used before, the connection is discarded and the
+    request is retried once on a new one.  Connections idle for longer than
+    C{maxIdle} seconds are discarded before they're used.
+
+    @param maxPerHost: Optionally, the maximum number of connections to each
+        host.  Defaults to 4.
+    @param maxIdle: Optionally, the number of seconds after which an idle
+        connection is discarded instead of reused.  By default connections
+        are always reused.
+    @param timeout: Optionally, the socket timeout in seconds for new
+        connections.
+    @param httpFactory: Optionally, a function that returns a new
+        C{httplib2.Http}-compatible object.  It's used for testing purposes.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @ivar created: The number of connections created.
+    @ivar reused: The number of requests made on a reused connection.
+    @ivar retried: The number of requests retried after a stale connection
+        failed.
+    """
+
+    def __init__(self, maxPerHost=4, maxIdle=None, timeout=None,
+                 httpFactory=None, timeModule=None):
+        self._maxPerHost = maxPerHost
+        self._maxIdle = maxIdle
+        self._httpFactory = httpFactory or (lambda: Http(timeout=timeout))
+        self._timeModule = timeModule or time
+        self._lock = Lock()
+        self._hosts = {}
+        self.created = 0
+        self.reused = 0
+        self.retried = 0
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=DEFAULT_MAX_REDIRECTS, connection_type=None):
+        """Make an HTTP request on a pooled connection.
+
+        @param uri: The absolute URI to request.
+        @param method: Optionally, the HTTP method.  Defaults to C{GET}.
+        @param body: Optionally, the request body.
+        @param headers: Optionally, a C{dict} of request headers.
+        @param redirections: Optionally, the maximum number of redirects to
+            follow.
+        @param connection_type: Optionally, the C{httplib} connection class
+            to use.
+        @raise socket.error: Raised if the request fails on a new
+            connection.
+        @return: A C{(response, content)} 2-tuple, as returned by
+            C{httplib2.Http.request}.
+        """
+        semaphore, idle = self._getHost(uri)
+        with semaphore:
+            connection = self._checkout(idle)
+            try:
+                result = connection.http.request(
+                    uri, method, body, headers, redirections,
+                    connection_type)
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if connection.lastUsed is None:
+                    raise
+                self.retried += 1
+                connection = self._create()
+                result = connection.http.request(
+                    uri, method, body, headers, redirections,
+                    connection_type)
+            connection.lastUsed = self._timeModule.time()
+            with self._lock:
+                idle.append(connection)
+            return result
+
+    def close(self):
+        """Close all the idle connections in the pool."""
+        with self._lock:
+            for semaphore, idle in self._hosts.itervalues():
+                while idle:
+                    idle.pop().close()
+
+    def _getHost(self, uri):
+        """Get the semaphore and idle connections for the host of a URI.
+
+        @return: A C{(semaphore, idle)} 2-tuple, where C{idle} is a C{list}
+            of L{PooledConnection}s, most recently used last.
+        """
+        url = urlparse(uri)
+        key = (url.scheme, url.netloc)
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                host = self._hosts[key] = (
+                    BoundedSemaphore(self._maxPerHost), [])
+            return host
+
+    def _checkout(self, idle):
+        """Take the most recently used connection, or create a new one.
+
+        @param idle: The C{list} of idle connections for the host.
+        @return: A L{PooledConnection}.
+        """
+        now = self._timeModule.time()
+        with self._lock:
+            while idle:
+                connection = idle.pop()
+                if (self._maxIdle is not None and
+                        now - connection.lastUsed > self._maxIdle):
+                    connection.close()
+                    continue
+                self.reused += 1
+                return connection
+        return self._create()
+
+    def _create(self):
+        """Create a new connection."""
+        with self._lock:
+            self.created += 1
+        return PooledConnection(self._httpFactory())
+
+
+class PooledResponse(object):
+    """A C{requests}-style response for a request made by a L{SessionAdapter}.
+
+    @ivar status_code: The HTTP status code, as an C{int}.
+    @ivar headers: A C{dict} of the response headers, with lowercase names.
+    @ivar text: The body of the response.
+    """
+
+    def __init__(self, headers, content):
+        self.status_code = int(headers['status'])
+        self.headers = headers
+        self.text = content
+        self.content = content
+
+
+class SessionAdapter(object):
+    """Make C{fom} send its requests through a L{ConnectionPool}.
+
+    C{fom} makes requests with the C{request} method of a C{requests}
+    session, which this class implements.
+
+    @param pool: The L{ConnectionPool} to use.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def request(self, method, url, data=None, headers=None):
+        """Make a request.
+
+        @param method: The HTTP method.
+        @param url: The absolute URL to request.
+        @param data: Optionally, the request body.
+        @param headers: Optionally, a C{dict} of request headers.
+        @return: A L{PooledResponse}.
+        """
+        headers, content = self._pool.request(url, method, data, headers)
+        return PooledResponse(headers, content)
+
+
+def usePool(fdb, pool):
+    """Make a C{fom.session.Fluid} session use a L{ConnectionPool}.
+
+    @param fdb: The C{fom.session.Fluid} session.
+    @param pool: The L{ConnectionPool} to use.
+    @return: The session.
+    """
+    fdb.db.session = SessionAdapter(pool)
+    return fdb
@@ -0,0 +1,281 @@
+"""Rate limiters for the PeerIndex API.
+
+The PeerIndex API allows one call per second and a fixed number of calls per
+day.  Every response includes headers describing the daily quota::
+
+  x-ratelimit-limit: 10000
+  x-ratelimit-remaining: 9998
+  x-ratelimit-reset: 1316386800
+
+A limiter is asked for permission before each call and is told about each
+response.  L{TokenBucket} enforces the per second limit and ignores the
+headers.  L{QuotaScheduler} combines a L{TokenBucket} with a L{QuotaTracker}
+to spread the remaining daily quota evenly until it resets, and to pause
+until the reset once the quota is exhausted.  Spreading can be turned off
+for runs that need fewer calls than the quota allows, so they go as fast as
+the L{TokenBucket} allows and only pause if the quota runs out.
+"""
+
+import time
+
+
+class Limiter(object):
+    """Base class for rate limiters.
+
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    """
+
+    def __init__(self, timeModule=None):
+        self._timeModule = timeModule or time
+
+    def reserve(self):
+        """Reserve permission to make a call.
+
+        @return: The number of seconds to wait before making the call.
+        """
+        raise NotImplementedError()
+
+    def peek(self):
+        """Get the delay before a call could be made, without reserving it.
+
+        @return: The number of seconds L{reserve} would return now.
+        """
+        return 0.0
+
+    def wait(self):
+        """Reserve permission to make a call and sleep until it's granted.
+
+        @return: The number of seconds slept.
+        """
+        delay = self.reserve()
+        if delay <= 0:
+            return 0.0
+        self._timeModule.sleep(delay)
+        return delay
+
+    def update(self, headers):
+        """Observe the headers of an API response.
+
+        @param headers: The C{httplib2}-style response headers.
+        """
+
+    def exhausted(self):
+        """Observe a L{RateLimitError} raised by the API.
+
+        @return: C{True} if the call should be retried, because the limiter
+            will pause until the quota resets the next time it's used,
+            otherwise C{False}.
+        """
+        return False
+
+
+class TokenBucket(Limiter):
+    """A limiter that allows a burst of calls and then a steady call rate.
+
+    Tokens are added to the bucket at C{rate} per second, up to C{capacity}.
+    Each call takes one token.  A call made when the bucket is empty is
+    scheduled for the time its token will be added.
+
+    @param rate: Optionally, the number of calls allowed per second.
+        Defaults to 1.0.
+    @param capacity: Optionally, the maximum number of calls that can be
+        made at once.  Defaults to 1.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    """
+
+    def __init__(self, rate=1.0, capacity=1, timeModule=None):
+        super(TokenBucket, self).__init__(timeModule)
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._lastTime = None
+
+    def reserve(self):
+        """Take a token from the bucket.
+
+        @return: The number of seconds until the token is available.
+        """
+        now = self._timeModule.time()
+        if self._lastTime is not None:
+            self._tokens = min(self._capacity,
+                               self._tokens + (now - self._lastTime) *
+                               self._rate)
+        self._lastTime = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self._rate
+
+    def peek(self):
+        """Get the delay before a token would be available.
+
+        @return: The number of seconds L{reserve} would return now.
+        """
+        tokens = self._tokens
+        if self._lastTime is not None:
+            tokens = min(self._capacity,
+                         tokens + (self._timeModule.time() - self._lastTime) *
+                         self._rate)
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self._rate
+
+    def postpone(self, when):
+        """Record that the last reserved call will be made later than granted.
+
+        The token taken by L{reserve} is taken at C{when} instead, so the
+        tokens that would have been added while the call was delayed aren't
+        available to the calls after it.
+
+        @param when: The time the call will be made, in seconds since the
+            epoch.
+        """
+        if self._lastTime is None or when <= self._lastTime:
+            return
+        tokens = min(self._capacity,
+                     self._tokens + 1 + (when - self._lastTime) * self._rate)
+        self._tokens = tokens - 1
+        self._lastTime = when
+
+
+class QuotaTracker(object):
+    """Track the daily quota reported by the PeerIndex API.
+
+    @ivar limit: The total number of calls allowed per day, or C{None} if it
+        isn't known.
+    @ivar remaining: The number of calls left in the current day, or C{None}
+        if it isn't known.
+    @ivar reset: The time, in seconds since the epoch, when the quota
+        resets, or C{None} if it isn't known.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+
+    def update(self, headers):
+        """Update the quota from the headers of an API response.
+
+        Responses that don't include the rate limit headers are ignored.
+
+        @param headers: The C{httplib2}-style response headers.
+        """
+        try:
+            limit = int(headers['x-ratelimit-limit'])
+            remaining = int(headers['x-ratelimit-remaining'])
+            reset = float(headers['x-ratelimit-reset'])
+        except (KeyError, ValueError):
+            return
+        self.limit, self.remaining, self.reset = limit, remaining, reset
+
+    def consume(self):
+        """Record that a call is about to be made."""
+        if self.remaining:
+            self.remaining -= 1
+
+    def exhaust(self):
+        """Record that the API reported the quota as exhausted."""
+        self.remaining = 0
+
+    def renew(self):
+        """Record that the quota has reset.
+
+        The reset time of the new quota isn't known until the next response
+        is received.
+        """
+        self.remaining = self.limit
+        self.reset = None
+
+
+class QuotaScheduler(Limiter):
+    """A limiter that spreads the remaining daily quota until it resets.
+
+    Calls are never made faster than the L{TokenBucket} allows.  When the
+    server has reported the quota, calls are also spaced evenly so that the
+    remaining calls last until the reset time, unless spreading is turned
+    off.  When the quota is exhausted calls are delayed until it resets.
+
+    @param bucket: Optionally, the L{TokenBucket} that enforces the per
+        second limit.  Defaults to one call per second.
+    @param tracker: Optionally, the L{QuotaTracker} to use.
+    @param pause: Optionally, a flag indicating whether to pause until the
+        quota resets when it runs out.  Defaults to C{True}.  If C{False},
+        L{exhausted} returns C{False} so the L{RateLimitError} is raised.
+    @param spread: Optionally, a flag indicating whether to spread the
+        remaining calls until the quota resets.  Defaults to C{True}.  If
+        C{False}, calls are only limited by the L{TokenBucket} until the
+        quota runs out.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    """
+
+    def __init__(self, bucket=None, tracker=None, pause=True, spread=True,
+                 timeModule=None):
+        super(QuotaScheduler, self).__init__(timeModule)
+        self.bucket = bucket or TokenBucket(timeModule=self._timeModule)
+        self.tracker = tracker or QuotaTracker()
+        self._pause = pause
+        self._spread = spread
+        self._nextCallTime = None
+
+    def reserve(self):
+        """Reserve the next call slot that honours the quota.
+
+        @return: The number of seconds to wait before making the call.
+        """
+        now = self._timeModule.time()
+        granted = start = now + self.bucket.reserve()
+        tracker = self.tracker
+        if tracker.reset is not None:
+            if tracker.remaining == 0 and self._pause:
+                start = max(start, tracker.reset)
+            if tracker.reset <= start:
+                tracker.renew()
+                self._nextCallTime = None
+            elif tracker.remaining and self._spread:
+                if self._nextCallTime is not None:
+                    start = max(start, self._nextCallTime)
+                interval = (tracker.reset - start) / tracker.remaining
+                self._nextCallTime = start + interval
+        if start > granted:
+            # The bucket's token is taken when the call is actually made,
+            # so calls after a pause for the quota to reset don't burst.
+            self.bucket.postpone(start)
+        tracker.consume()
+        return start - now
+
+    def peek(self):
+        """Get the delay before the next call slot, without reserving it.
+
+        @return: The number of seconds L{reserve} would return now.
+        """
+        now = self._timeModule.time()
+        start = now + self.bucket.peek()
+        tracker = self.tracker
+        if tracker.reset is not None and tracker.reset > start:
+            if tracker.remaining == 0 and self._pause:
+                start = tracker.reset
+            elif tracker.remaining and self._nextCallTime is not None:
+                start = max(start, self._nextCallTime)
+        return start - now
+
+    def update(self, headers):
+        """Update the quota from the headers of an API response.
+
+        @param headers: The C{httplib2}-style response headers.
+        """
+        self.tracker.update(headers)
+
+    def exhausted(self):
+        """Observe a L{RateLimitError} raised by the API.
+
+        @return: C{True} if pausing is enabled and the reset time of the
+            exhausted quota is in the future, otherwise C{False}.
+        """
+        self.tracker.exhaust()
+        reset = self.tracker.reset
+        return (self._pause and reset is not None and
+                reset > self._timeModule.time())
@@ -0,0 +1,197 @@
+"""Choose which profiles to refresh with a limited daily quota.
+
+When the quota doesn't cover every tracked user each day, L{RefreshIndex}
+decides who to refresh.  It keeps a local record of when each user's profile
+was last refreshed, mirroring C{peerindex.com/updated-at}, and their last
+PeerIndex score.  Each day it produces a work list of the users most in need
+of a refresh, sized to the quota left for the day::
+
+  index = RefreshIndex('refresh.db')
+  index.track(readNames(open('names.txt')))
+  limit = index.getRemainingQuota(10000, time.time())
+  for name in index.getWorkList(limit, time.time()):
+      ...
+  index.close()
+
+Users that have never been refreshed come first.  The rest are ordered by
+how long ago they were refreshed, multiplied by C{1 + weight * score / 100},
+so stale users with high scores come before stale users with low scores.
+
+Users that can't be fetched, such as unknown users, are recorded with
+L{RefreshIndex.recordFailure} and left out of the work lists until a retry
+delay has passed.  The delay doubles with each consecutive failure, so
+users that keep failing don't use the quota every day.
+"""
+
+import sqlite3
+
+from peerindex.names import normalizeName
+
+
+DAY = 24 * 60 * 60
+
+
+class RefreshIndex(object):
+    """A persistent record of when each user's profile was last refreshed.
+
+    @param path: The path to the SQLite database file.  It's created if it
+        doesn't exist.
+    @param commitEvery: Optionally, the number of changes to make between
+        commits.  Defaults to 1000.
+    @param retryDelay: Optionally, the number of seconds after a user's
+        first failure before they're included in a work list again.  It
+        doubles with each further consecutive failure.  Defaults to a day.
+    @param maxRetryDelay: Optionally, the largest number of seconds to wait
+        after a failure.  Defaults to 30 days.
+    """
+
+    def __init__(self, path, commitEvery=1000, retryDelay=DAY,
+                 maxRetryDelay=30 * DAY):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS refreshes ('
+            'name TEXT PRIMARY KEY, refreshed_at REAL, peerindex REAL, '
+            'failed_at REAL, failures INTEGER NOT NULL DEFAULT 0, '
+            'retry_at REAL)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS refreshes_refreshed_at '
+            'ON refreshes (refreshed_at)')
+        self._commitEvery = commitEvery
+        self._retryDelay = retryDelay
+        self._maxRetryDelay = maxRetryDelay
+        self._uncommitted = 0
+
+    def track(self, names):
+        """Start tracking users, as never refreshed if they're new.
+
+        @param names: An iterable of screen names.
+        @return: The number of users that weren't tracked before.
+        """
+        count = 0
+        for name in names:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO refreshes (name) VALUES (?)',
+                (normalizeName(name),))
+            count += cursor.rowcount
+            self._changed()
+        return count
+
+    def record(self, name, refreshedAt, score=None):
+        """Record that a user's profile has been refreshed.
+
+        Any failures recorded for the user are forgotten.
+
+        @param name: The screen name of the Twitter user.
+        @param refreshedAt: The time of the refresh, in seconds since the
+            epoch, such as the value of C{peerindex.com/updated-at}.
+        @param score: Optionally, the user's C{peerindex} score.  By default
+            the last recorded score is kept.
+        """
+        name = normalizeName(name)
+        cursor = self._connection.execute(
+            'UPDATE refreshes SET refreshed_at = ?, '
+            'peerindex = COALESCE(?, peerindex), failures = 0, '
+            'retry_at = NULL WHERE name = ?',
+            (refreshedAt, score, name))
+        if not cursor.rowcount:
+            self._connection.execute(
+                'INSERT INTO refreshes (name, refreshed_at, peerindex) '
+                'VALUES (?, ?, ?)', (name, refreshedAt, score))
+        self._changed()
+
+    def recordFailure(self, name, failedAt):
+        """Record that a user's profile couldn't be fetched.
+
+        The user is left out of work lists until the retry delay, doubled
+        for each earlier consecutive failure, has passed.
+
+        @param name: The screen name of the Twitter user.
+        @param failedAt: The time of the failed call, in seconds since the
+            epoch.
+        """
+        name = normalizeName(name)
+        row = self._connection.execute(
+            'SELECT failures FROM refreshes WHERE name = ?',
+            (name,)).fetchone()
+        failures = 1 if row is None else row[0] + 1
+        delay = min(self._maxRetryDelay,
+                    self._retryDelay * 2 ** (failures - 1))
+        if row is None:
+            self._connection.execute(
+                'INSERT INTO refreshes (name, failed_at, failures, retry_at) '
+                'VALUES (?, ?, ?, ?)',
+                (name, failedAt, failures, failedAt + delay))
+        else:
+            self._connection.execute(
+                'UPDATE refreshes SET failed_at = ?, failures = ?, '
+                'retry_at = ? WHERE name = ?',
+                (failedAt, failures, failedAt + delay, name))
+        self._changed()
+
+    def recordProfile(self, profile, refreshedAt):
+        """Record that a user's profile has been refreshed.
+
+        @param profile: The profile C{dict} returned by the PeerIndex API.
+        @param refreshedAt: The time of the refresh, in seconds since the
+            epoch.
+        """
+        self.record(profile['twitter'], refreshedAt, profile.get('peerindex'))
+
+    def getRemainingQuota(self, quota, now):
+        """Estimate the number of calls left from a daily quota.
+
+        Every refresh, and every failure, recorded in the last day is
+        assumed to have spent a call.
+
+        @param quota: The total number of calls allowed per day.
+        @param now: The current time, in seconds since the epoch.
+        @return: The number of calls left.
+        """
+        used = self._connection.execute(
+            'SELECT COUNT(*) FROM refreshes '
+            'WHERE refreshed_at > ? OR failed_at > ?',
+            (now - DAY, now - DAY)).fetchone()[0]
+        return max(0, quota - used)
+
+    def getWorkList(self, limit, now, minAge=0, weight=1.0):
+        """Get the users most in need of a refresh.
+
+        Users whose last attempt failed are skipped until their retry delay
+        has passed.
+
+        @param limit: The maximum number of users to return.
+        @param now: The current time, in seconds since the epoch.
+        @param minAge: Optionally, the number of seconds after a refresh
+            before a user can be refreshed again.  Defaults to 0.
+        @param weight: Optionally, how strongly a higher C{peerindex} score
+            raises a user's priority.  C{0} orders users by staleness alone.
+            Defaults to 1.0.
+        @return: A C{list} of normalized screen names, highest priority
+            first.
+        """
+        self.commit()
+        rows = self._connection.execute(
+            'SELECT name FROM refreshes '
+            'WHERE (refreshed_at IS NULL OR refreshed_at <= ?) '
+            'AND (retry_at IS NULL OR retry_at <= ?) '
+            'ORDER BY refreshed_at IS NOT NULL, '
+            '(? - refreshed_at) * (1 + ? * COALESCE(peerindex, 0) / 100.0) '
+            'DESC, name LIMIT ?',
+            (now - minAge, now, now, weight, limit))
+        return [row[0] for row in rows]
+
+    def commit(self):
+        """Commit changes to disk."""
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        """Commit changes and close the database."""
+        self.commit()
+        self._connection.close()
+
+    def _changed(self):
+        """Count a change, committing if enough have been made."""
+        self._uncommitted += 1
+        if self._uncommitted >= self._commitEvery:
+            self.commit()
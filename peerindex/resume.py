@@ -0,0 +1,149 @@
+"""Support for resuming interrupted downloads.
+
+A download writes one JSON profile per line to its output file.  When it's
+restarted the names already in the output can be skipped, so no API calls
+are spent on work that's already done.  Scanning a large output file takes a
+while, so a L{Checkpoint} file listing one completed name per line can be
+kept alongside it and read instead.  The checkpoint also lists users that
+don't exist, so they aren't looked up again either.  Output written by a
+L{ProfileWriter}, including rotated and compressed files, can be scanned.
+"""
+
+from json import loads
+import os
+import re
+
+from peerindex.names import normalizeName
+from peerindex.output import readOutputLines
+
+
+# Marks a checkpoint line naming a user that can never be downloaded.
+_FAILED_MARKER = '!'
+
+_TWITTER_PATTERN = re.compile(r'"twitter": "([^"\\]*)"')
+
+
+def getProfileName(line):
+    """Get the normalized Twitter screen name from a line of JSON output.
+
+    The name is found with a regular expression when possible, which is much
+    faster than decoding the whole profile.
+
+    @param line: A line containing a JSON profile.
+    @return: The normalized screen name, or C{None} if the line isn't a
+        valid profile.
+    """
+    match = _TWITTER_PATTERN.search(line)
+    if match is not None:
+        return normalizeName(match.group(1))
+    try:
+        return normalizeName(loads(line)['twitter'])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def loadCompletedNames(outputPath, checkpointPath=None):
+    """Load the names of the users whose profiles have been downloaded, or
+    that can never be downloaded because they don't exist.
+
+    @param outputPath: The path to the JSON output file of the download.
+        Rotated files are also read.
+    @param checkpointPath: Optionally, the path to a L{Checkpoint} file.  If
+        it lists any names it's read instead of the output file.  An empty
+        checkpoint, left by a download that stopped before its first flush,
+        is ignored.
+    @return: A C{set} of normalized screen names.
+    """
+    names = set()
+    if checkpointPath is not None and os.path.exists(checkpointPath):
+        with open(checkpointPath, 'r') as checkpointFile:
+            for line in checkpointFile:
+                if line.endswith('\n'):
+                    names.add(line[:-1].lstrip(_FAILED_MARKER))
+    if not names:
+        for line in readOutputLines(outputPath):
+            name = getProfileName(line)
+            if name is not None:
+                names.add(name)
+    return names
+
+
+def repairOutput(path):
+    """Remove a partial trailing line left in a file by a crash.
+
+    @param path: The path to the file to repair.
+    @return: The number of bytes removed.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb+') as outputFile:
+        outputFile.seek(0, os.SEEK_END)
+        size = outputFile.tell()
+        end = size
+        while end > 0:
+            blockSize = min(end, 4096)
+            outputFile.seek(end - blockSize)
+            block = outputFile.read(blockSize)
+            if end == size and block.endswith('\n'):
+                return 0
+            index = block.rfind('\n')
+            if index != -1:
+                end = end - blockSize + index + 1
+                break
+            end -= blockSize
+        outputFile.truncate(end)
+    return size - end
+
+
+class Checkpoint(object):
+    """A sidecar file recording the names of completed users.
+
+    Users that fail permanently, such as unknown users, are recorded too,
+    on lines starting with C{!}, so resuming doesn't spend calls on them.
+
+    Names are held in memory until L{flush} is called, and then appended to
+    the file, one per line.  Flushing after the corresponding profiles have
+    been flushed ensures the checkpoint never lists a profile that isn't in
+    the output.
+
+    A new or empty checkpoint is seeded with the names already completed,
+    such as those found by scanning the output, so it's complete from the
+    start and the output never has to be scanned again.
+
+    @param path: The path to the checkpoint file.
+    @param completed: Optionally, an iterable of the normalized names of the
+        users already completed, written if the checkpoint is empty.
+    """
+
+    def __init__(self, path, completed=()):
+        repairOutput(path)
+        self._file = open(path, 'a')
+        self._pending = []
+        if not os.path.getsize(path):
+            self._pending.extend(name + '\n' for name in completed)
+            self.flush()
+
+    def add(self, name):
+        """Record that a user has been completed.
+
+        @param name: The screen name of the user.
+        """
+        self._pending.append(normalizeName(name) + '\n')
+
+    def addFailure(self, name):
+        """Record that a user can never be downloaded.
+
+        @param name: The screen name of the user.
+        """
+        self._pending.append(_FAILED_MARKER + normalizeName(name) + '\n')
+
+    def flush(self):
+        """Write recorded names to disk."""
+        if self._pending:
+            self._file.writelines(self._pending)
+            self._file.flush()
+            self._pending = []
+
+    def close(self):
+        """Close the checkpoint file, without writing unflushed names."""
+        self._file.close()
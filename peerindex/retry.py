@@ -0,0 +1,246 @@
+"""Retry failed PeerIndex calls later, with exponential backoff and jitter.
+
+Retrying a failed call straight away usually fails again and spends another
+rate limit slot, so L{fetchWithRetries} puts users whose calls fail in a
+L{RetryScheduler} and carries on with fresh users, retrying each failed user
+once its backoff delay has passed::
+
+  scheduler = RetryScheduler(maxAttempts=4)
+  deadLetters = DeadLetters('failed.txt')
+  for profile in fetchWithRetries(peerindex, names, scheduler, deadLetters):
+      ...
+  deadLetters.close()
+
+Errors are classified by L{getErrorKind}.  Users that still fail after
+C{maxAttempts} calls are written to a dead-letter file, one screen name per
+line, which can be used as the input of a later run.
+"""
+
+import heapq
+import httplib
+import logging
+import random
+import socket
+import time
+
+from peerindex.client import (
+    CredentialsError, PeerIndexError, RateLimitError, UnknownUserError)
+
+
+# Errors that stop the run, since every other call will fail too.
+FATAL_ERRORS = (RateLimitError, CredentialsError)
+
+# Errors that won't go away if the call is retried.
+PERMANENT_ERRORS = (UnknownUserError,)
+
+# Errors that may not happen if the call is retried.
+RETRYABLE_ERRORS = (PeerIndexError, socket.error, httplib.HTTPException)
+
+
+def getErrorKind(error):
+    """Classify an error raised by L{PeerIndex.get}.
+
+    @param error: The exception.
+    @return: C{'fatal'}, C{'permanent'}, C{'retryable'}, or C{None} for
+        errors that aren't expected from a call, which shouldn't be caught.
+    """
+    if isinstance(error, FATAL_ERRORS):
+        return 'fatal'
+    if isinstance(error, PERMANENT_ERRORS):
+        return 'permanent'
+    if isinstance(error, RETRYABLE_ERRORS):
+        return 'retryable'
+    return None
+
+
+class RetryScheduler(object):
+    """A queue of failed users, ordered by the time they can be retried.
+
+    The delay before the Nth retry is C{baseDelay * 2 ** (N - 1)}, up to
+    C{maxDelay}, with half of it replaced by random jitter so users that
+    failed together aren't all retried together.
+
+    @param maxAttempts: Optionally, the number of calls made for a user
+        before giving up.  Defaults to 4.
+    @param baseDelay: Optionally, the number of seconds before the first
+        retry.  Defaults to 5.0.
+    @param maxDelay: Optionally, the maximum number of seconds between
+        retries.  Defaults to 300.0.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @param randomModule: Optionally, a C{random}-compatible module object.
+        It's used for testing purposes.
+    """
+
+    def __init__(self, maxAttempts=4, baseDelay=5.0, maxDelay=300.0,
+                 timeModule=None, randomModule=None):
+        self.maxAttempts = maxAttempts
+        self._baseDelay = baseDelay
+        self._maxDelay = maxDelay
+        self._timeModule = timeModule or time
+        self._randomModule = randomModule or random
+        self._queue = []
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def getDelay(self, attempts):
+        """Get the backoff delay after a number of failed calls.
+
+        @param attempts: The number of calls made for the user so far.
+        @return: The number of seconds to wait before the next call.
+        """
+        delay = min(self._maxDelay, self._baseDelay * 2 ** (attempts - 1))
+        return delay / 2 + self._randomModule.random() * delay / 2
+
+    def schedule(self, name, attempts):
+        """Queue a user to be retried after its backoff delay.
+
+        @param name: The screen name of the Twitter user.
+        @param attempts: The number of calls made for the user so far.
+        @return: C{False} if the user has used up its attempts and wasn't
+            queued, otherwise C{True}.
+        """
+        if attempts >= self.maxAttempts:
+            return False
+        retryAt = self._timeModule.time() + self.getDelay(attempts)
+        self._sequence += 1
+        heapq.heappush(self._queue, (retryAt, self._sequence, name, attempts))
+        return True
+
+    def pop(self):
+        """Take the next user whose backoff delay has passed.
+
+        @return: A C{(name, attempts)} 2-tuple, or C{None} if no user is
+            ready to be retried.
+        """
+        if self._queue and self._queue[0][0] <= self._timeModule.time():
+            retryAt, sequence, name, attempts = heapq.heappop(self._queue)
+            return name, attempts
+        return None
+
+    def wait(self):
+        """Sleep until the next user is ready to be retried.
+
+        @return: The number of seconds slept.
+        """
+        delay = self._queue[0][0] - self._timeModule.time()
+        if delay <= 0:
+            return 0.0
+        self._timeModule.sleep(delay)
+        return delay
+
+    def drain(self):
+        """Remove all the queued users.
+
+        @return: A C{list} of the queued screen names, in retry order.
+        """
+        names = [item[2] for item in sorted(self._queue)]
+        self._queue = []
+        return names
+
+
+class DeadLetters(object):
+    """A file of users that couldn't be fetched, one screen name per line.
+
+    The file is appended to and flushed after each name, so it can be fed
+    back in as the input of a later run.
+
+    @param path: The path of the file.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'a')
+        self.count = 0
+
+    def add(self, name):
+        """Record a user that couldn't be fetched.
+
+        @param name: The screen name of the Twitter user.
+        """
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        self._file.write(name + '\n')
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+
+def fetchWithRetries(peerindex, names, scheduler, deadLetters=None,
+                     onFailure=None, onPermanentFailure=None):
+    """Fetch PeerIndex profiles, retrying failed users later.
+
+    Users that are ready to be retried are fetched before fresh ones.  When
+    there are no fresh users left, it sleeps until the next retry is due.
+    If fetching stops early, users still waiting to be retried are written
+    to the dead-letter file.
+
+    @param peerindex: The L{PeerIndex} client to use.
+    @param names: An iterable of screen names.
+    @param scheduler: The L{RetryScheduler} to queue failed users in.
+    @param deadLetters: Optionally, the L{DeadLetters} to record users that
+        can't be fetched in.  By default they're only logged.
+    @param onFailure: Optionally, a function to call with the screen name
+        of each user that can't be fetched, after a permanent error or
+        after their last attempt.
+    @param onPermanentFailure: Optionally, a function to call with the
+        screen name of each user that fails with a permanent error, such as
+        an unknown user, before C{onFailure} is called.
+    @raise RateLimitError: Raised if the daily quota is exhausted and the
+        client can't pause until it resets.
+    @raise CredentialsError: Raised if the API key is invalid.
+    @return: A generator that yields profile C{dict}s.
+    """
+    names = iter(names)
+    try:
+        while True:
+            retry = scheduler.pop()
+            if retry is not None:
+                name, attempts = retry
+            else:
+                name, attempts = next(names, None), 0
+                if name is None:
+                    if not scheduler:
+                        return
+                    scheduler.wait()
+                    continue
+            attempts += 1
+            try:
+                profile = peerindex.get(name)
+            except Exception as error:
+                kind = getErrorKind(error)
+                if kind in (None, 'fatal'):
+                    raise
+                errorName = error.__class__.__name__
+                if kind == 'permanent':
+                    logging.warning("Couldn't get a profile for %s: %s"
+                                    % (name, errorName))
+                    if onPermanentFailure is not None:
+                        onPermanentFailure(name)
+                elif scheduler.schedule(name, attempts):
+                    logging.info('Retrying %s after %s (attempt %d of %d)'
+                                 % (name, errorName, attempts,
+                                    scheduler.maxAttempts))
+                    continue
+                else:
+                    logging.warning('Giving up on %s after %d attempts: %s'
+                                    % (name, attempts, errorName))
+                    if deadLetters is not None:
+                        deadLetters.add(name)
+                if onFailure is not None:
+                    onFailure(name)
+                continue
+            logging.info('Retrieved profile for %s' % name)
+            yield profile
+    finally:
+        pending = scheduler.drain()
+        if pending:
+            logging.warning('Stopped with %d users waiting to be retried'
+                            % len(pending))
+            if deadLetters is not None:
+                for name in pending:
+                    deadLetters.add(name)
@@ -0,0 +1,111 @@
+"""Split a run between several processes or machines by hashing names.
+
+Each Twitter user belongs to exactly one of C{N} shards, chosen from a hash
+of the normalized screen name, so every process given the same C{N} agrees
+on the partition without any coordination::
+
+  names = filterShard(normalizeNames(readNames(inputFile)), 2, 4)
+
+Each shard writes its own output, to a path from L{getShardPath}, and can be
+restarted on its own.  L{mergeShards} then streams the outputs of all the
+shards into one deduplicated stream of profiles.
+"""
+
+from argparse import ArgumentTypeError
+from hashlib import md5
+import logging
+
+from peerindex.output import getOutputPaths
+from peerindex.pipeline import dedup, getProfileName, readProfiles
+
+
+def parseShard(value):
+    """Parse a C{--shard} option.
+
+    @param value: A C{str} like C{2/4}, for the second of four shards.
+    @raise ArgumentTypeError: Raised if the value isn't a valid shard.
+    @return: A C{(index, count)} 2-tuple, where C{index} is between 1 and
+        C{count}.
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ArgumentTypeError('%r is not of the form i/N' % value)
+    if not 1 <= index <= count:
+        raise ArgumentTypeError('%r is not a shard between 1/%d and %d/%d'
+                                % (value, count, count, count))
+    return index, count
+
+
+def getShard(name, count):
+    """Get the shard a normalized screen name belongs to.
+
+    The hash is stable across processes, machines and Python versions.
+
+    @param name: The normalized screen name.
+    @param count: The number of shards.
+    @return: The shard index, between 1 and C{count}.
+    """
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return int(md5(name).hexdigest()[:8], 16) % count + 1
+
+
+def filterShard(items, index, count, key=None):
+    """Skip items that belong to other shards.
+
+    @param items: An iterable of normalized screen names, or of items that
+        C{key} gets one from.
+    @param index: The index of this shard, between 1 and C{count}.
+    @param count: The number of shards.
+    @param key: Optionally, a function that returns the normalized screen
+        name for an item, such as L{getProfileName}.
+    @return: A generator that yields the items in this shard.
+    """
+    for item in items:
+        name = item if key is None else key(item)
+        if getShard(name, count) == index:
+            yield item
+
+
+def getShardPath(path, index, count):
+    """Get the path a shard writes to, such as C{profiles.json.shard-2-of-4}.
+
+    @param path: The path given for the whole run.
+    @param index: The index of the shard, between 1 and C{count}.
+    @param count: The number of shards.
+    @return: The path for the shard.
+    """
+    return '%s.shard-%d-of-%d' % (path, index, count)
+
+
+def mergeShards(path, count, seen=None):
+    """Read the profiles written by all the shards of a run.
+
+    Rotated output files are read in the order they were written.  A shard
+    that hasn't written anything is logged and skipped.
+
+    @param path: The output path given for the whole run.
+    @param count: The number of shards.
+    @param seen: Optionally, the set-like object used to skip repeated
+        users, such as a L{SeenSet}.  Defaults to a new C{set}.
+    @return: A generator that yields the first profile for each user.
+    """
+    return dedup(readShards(path, count), key=getProfileName, seen=seen)
+
+
+def readShards(path, count):
+    """Read the profiles written by all the shards of a run, in shard order.
+
+    @param path: The output path given for the whole run.
+    @param count: The number of shards.
+    @return: A generator that yields profile C{dict}s.
+    """
+    for index in xrange(1, count + 1):
+        shardPaths = getOutputPaths(getShardPath(path, index, count))
+        if not shardPaths:
+            logging.warning('Shard %d/%d has no output' % (index, count))
+        for shardPath in shardPaths:
+            with open(shardPath, 'rb') as inputFile:
+                for profile in readProfiles(inputFile):
+                    yield profile
@@ -0,0 +1,209 @@
+"""A local record of the tag values last written to Fluidinfo.
+
+Most PeerIndex scores don't change between refreshes, so rewriting every
+tag on every run wastes Fluidinfo requests.  L{ValueStore} remembers a hash
+of each tag value written for each Twitter user, so importers can write only
+the tags that changed, or skip the object entirely::
+
+  store = ValueStore('values.db')
+  values = store.getChangedValues(screenname, getTagValues(info, now), now)
+  if values:
+      fdb.values.put(query=query, values=values)
+      store.record(screenname, values, now)
+  store.close()
+
+L{ChangedValuesWriter} does the same for the writers in
+L{peerindex.fluidinfo}.
+"""
+
+from collections import deque
+from hashlib import md5
+from json import dumps, loads
+import sqlite3
+import time
+
+from peerindex.names import normalizeName
+
+
+UPDATED_AT = 'peerindex.com/updated-at'
+
+
+def hashValue(value):
+    """Get a hash of a tag value.
+
+    @param value: The C{{'value': ...}} C{dict} for a tag.
+    @return: A hex digest that's the same for equal values.
+    """
+    return md5(dumps(value, sort_keys=True)).hexdigest()
+
+
+class ValueStore(object):
+    """A persistent map of screen names to hashes of their last tag values.
+
+    The C{peerindex.com/updated-at} tag changes on every run, so it isn't
+    compared.  It's written along with any changed tags, and also when the
+    last value written is older than C{refreshAfter} seconds.
+
+    @param path: The path to the SQLite database file.  It's created if it
+        doesn't exist.
+    @param refreshAfter: Optionally, the number of seconds after which
+        C{peerindex.com/updated-at} is rewritten even if nothing else
+        changed.  C{0} always rewrites it.  By default it's only written
+        when other tags change.
+    @param commitEvery: Optionally, the number of records to write between
+        commits.  Defaults to 1000.
+    """
+
+    def __init__(self, path, refreshAfter=None, commitEvery=1000):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS tag_values ('
+            'name TEXT PRIMARY KEY, hashes TEXT, updated_at REAL)')
+        self._refreshAfter = refreshAfter
+        self._commitEvery = commitEvery
+        self._uncommitted = 0
+
+    def getChangedValues(self, name, values, now):
+        """Get the tag values that need to be written for a user.
+
+        @param name: The screen name of the Twitter user.
+        @param values: The tag values to write, as returned by
+            L{getTagValues}.
+        @param now: The current time, in seconds since the epoch.
+        @return: A C{dict} with the changed tag values.  It's empty if
+            nothing needs to be written.
+        """
+        hashes, updatedAt = self._load(name)
+        changed = dict((tag, value) for tag, value in values.iteritems()
+                       if tag != UPDATED_AT and
+                       hashes.get(tag) != hashValue(value))
+        if UPDATED_AT in values:
+            if changed or self._isStale(updatedAt, now):
+                changed[UPDATED_AT] = values[UPDATED_AT]
+        return changed
+
+    def record(self, name, values, now):
+        """Record that tag values have been written for a user.
+
+        @param name: The screen name of the Twitter user.
+        @param values: The tag values that were written.
+        @param now: The current time, in seconds since the epoch.
+        """
+        hashes, updatedAt = self._load(name)
+        for tag, value in values.iteritems():
+            if tag != UPDATED_AT:
+                hashes[tag] = hashValue(value)
+        if UPDATED_AT in values:
+            updatedAt = now
+        self._connection.execute(
+            'INSERT OR REPLACE INTO tag_values VALUES (?, ?, ?)',
+            (normalizeName(name), dumps(hashes), updatedAt))
+        self._uncommitted += 1
+        if self._uncommitted >= self._commitEvery:
+            self.commit()
+
+    def commit(self):
+        """Commit recorded values to disk."""
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        """Commit recorded values and close the database."""
+        self.commit()
+        self._connection.close()
+
+    def _load(self, name):
+        """Load the hashes and update time recorded for a user.
+
+        @return: A C{(hashes, updatedAt)} 2-tuple.  C{hashes} is empty and
+            C{updatedAt} is C{None} for an unknown user.
+        """
+        row = self._connection.execute(
+            'SELECT hashes, updated_at FROM tag_values WHERE name = ?',
+            (normalizeName(name),)).fetchone()
+        if row is None:
+            return {}, None
+        return loads(row[0]), row[1]
+
+    def _isStale(self, updatedAt, now):
+        """Determine if C{peerindex.com/updated-at} should be rewritten."""
+        if updatedAt is None:
+            return True
+        if self._refreshAfter is None:
+            return False
+        return now - updatedAt >= self._refreshAfter
+
+
+class ChangedValuesWriter(object):
+    """Wrap a L{BatchWriter} so that only changed tag values are written.
+
+    Objects with no changed values are skipped.  Values are recorded in the
+    L{ValueStore} once they've been written successfully.
+
+    @param writer: The L{BatchWriter} or L{ConcurrentBatchWriter} to wrap.
+    @param store: The L{ValueStore} to use.
+    @param timeModule: Optionally, a C{time}-compatible module object.  It's
+        used for testing purposes.
+    @ivar skipped: The number of objects skipped because nothing changed.
+    """
+
+    def __init__(self, writer, store, timeModule=None):
+        self._writer = writer
+        self._store = store
+        self._timeModule = timeModule or time
+        self._pending = {}
+        self.skipped = 0
+
+    def add(self, key, query, values):
+        """Add an object to be written, if any of its values have changed.
+
+        @param key: The screen name of the Twitter user.
+        @param query: The Fluidinfo query matching the object.
+        @param values: The tag values to write, as returned by
+            L{getTagValues}.
+        @return: A C{list} of L{WriteResult}s for any objects written.
+        """
+        values = self._store.getChangedValues(key, values,
+                                              self._timeModule.time())
+        if not values:
+            self.skipped += 1
+            return []
+        self._pending.setdefault(key, deque()).append(values)
+        return self._record(self._writer.add(key, query, values))
+
+    def flush(self):
+        """Flush the wrapped writer.
+
+        @return: A C{list} of L{WriteResult}s for any objects written.
+        """
+        return self._record(self._writer.flush())
+
+    def sync(self):
+        """Sync the wrapped writer and commit the store.
+
+        @return: A C{list} of L{WriteResult}s for any objects written.
+        """
+        results = self._record(self._writer.sync())
+        self._store.commit()
+        return results
+
+    def close(self):
+        """Close the wrapped writer and commit the store.
+
+        @return: A C{list} of L{WriteResult}s for any objects written.
+        """
+        results = self._record(self._writer.close())
+        self._store.commit()
+        return results
+
+    def _record(self, results):
+        """Record the values of successfully written objects."""
+        now = self._timeModule.time()
+        for result in results:
+            pending = self._pending[result.key]
+            values = pending.popleft()
+            if not pending:
+                del self._pending[result.key]
+            if result.error is None:
+                self._store.record(result.key, values, now)
+        return results
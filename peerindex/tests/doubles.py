@@ -1,4 +1,6 @@
+from fom.errors import Fluid400Error
 from httplib2 import DEFAULT_MAX_REDIRECTS
+from twisted.internet.defer import Deferred
 
 
 class FakeHTTPResponse(object):
@@ -13,6 +15,7 @@ class FakeHTTPResponse(object):
         self.redirections = redirections
         self.connection_type = connection_type
         self.response = None
+        self.error = None
 
     def result(self, headers, content):
         """Set the response headers and content to return with this response.
@@ -23,6 +26,13 @@ class FakeHTTPResponse(object):
         """
         self.response = (headers, content)
 
+    def fail(self, error):
+        """Set an exception to raise instead of returning a response.
+
+        @param error: The exception to raise, such as a C{socket.error}.
+        """
+        self.error = error
+
 
 class FakeHTTPClient(object):
     """A fake HTTP client that can be used in place of C{httplib2.Http}."""
@@ -51,9 +61,43 @@ class FakeHTTPClient(object):
         assert(response.headers == headers)
         assert(response.redirections == redirections)
         assert(response.connection_type == connection_type)
+        if response.error is not None:
+            raise response.error
         return response.response
 
 
+class FakeDeferredHTTPClient(FakeHTTPClient):
+    """
+    A fake HTTP client that returns results in C{Deferred}s, for use with
+    L{ConcurrentPeerIndex}.
+
+    Results are held back until L{flush} is called, so that tests can
+    simulate several requests being in flight at once.
+    """
+
+    def __init__(self):
+        super(FakeDeferredHTTPClient, self).__init__()
+        self.pending = []
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=DEFAULT_MAX_REDIRECTS, connection_type=None):
+        """
+        A fake implementation of L{AgentClient.request}.  Returns a
+        C{Deferred} that fires when L{flush} is called.
+        """
+        result = super(FakeDeferredHTTPClient, self).request(
+            uri, method, body, headers, redirections, connection_type)
+        deferred = Deferred()
+        self.pending.append((deferred, result))
+        return deferred
+
+    def flush(self):
+        """Fire the C{Deferred}s for all pending requests."""
+        pending, self.pending = self.pending, []
+        for deferred, result in pending:
+            deferred.callback(result)
+
+
 class FakeTimeModule(object):
     """A fake C{time} module.
 
@@ -72,3 +116,100 @@ class FakeTimeModule(object):
     def time(self):
         """Get the current time."""
         return self.currentTime
+
+
+class FakeFluidResponse(object):
+    """A fake C{fom.db.FluidResponse} used to build C{FluidError}s."""
+
+    def __init__(self, status, error):
+        self.status = status
+        self.error = error
+        self.request_id = None
+        self.value = None
+
+
+class FakeValuesAPI(object):
+    """A fake C{fom.api.ValuesApi} that records the tag values put to it.
+
+    @param fluid: The L{FakeFluid} this API belongs to.
+    """
+
+    def __init__(self, fluid):
+        self._fluid = fluid
+
+    def __call__(self, method, path=(), payload=None, urlargs=None):
+        """A fake implementation of C{ValuesApi.__call__}."""
+        assert(method == 'PUT')
+        return self._fluid.request(payload['queries'])
+
+    def get(self, query, taglist):
+        """
+        A fake implementation of C{ValuesApi.get} that returns the about
+        values of the objects in L{FakeFluid.abouts}.
+        """
+        assert(taglist == ['fluiddb/about'])
+        self._fluid.queries.append(query)
+        response = FakeFluidResponse(200, None)
+        response.value = {'results': {'id': dict(
+            (objectId, {'fluiddb/about': {'value': about}})
+            for objectId, about in self._fluid.abouts.iteritems())}}
+        return response
+
+    def put(self, query, values):
+        """A fake implementation of C{ValuesApi.put}."""
+        return self._fluid.request([[query, values]])
+
+
+class FakeObjectsAPI(object):
+    """A fake C{fom.api.ObjectsApi} that creates objects with fake IDs.
+
+    @param fluid: The L{FakeFluid} this API belongs to.
+    """
+
+    def __init__(self, fluid):
+        self._fluid = fluid
+
+    def post(self, about=None):
+        """A fake implementation of C{ObjectsApi.post}."""
+        self._fluid.posts.append(about)
+        response = FakeFluidResponse(201, None)
+        response.value = {'id': 'id-%s' % about}
+        return response
+
+
+class FakeFluid(object):
+    """A fake C{fom.session.Fluid} that records the requests made with it.
+
+    @param timeModule: Optionally, a L{FakeTimeModule} to advance by
+        C{latency} seconds for each request.
+    @param latency: Optionally, the number of seconds each request takes.
+    @ivar requests: A C{list} with the C{[query, values]} pairs of each
+        C{values} PUT request made.
+    @ivar posts: A C{list} with the about values of the objects created.
+    @ivar queries: A C{list} with the queries of each C{values} GET request
+        made.
+    @ivar abouts: A C{dict} mapping the IDs of the objects returned by
+        C{values} GET requests to their about values.
+    @ivar failures: A C{set} of queries that cause the requests they're in
+        to fail with a C{FluidError}.
+    """
+
+    def __init__(self, timeModule=None, latency=0.0):
+        self.values = FakeValuesAPI(self)
+        self.objects = FakeObjectsAPI(self)
+        self.requests = []
+        self.posts = []
+        self.queries = []
+        self.abouts = {}
+        self.failures = set()
+        self._timeModule = timeModule
+        self._latency = latency
+
+    def request(self, queries):
+        """Record a C{values} PUT request."""
+        if self._timeModule is not None:
+            self._timeModule.sleep(self._latency)
+        for query, values in queries:
+            if query in self.failures:
+                raise Fluid400Error(FakeFluidResponse(400, 'BadRequest'))
+        self.requests.append(queries)
@@ -0,0 +1,219 @@
+"""A simulated PeerIndex API that runs in virtual time.
+
+L{SimulatedPeerIndex} can be used in place of C{httplib2.Http} as the client
+of a L{PeerIndex}, and answers any number of C{profile/show} calls without
+scripting each one.  It behaves like the real API under load:
+
+  - each call takes a latency drawn from a distribution, such as
+    L{exponentialLatency}, by advancing a L{FakeTimeModule},
+  - each API key has a daily quota, reported in the C{x-ratelimit-*}
+    headers, that resets every C{resetInterval} seconds,
+  - calls made with an exhausted quota get a C{403} rate limit error,
+  - unknown users get a C{200} response with a C{404 Not Found} body,
+  - a fraction of calls fail with a transient C{5xx} error or a dropped
+    connection.
+
+Sharing the L{FakeTimeModule} with the limiters and schedulers being tested
+lets a whole simulated day of calls run in seconds::
+
+  timeModule = FakeTimeModule()
+  server = SimulatedPeerIndex(timeModule, quota=10000,
+                              latency=exponentialLatency(0.2),
+                              serverErrorRate=0.01)
+  peerindex = PeerIndex('key', client=server, timeModule=timeModule,
+                        limiter=QuotaScheduler(timeModule=timeModule))
+
+Random choices are made with a seeded C{random.Random}, so runs are
+repeatable.
+"""
+
+from json import dumps
+from math import log
+import random
+import socket
+from urlparse import parse_qs, urlparse
+from zlib import crc32
+
+from peerindex.tests.doubles import FakeTimeModule
+
+
+DAY = 24 * 60 * 60
+
+
+def constantLatency(seconds):
+    """Get a latency distribution that always takes the same time.
+
+    @param seconds: The latency, in seconds.
+    @return: A function that takes a C{random.Random} and returns a latency.
+    """
+    return lambda generator: seconds
+
+
+def uniformLatency(low, high):
+    """Get a latency distribution that's uniform over a range.
+
+    @param low: The smallest latency, in seconds.
+    @param high: The largest latency, in seconds.
+    @return: A function that takes a C{random.Random} and returns a latency.
+    """
+    return lambda generator: generator.uniform(low, high)
+
+
+def exponentialLatency(mean):
+    """Get an exponential latency distribution, with a long tail.
+
+    @param mean: The mean latency, in seconds.
+    @return: A function that takes a C{random.Random} and returns a latency.
+    """
+    return lambda generator: generator.expovariate(1.0 / mean)
+
+
+def logNormalLatency(median, sigma=0.5):
+    """Get a log-normal latency distribution, typical of network calls.
+
+    @param median: The median latency, in seconds.
+    @param sigma: Optionally, the standard deviation of the log of the
+        latency.  Defaults to 0.5.
+    @return: A function that takes a C{random.Random} and returns a latency.
+    """
+    mu = log(median)
+    return lambda generator: generator.lognormvariate(mu, sigma)
+
+
+class SimulatedQuota(object):
+    """The daily quota of an API key.
+
+    @ivar remaining: The number of calls left before the reset.
+    @ivar reset: The time, in seconds since the epoch, when the quota
+        resets.
+    @ivar lastCall: The time of the last call, or C{None}.
+    """
+
+    def __init__(self, quota, reset):
+        self.remaining = quota
+        self.reset = reset
+        self.lastCall = None
+
+
+class SimulatedPeerIndex(object):
+    """A simulated PeerIndex API, used in place of C{httplib2.Http}.
+
+    @param timeModule: Optionally, the L{FakeTimeModule} to advance.
+        Defaults to a new one.
+    @param quota: Optionally, the number of calls allowed per key before
+        the quota resets.  Defaults to 10000.
+    @param resetInterval: Optionally, the number of seconds between quota
+        resets.  Defaults to a day.
+    @param latency: Optionally, the latency distribution, as returned by
+        L{constantLatency} and friends.  Defaults to no latency.
+    @param unknownRate: Optionally, the fraction of users PeerIndex doesn't
+        know about.  Whether a user is known depends only on their name.
+    @param serverErrorRate: Optionally, the fraction of calls that fail
+        with a C{500}, C{502} or C{503} response.  Failed calls don't count
+        against the quota.
+    @param connectionErrorRate: Optionally, the fraction of calls that fail
+        with a C{socket.error}, as if the connection was reset.
+    @param minInterval: Optionally, the number of seconds the API expects
+        between calls with the same key.  Faster calls are counted in
+        C{violations}.  Defaults to 1.0.
+    @param seed: Optionally, the seed for random choices.  Defaults to 0.
+    @ivar timeModule: The L{FakeTimeModule} advanced by each call.
+    @ivar calls: The number of calls made.
+    @ivar profiles: The number of profiles returned.
+    @ivar rateLimited: The number of calls rejected with a C{403}.
+    @ivar unknown: The number of calls for unknown users.
+    @ivar serverErrors: The number of calls that failed with a C{5xx}.
+    @ivar connectionErrors: The number of calls that failed with a
+        C{socket.error}.
+    @ivar violations: The number of calls started less than C{minInterval}
+        seconds after the previous call with the same key.
+    @ivar resets: The number of times a quota has reset.
+    """
+
+    def __init__(self, timeModule=None, quota=10000, resetInterval=DAY,
+                 latency=None, unknownRate=0.0, serverErrorRate=0.0,
+                 connectionErrorRate=0.0, minInterval=1.0, seed=0):
+        self.timeModule = timeModule or FakeTimeModule()
+        self._quota = quota
+        self._resetInterval = resetInterval
+        self._latency = latency or constantLatency(0.0)
+        self._unknownRate = unknownRate
+        self._serverErrorRate = serverErrorRate
+        self._connectionErrorRate = connectionErrorRate
+        self._minInterval = minInterval
+        self._random = random.Random(seed)
+        self._start = self.timeModule.time()
+        self._quotas = {}
+        self.calls = 0
+        self.profiles = 0
+        self.rateLimited = 0
+        self.unknown = 0
+        self.serverErrors = 0
+        self.connectionErrors = 0
+        self.violations = 0
+        self.resets = 0
+
+    def isUnknown(self, name):
+        """Determine whether PeerIndex knows about a user.
+
+        @param name: The screen name of the Twitter user.
+        @return: C{True} if the user is unknown, otherwise C{False}.
+        """
+        return (crc32(name) & 0xffffffff) < self._unknownRate * 2 ** 32
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=None, connection_type=None):
+        """A simulated implementation of C{httplib2.Http.request}.
+
+        @raise socket.error: Raised for a simulated dropped connection.
+        @return: A C{(headers, content)} 2-tuple.
+        """
+        query = parse_qs(urlparse(uri).query)
+        name = query['id'][0]
+        quota = self._getQuota(query['api_key'][0])
+        now = self.timeModule.time()
+        self.timeModule.sleep(max(0.0, self._latency(self._random)))
+        self.calls += 1
+        if (quota.lastCall is not None and
+                now - quota.lastCall < self._minInterval):
+            self.violations += 1
+        quota.lastCall = now
+        if self._random.random() < self._connectionErrorRate:
+            self.connectionErrors += 1
+            raise socket.error('Connection reset by peer')
+        if self._random.random() < self._serverErrorRate:
+            self.serverErrors += 1
+            status = self._random.choice(['500', '502', '503'])
+            return self._respond(status, quota, 'Server error')
+        if quota.remaining <= 0:
+            self.rateLimited += 1
+            return self._respond('403', quota,
+                                 dumps({'error': 'Rate limit exceeded'}))
+        quota.remaining -= 1
+        if self.isUnknown(name):
+            self.unknown += 1
+            return self._respond('200', quota, '<h1>404 Not Found</h1>')
+        self.profiles += 1
+        return self._respond('200', quota, dumps(
+            {'twitter': name, 'peerindex': crc32(name) % 100}))
+
+    def _getQuota(self, key):
+        """Get the quota of an API key, resetting it if it's due."""
+        now = self.timeModule.time()
+        quota = self._quotas.get(key)
+        if quota is None:
+            quota = self._quotas[key] = SimulatedQuota(
+                self._quota, self._start + self._resetInterval)
+        while now >= quota.reset:
+            quota.remaining = self._quota
+            quota.reset += self._resetInterval
+            self.resets += 1
+        return quota
+
+    def _respond(self, status, quota, content):
+        """Build a response with the rate limit headers of a quota."""
+        headers = {'status': status,
+                   'x-ratelimit-limit': str(self._quota),
+                   'x-ratelimit-remaining': str(max(0, quota.remaining)),
+                   'x-ratelimit-reset': str(int(quota.reset))}
+        return headers, content
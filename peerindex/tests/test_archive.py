@@ -0,0 +1,118 @@
+from StringIO import StringIO
+import struct
+from unittest import TestCase
+
+from peerindex.archive import (
+    ARCHIVE_MAGIC, ArchiveWriter, encodeColumn, readArchive,
+    readArchiveColumns)
+from peerindex.pipeline import readProfiles
+
+
+PROFILES = [
+    {'twitter': 'one', 'peerindex': 40, 'authority': 12.5,
+     'topics': ['python', 'twitter'], 'url': 'http://example.com/one'},
+    {'twitter': 'two', 'peerindex': 7, 'authority': 3,
+     'topics': [], 'extra': {'a': [1, 2]}},
+    {'twitter': 'three', 'peerindex': 18, 'topics': ['python'],
+     'url': 'http://example.com/three', 'extra': True},
+]
+
+
+def writeArchive(profiles, blockSize=65536):
+    """Write profiles to an archive in memory.
+
+    @return: The archive data.
+    """
+    outputFile = StringIO()
+    writer = ArchiveWriter(outputFile, blockSize=blockSize)
+    for profile in profiles:
+        writer.write(profile)
+    writer.close()
+    return outputFile.getvalue()
+
+
+class ArchiveTest(TestCase):
+
+    def testRoundTrip(self):
+        """
+        L{readArchive} reads back the profiles written by L{ArchiveWriter},
+        with exactly the keys and value types they were written with.
+        """
+        profiles = list(readArchive(StringIO(writeArchive(PROFILES))))
+        self.assertEqual(PROFILES, profiles)
+        self.assertTrue(isinstance(profiles[0]['peerindex'], int))
+        self.assertTrue(isinstance(profiles[0]['authority'], float))
+        self.assertTrue(isinstance(profiles[1]['authority'], int))
+
+    def testRoundTripWithSeveralBlocks(self):
+        """Profiles are written in blocks of C{blockSize} records."""
+        data = writeArchive(PROFILES, blockSize=2)
+        self.assertEqual(PROFILES, list(readArchive(StringIO(data))))
+
+    def testEmptyArchive(self):
+        """An archive with no profiles only has the magic number."""
+        data = writeArchive([])
+        self.assertEqual(ARCHIVE_MAGIC, data)
+        self.assertEqual([], list(readArchive(StringIO(data))))
+
+    def testLargeIntegers(self):
+        """Integers that don't fit in 32 bits are read back exactly."""
+        profiles = [{'followers': 2 ** 60 + 1}]
+        [profile] = readArchive(StringIO(writeArchive(profiles)))
+        self.assertEqual(profiles, [profile])
+        self.assertFalse(isinstance(profile['followers'], float))
+
+    def testMixedNumbers(self):
+        """
+        A column that mixes integers and floats is stored as JSON, so each
+        value is read back with its own type.
+        """
+        description, data = encodeColumn([1, 2.5])
+        self.assertEqual('json', description['type'])
+        profiles = [{'score': 1}, {'score': 2.5}]
+        [one, two] = readArchive(StringIO(writeArchive(profiles)))
+        self.assertTrue(isinstance(one['score'], int))
+        self.assertTrue(isinstance(two['score'], float))
+
+    def testLittleEndian(self):
+        """Typed arrays are stored little-endian on any machine."""
+        description, data = encodeColumn([1, 258])
+        self.assertEqual([struct.pack('<2i', 1, 258)], data)
+        description, data = encodeColumn([0.5])
+        self.assertEqual([struct.pack('<d', 0.5)], data)
+
+    def testCompression(self):
+        """Repeated values are stored once per block."""
+        profiles = [{'twitter': 'user%d' % i, 'peerindex': i % 100,
+                     'topics': ['python', 'twitter', 'fluidinfo']}
+                    for i in range(1000)]
+        data = writeArchive(profiles)
+        self.assertTrue(len(data) < 1000 * 10)
+
+    def testTruncatedArchive(self):
+        """A truncated block at the end of an archive is ignored."""
+        data = writeArchive(PROFILES, blockSize=2)
+        self.assertEqual(PROFILES[:2],
+                         list(readArchive(StringIO(data[:-3]))))
+
+    def testNotAnArchive(self):
+        """L{readArchive} raises a C{ValueError} for other files."""
+        self.assertRaises(ValueError, list,
+                          readArchive(StringIO('{"twitter": "one"}\n')))
+
+    def testReadArchiveColumns(self):
+        """
+        L{readArchiveColumns} reads only the requested columns of each
+        block, with C{None} for missing values.
+        """
+        data = writeArchive(PROFILES, blockSize=2)
+        self.assertEqual(
+            [{'twitter': ['one', 'two'], 'url': ['http://example.com/one',
+                                                 None]},
+             {'twitter': ['three'], 'url': ['http://example.com/three']}],
+            list(readArchiveColumns(StringIO(data), ['twitter', 'url'])))
+
+    def testReadProfiles(self):
+        """L{readProfiles} detects and reads archives."""
+        data = writeArchive(PROFILES)
+        self.assertEqual(PROFILES, list(readProfiles(StringIO(data))))
@@ -0,0 +1,169 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.bundles import (
+    BundleWriter, ReplayLog, getBundlePaths, readBundle, replayBundles,
+    writeBundle)
+from peerindex.fluidinfo import WriterPool
+from peerindex.tests.doubles import FakeFluid, FakeTimeModule
+
+
+class BundleWriterTest(TestCase):
+
+    def setUp(self):
+        super(BundleWriterTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'bundles')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(BundleWriterTest, self).tearDown()
+
+    def testAdd(self):
+        """
+        L{BundleWriter.add} saves a bundle with the C{values} PUT payload
+        when it's full, and returns a result for each object.
+        """
+        writer = BundleWriter(self.path, bundleSize=2,
+                              timeModule=FakeTimeModule())
+        self.assertEqual([], writer.add('one', 'query1', {'tag': 1}))
+        results = writer.add('two', 'query2', {'tag': 2})
+        self.assertEqual(['one', 'two'], [result.key for result in results])
+        self.assertEqual([None, None], [result.error for result in results])
+        [path] = getBundlePaths(self.path)
+        filename = os.path.basename(path)
+        self.assertTrue(filename.startswith('bundle-19700101T000140-'))
+        self.assertTrue(filename.endswith('-000001.json.gz'))
+        self.assertEqual([['query1', {'tag': 1}], ['query2', {'tag': 2}]],
+                         readBundle(path))
+        self.assertEqual([filename], os.listdir(self.path))
+
+    def testClose(self):
+        """L{BundleWriter.close} saves a partial bundle."""
+        writer = BundleWriter(self.path, bundleSize=2)
+        writer.add('one', 'query1', {'tag': 1})
+        self.assertEqual(['one'], [result.key for result in writer.close()])
+        self.assertEqual([], writer.close())
+        self.assertEqual(1, writer.bundles)
+
+    def testSeveralRuns(self):
+        """
+        L{getBundlePaths} returns the bundles of several runs in the order
+        they were written, with each run's bundles in numeric order.
+        """
+        timeModule = FakeTimeModule()
+        for i in range(3):
+            writer = BundleWriter(self.path, bundleSize=1,
+                                  timeModule=timeModule)
+            for j in range(11):
+                writer.add(j, 'query%d-%d' % (i, j), {'tag': j})
+            timeModule.sleep(1)
+        self.assertEqual(
+            [[['query%d-%d' % (i, j), {'tag': j}]]
+             for i in range(3) for j in range(11)],
+            [readBundle(path) for path in getBundlePaths(self.path)])
+
+    def testConcurrentWriters(self):
+        """
+        Writers started at the same time give their bundles different
+        names, so neither replaces the other's bundles.
+        """
+        timeModule = FakeTimeModule()
+        writers = [BundleWriter(self.path, bundleSize=1,
+                                timeModule=timeModule) for i in range(2)]
+        for i, writer in enumerate(writers):
+            writer.add(i, 'query%d' % i, {'tag': i})
+        self.assertEqual(
+            [[['query0', {'tag': 0}]], [['query1', {'tag': 1}]]],
+            sorted(readBundle(path) for path in getBundlePaths(self.path)))
+
+    def testExistingBundleNotReplaced(self):
+        """
+        L{BundleWriter.flush} raises C{OSError} rather than replace an
+        existing bundle with the same name, and removes its temporary file.
+        """
+        writer = BundleWriter(self.path, bundleSize=1)
+        writer.add('one', 'query1', {'tag': 1})
+        [path] = getBundlePaths(self.path)
+        writer._number = 0
+        self.assertRaises(OSError, writer.add, 'two', 'query2', {'tag': 2})
+        self.assertEqual([['query1', {'tag': 1}]], readBundle(path))
+        self.assertEqual([os.path.basename(path)], os.listdir(self.path))
+
+
+class ReplayTest(TestCase):
+
+    def setUp(self):
+        super(ReplayTest, self).setUp()
+        self.directory = mkdtemp()
+        writer = BundleWriter(self.directory, bundleSize=2)
+        for i in range(5):
+            writer.add(i, 'query%d' % i, {'tag': i})
+        writer.close()
+        self.paths = getBundlePaths(self.directory)
+        self.logPath = os.path.join(self.directory, 'replayed.log')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(ReplayTest, self).tearDown()
+
+    def replay(self, fluid):
+        """Replay all the bundles with a session and return the results."""
+        log = ReplayLog(self.logPath)
+        pool = WriterPool(lambda: fluid, writeBundle, concurrency=2)
+        try:
+            return list(replayBundles(pool, self.paths, log))
+        finally:
+            log.close()
+
+    def testReplayBundles(self):
+        """
+        L{replayBundles} writes each bundle with one request and yields the
+        number of objects written for each.
+        """
+        fluid = FakeFluid()
+        results = self.replay(fluid)
+        self.assertEqual([(path, count, None) for path, count
+                          in zip(self.paths, [2, 2, 1])], results)
+        self.assertEqual(
+            [[['query0', {'tag': 0}], ['query1', {'tag': 1}]],
+             [['query2', {'tag': 2}], ['query3', {'tag': 3}]],
+             [['query4', {'tag': 4}]]],
+            sorted(fluid.requests))
+
+    def testResume(self):
+        """
+        Bundles that have been written are skipped by the next replay, and
+        bundles that failed are sent again.
+        """
+        fluid = FakeFluid()
+        fluid.failures.add('query2')
+        results = self.replay(fluid)
+        self.assertEqual([None, 'Fluid400Error', None],
+                         [error and error.__class__.__name__
+                          for path, count, error in results])
+        self.assertEqual(2, len(fluid.requests))
+        fluid = FakeFluid()
+        self.assertEqual([self.paths[1]],
+                         [path for path, count, error in self.replay(fluid)])
+        self.assertEqual([[['query2', {'tag': 2}], ['query3', {'tag': 3}]]],
+                         fluid.requests)
+        self.assertEqual([], self.replay(FakeFluid()))
+
+    def testNewBundlesAfterDeletingReplayed(self):
+        """
+        Bundles exported after the replayed ones are deleted aren't mistaken
+        for them.
+        """
+        self.replay(FakeFluid())
+        for path in self.paths:
+            os.remove(path)
+        writer = BundleWriter(self.directory)
+        writer.add(5, 'query5', {'tag': 5})
+        writer.close()
+        self.paths = getBundlePaths(self.directory)
+        fluid = FakeFluid()
+        self.assertEqual([(self.paths[0], 1, None)], self.replay(fluid))
+        self.assertEqual([[['query5', {'tag': 5}]]], fluid.requests)
@@ -0,0 +1,114 @@
+import os
+from shutil import rmtree
+import sqlite3
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.cache import ResponseCache
+from peerindex.tests.doubles import FakeTimeModule
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        self.timeModule = FakeTimeModule()
+        self.result = {'twitter': 'terrycojones', 'peerindex': 52}
+
+    def testGetWithMissingResponse(self):
+        """
+        L{ResponseCache.get} returns C{(False, None)} and counts a miss if
+        nothing is cached.
+        """
+        cache = ResponseCache(':memory:', timeModule=self.timeModule)
+        self.assertEqual((False, None), cache.get('terrycojones'))
+        self.assertEqual(1, cache.misses)
+
+    def testGet(self):
+        """
+        L{ResponseCache.get} returns a cached profile, keyed by normalized
+        name, and counts a hit.
+        """
+        cache = ResponseCache(':memory:', timeModule=self.timeModule)
+        cache.put('terrycojones', self.result)
+        self.assertEqual((True, self.result), cache.get('@TerryCoJones'))
+        self.assertEqual(1, cache.hits)
+
+    def testGetWithExpiredResponse(self):
+        """
+        L{ResponseCache.get} doesn't return profiles older than the TTL.
+        """
+        cache = ResponseCache(':memory:', ttl=60, timeModule=self.timeModule)
+        cache.put('terrycojones', self.result)
+        self.timeModule.sleep(60)
+        self.assertEqual((False, None), cache.get('terrycojones'))
+        self.assertEqual(1, cache.misses)
+
+    def testGetWithUnknownUser(self):
+        """
+        L{ResponseCache.get} returns C{(True, None)} for a cached unknown
+        user, until the negative TTL expires.
+        """
+        cache = ResponseCache(':memory:', ttl=10, negativeTTL=60,
+                              timeModule=self.timeModule)
+        cache.putUnknown('unknown')
+        self.timeModule.sleep(30)
+        self.assertEqual((True, None), cache.get('unknown'))
+        self.assertEqual(1, cache.negativeHits)
+        self.timeModule.sleep(30)
+        self.assertEqual((False, None), cache.get('unknown'))
+
+    def testPutEvictsLeastRecentlyUsed(self):
+        """
+        L{ResponseCache.put} evicts the least recently used responses when
+        the cache holds more than C{maxEntries}.
+        """
+        cache = ResponseCache(':memory:', maxEntries=2,
+                              timeModule=self.timeModule)
+        cache.put('one', {'twitter': 'one'})
+        self.timeModule.sleep(1)
+        cache.put('two', {'twitter': 'two'})
+        self.timeModule.sleep(1)
+        cache.get('one')
+        self.timeModule.sleep(1)
+        cache.put('three', {'twitter': 'three'})
+        self.assertEqual((False, None), cache.get('two'))
+        self.assertEqual((True, {'twitter': 'one'}), cache.get('one'))
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(2, cache.getStats()['size'])
+
+    def testAccessTimesAreBatched(self):
+        """
+        L{ResponseCache.get} writes the access times of hits every
+        C{touchEvery} hits, and L{ResponseCache.close} writes the rest.
+        """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        path = os.path.join(directory, 'responses.db')
+        cache = ResponseCache(path, touchEvery=2, timeModule=self.timeModule)
+        cache.put('one', {'twitter': 'one'})
+        cache.put('two', {'twitter': 'two'})
+        connection = sqlite3.connect(path)
+        self.addCleanup(connection.close)
+
+        def getAccessTimes():
+            return connection.execute(
+                'SELECT accessed_at FROM responses ORDER BY name').fetchall()
+
+        self.timeModule.sleep(1)
+        cache.get('one')
+        self.assertEqual([(100.0,), (100.0,)], getAccessTimes())
+        cache.get('two')
+        self.assertEqual([(101.0,), (101.0,)], getAccessTimes())
+        self.timeModule.sleep(1)
+        cache.get('one')
+        cache.close()
+        self.assertEqual([(102.0,), (101.0,)], getAccessTimes())
+
+    def testPutReplacesResponse(self):
+        """L{ResponseCache.put} replaces an existing response."""
+        cache = ResponseCache(':memory:', timeModule=self.timeModule)
+        cache.putUnknown('terrycojones')
+        cache.put('terrycojones', self.result)
+        self.assertEqual((True, self.result), cache.get('terrycojones'))
+        self.assertEqual(1, cache.getStats()['size'])
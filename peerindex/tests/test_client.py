@@ -4,6 +4,9 @@ from unittest import TestCase
 from peerindex.client import (
     PeerIndex, PeerIndexError, CredentialsError, RateLimitError,
     UnknownUserError)
+from peerindex.cache import ResponseCache
+from peerindex.metrics import Metrics
+from peerindex.ratelimit import QuotaScheduler
 from peerindex.tests.doubles import FakeHTTPClient, FakeTimeModule
 
 
@@ -37,6 +40,21 @@ class PeerIndexTest(TestCase):
         peerindex = PeerIndex('key', client=client)
         self.assertEqual(result, peerindex.get('terrycojones'))
 
+    def testGetWithBaseURL(self):
+        """
+        L{PeerIndex.get} makes calls to the C{baseURL} passed to the client,
+        if one is given.
+        """
+        client = FakeHTTPClient()
+        response = client.expect(
+            'http://localhost:8080/1/profile/show.json?'
+            'id=terrycojones&api_key=key')
+        response.result({'status': '200'}, dumps({'twitter': 'terrycojones'}))
+        peerindex = PeerIndex('key', client=client,
+                              baseURL='http://localhost:8080/1')
+        self.assertEqual({'twitter': 'terrycojones'},
+                         peerindex.get('terrycojones'))
+
     def testGetStripsLeadingAtSignInUsername(self):
         """
         L{PeerIndex.get} automatically strips a leading C{@} sign out of a
@@ -206,6 +224,63 @@ class PeerIndexTest(TestCase):
         peerindex = PeerIndex('key', client=client)
         self.assertRaises(RateLimitError, peerindex.get, 'terrycojones')
 
+    def testGetPausesWhenQuotaIsExhausted(self):
+        """
+        L{PeerIndex.get} sleeps until the daily quota resets and retries the
+        call, instead of raising L{RateLimitError}, if its limiter knows when
+        the quota resets.
+        """
+        timeModule = FakeTimeModule()
+        client = FakeHTTPClient()
+        headers = {'status': '200', 'x-ratelimit-remaining': '5',
+                   'x-ratelimit-limit': '10000',
+                   'x-ratelimit-reset': '3700'}
+        result = {'name': 'Terry Jones', 'twitter': 'terrycojones'}
+        response = client.expect(
+            'http://api.peerindex.net/1/profile/show.json?'
+            'id=terrycojones&api_key=key')
+        response.result(headers, dumps(result))
+        response = client.expect(
+            'http://api.peerindex.net/1/profile/show.json?'
+            'id=terrycojones&api_key=key')
+        response.result({'status': '403'},
+                        dumps({'error': 'Rate limit exceeded'}))
+        response = client.expect(
+            'http://api.peerindex.net/1/profile/show.json?'
+            'id=terrycojones&api_key=key')
+        response.result(headers, dumps(result))
+        limiter = QuotaScheduler(timeModule=timeModule)
+        peerindex = PeerIndex('key', client=client, timeModule=timeModule,
+                              limiter=limiter)
+        self.assertEqual(result, peerindex.get('terrycojones'))
+        self.assertEqual(result, peerindex.get('terrycojones'))
+        self.assertEqual(3700.0, timeModule.currentTime)
+
+    def testGetRecordsMetrics(self):
+        """
+        L{PeerIndex.get} records the time spent sleeping, fetching and
+        decoding in its L{Metrics}, and counts errors by class.
+        """
+        timeModule = FakeTimeModule()
+        client = FakeHTTPClient()
+        response = client.expect(
+            'http://api.peerindex.net/1/profile/show.json?'
+            'id=terrycojones&api_key=key')
+        response.result({'status': '200'}, dumps({'twitter': 'terrycojones'}))
+        response = client.expect(
+            'http://api.peerindex.net/1/profile/show.json?'
+            'id=unknown&api_key=key')
+        response.result({'status': '404'}, dumps([]))
+        metrics = Metrics(timeModule)
+        peerindex = PeerIndex('key', client=client, timeModule=timeModule,
+                              metrics=metrics)
+        peerindex.get('terrycojones')
+        self.assertRaises(UnknownUserError, peerindex.get, 'unknown')
+        self.assertEqual(2, metrics.histograms['fetch'].count)
+        self.assertEqual(2, metrics.histograms['decode'].count)
+        self.assertEqual(1.0, metrics.histograms['sleep'].sum)
+        self.assertEqual({'UnknownUserError': 1}, metrics.errors)
+
     def testGetWithUnknownUser(self):
         """
         L{PeerIndex.get} raises an L{UnknownUserError} if the PeerIndex API
@@ -247,3 +322,36 @@ class PeerIndexTest(TestCase):
         response.result(headers, content)
         peerindex = PeerIndex('key', client=client)
         self.assertRaises(PeerIndexError, peerindex.get, 'unknown')
+
+    def testGetUsesCache(self):
+        """
+        L{PeerIndex.get} stores profiles in its cache and returns cached
+        profiles without making a call.
+        """
+        client = FakeHTTPClient()
+        result = {'name': 'Terry Jones', 'twitter': 'terrycojones'}
+        response = client.expect(
+            'http://api.peerindex.net/1/profile/show.json?'
+            'id=terrycojones&api_key=key')
+        response.result({'status': '200'}, dumps(result))
+        cache = ResponseCache(':memory:', timeModule=FakeTimeModule())
+        peerindex = PeerIndex('key', client=client, cache=cache)
+        self.assertEqual(result, peerindex.get('terrycojones'))
+        self.assertEqual(result, peerindex.get('@TerryCoJones'))
+        self.assertEqual(1, cache.hits)
+
+    def testGetCachesUnknownUsers(self):
+        """
+        L{PeerIndex.get} caches unknown users, and raises
+        L{UnknownUserError} for them without making a call.
+        """
+        client = FakeHTTPClient()
+        response = client.expect(
+            'http://api.peerindex.net/1/profile/show.json?'
+            'id=unknown&api_key=key')
+        response.result({'status': '404'}, dumps([]))
+        cache = ResponseCache(':memory:', timeModule=FakeTimeModule())
+        peerindex = PeerIndex('key', client=client, cache=cache)
+        self.assertRaises(UnknownUserError, peerindex.get, 'unknown')
+        self.assertRaises(UnknownUserError, peerindex.get, 'unknown')
+        self.assertEqual(1, cache.negativeHits)
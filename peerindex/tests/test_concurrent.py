@@ -0,0 +1,133 @@
+from json import dumps
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from peerindex.cache import ResponseCache
+from peerindex.client import RateLimitError, UnknownUserError
+from peerindex.concurrent import ConcurrentPeerIndex
+from peerindex.tests.doubles import FakeDeferredHTTPClient, FakeTimeModule
+
+
+class ConcurrentPeerIndexTest(TestCase):
+
+    def setUp(self):
+        super(ConcurrentPeerIndexTest, self).setUp()
+        self.clock = Clock()
+        self.client = FakeDeferredHTTPClient()
+        self.result = {'name': 'Terry Jones', 'twitter': 'terrycojones',
+                       'slug': 'terrycojones', 'known': 1, 'authority': 51,
+                       'activity': 46, 'audience': 57, 'peerindex': 52,
+                       'url': 'http:\\/\\/pi.mu\\/4O9',
+                       'topics': ['languages', 'terry jones', 'catalonia',
+                                  'tim oreilly', 'writing']}
+
+    def expect(self, name, headers=None, content=None):
+        """Script a response for a C{profile/show} call for C{name}."""
+        response = self.client.expect(
+            'http://api.peerindex.net/1/profile/show.json?'
+            'id=%s&api_key=key' % name)
+        response.result(headers or {'status': '200'},
+                        content or dumps(self.result))
+
+    def testGet(self):
+        """
+        L{ConcurrentPeerIndex.get} returns a C{Deferred} that fires with a
+        C{dict} with information about the specified Twitter user.
+        """
+        self.expect('terrycojones')
+        peerindex = ConcurrentPeerIndex('key', client=self.client,
+                                        clock=self.clock)
+        results = []
+        peerindex.get('@terrycojones\n').addCallback(results.append)
+        self.clock.advance(0)
+        self.client.flush()
+        self.assertEqual([self.result], results)
+
+    def testGetStartsRequestsWithoutWaitingForResponses(self):
+        """
+        L{ConcurrentPeerIndex.get} starts a new request once per second, even
+        if earlier requests haven't completed yet.
+        """
+        for name in ('one', 'two', 'three'):
+            self.expect(name)
+        peerindex = ConcurrentPeerIndex('key', client=self.client,
+                                        clock=self.clock)
+        for name in ('one', 'two', 'three'):
+            peerindex.get(name)
+        self.clock.advance(0)
+        self.assertEqual(1, len(self.client.pending))
+        self.clock.advance(0.5)
+        self.assertEqual(1, len(self.client.pending))
+        self.clock.advance(0.5)
+        self.assertEqual(2, len(self.client.pending))
+        self.clock.advance(1)
+        self.assertEqual(3, len(self.client.pending))
+
+    def testGetLimitsRequestsInFlight(self):
+        """
+        L{ConcurrentPeerIndex.get} doesn't start more than C{maxConcurrency}
+        requests at once.  Waiting requests are started as soon as a request
+        in flight completes.
+        """
+        for name in ('one', 'two', 'three'):
+            self.expect(name)
+        peerindex = ConcurrentPeerIndex('key', client=self.client,
+                                        clock=self.clock, maxConcurrency=2)
+        for name in ('one', 'two', 'three'):
+            peerindex.get(name)
+        self.clock.advance(0)
+        self.clock.advance(5)
+        self.assertEqual(2, len(self.client.pending))
+        self.client.flush()
+        self.clock.advance(0)
+        self.assertEqual(1, len(self.client.pending))
+
+    def testGetWithRateLimitExceeded(self):
+        """
+        L{ConcurrentPeerIndex.get} fails with a L{RateLimitError} if the
+        daily rate limit has been reached.
+        """
+        self.expect('terrycojones', {'status': '403'},
+                    dumps({'error': 'Rate limit exceeded'}))
+        peerindex = ConcurrentPeerIndex('key', client=self.client,
+                                        clock=self.clock)
+        failures = []
+        peerindex.get('terrycojones').addErrback(failures.append)
+        self.clock.advance(0)
+        self.client.flush()
+        [failure] = failures
+        self.assertTrue(failure.check(RateLimitError))
+
+    def testGetWithUnknownUser(self):
+        """
+        L{ConcurrentPeerIndex.get} fails with an L{UnknownUserError} if the
+        PeerIndex API doesn't have information about the specified user.
+        """
+        self.expect('unknown', {'status': '404'}, dumps([]))
+        peerindex = ConcurrentPeerIndex('key', client=self.client,
+                                        clock=self.clock)
+        failures = []
+        peerindex.get('unknown').addErrback(failures.append)
+        self.clock.advance(0)
+        self.client.flush()
+        [failure] = failures
+        self.assertTrue(failure.check(UnknownUserError))
+
+    def testGetUsesCache(self):
+        """
+        L{ConcurrentPeerIndex.get} stores profiles in its cache and returns
+        cached profiles without making a call.
+        """
+        self.expect('terrycojones')
+        cache = ResponseCache(':memory:', timeModule=FakeTimeModule())
+        peerindex = ConcurrentPeerIndex('key', client=self.client,
+                                        clock=self.clock, cache=cache)
+        results = []
+        peerindex.get('terrycojones').addCallback(results.append)
+        self.clock.advance(0)
+        self.client.flush()
+        peerindex.get('terrycojones').addCallback(results.append)
+        self.assertEqual([self.result, self.result], results)
+        self.assertEqual([], self.client.pending)
+        self.assertEqual(1, cache.hits)
@@ -0,0 +1,311 @@
+from threading import Event, current_thread
+from unittest import TestCase
+
+from fom.errors import FluidError
+
+from peerindex.fluidinfo import (
+    BatchWriter, ConcurrentBatchWriter, WriterPool, getAbout, getAboutQuery,
+    getTagValues, writeProfile)
+from peerindex.metrics import Metrics
+from peerindex.tests.doubles import FakeFluid, FakeTimeModule
+
+
+class TagValuesTest(TestCase):
+
+    def testGetAbout(self):
+        """
+        L{getAbout} returns the lowercase screen name preceded by an C{@}
+        sign.
+        """
+        self.assertEqual('@terrycojones', getAbout('TerryCoJones'))
+
+    def testGetAboutQuery(self):
+        """
+        L{getAboutQuery} returns a query matching the object about a Twitter
+        user.
+        """
+        self.assertEqual('fluiddb/about="@terrycojones"',
+                         getAboutQuery('terrycojones'))
+
+    def testGetTagValues(self):
+        """
+        L{getTagValues} maps the keys of a PeerIndex profile to
+        C{peerindex.com} tags, leaving out missing and unknown keys.
+        """
+        info = {'twitter': 'terrycojones', 'peerindex': 52,
+                'topics': ['writing']}
+        self.assertEqual(
+            {'peerindex.com/updated-at': {'value': 1000.0},
+             'peerindex.com/peerindex': {'value': 52},
+             'peerindex.com/topics': {'value': ['writing']}},
+            getTagValues(info, 1000.0))
+
+
+class WriteProfileTest(TestCase):
+
+    def testWriteProfile(self):
+        """
+        L{writeProfile} creates the object about a Twitter user and writes
+        its tag values by object ID.
+        """
+        fluid = FakeFluid()
+        values = {'peerindex.com/peerindex': {'value': 52}}
+        self.assertEqual('id-@terrycojones',
+                         writeProfile(fluid, 'TerryCoJones', values))
+        self.assertEqual(['@terrycojones'], fluid.posts)
+        self.assertEqual([[['fluiddb/id="id-@terrycojones"', values]]],
+                         fluid.requests)
+
+    def testWriteProfileWithObjectId(self):
+        """
+        L{writeProfile} doesn't create the object if its ID is given.
+        """
+        fluid = FakeFluid()
+        values = {'peerindex.com/peerindex': {'value': 52}}
+        self.assertEqual('known', writeProfile(fluid, 'terrycojones', values,
+                                               objectId='known'))
+        self.assertEqual([], fluid.posts)
+        self.assertEqual([[['fluiddb/id="known"', values]]], fluid.requests)
+
+    def testWriteProfileRecordsMetrics(self):
+        """
+        L{writeProfile} records the time spent in C{post} and C{put}
+        requests, and counts errors, in the L{Metrics} it's given.
+        """
+        fluid = FakeFluid()
+        fluid.failures.add('fluiddb/id="id-@bad"')
+        metrics = Metrics()
+        writeProfile(fluid, 'terrycojones', {}, metrics)
+        self.assertRaises(FluidError, writeProfile, fluid, 'bad', {},
+                          metrics)
+        self.assertEqual(2, metrics.histograms['post'].count)
+        self.assertEqual(2, metrics.histograms['put'].count)
+        self.assertEqual({'Fluid400Error': 1}, metrics.errors)
+
+
+class BatchWriterTest(TestCase):
+
+    def testAddWritesFullBatch(self):
+        """
+        L{BatchWriter.add} buffers objects until the batch is full and then
+        writes them all with a single request.
+        """
+        fluid = FakeFluid()
+        writer = BatchWriter(fluid, batchSize=2)
+        self.assertEqual([], writer.add('one', 'query1', {'tag': 1}))
+        results = writer.add('two', 'query2', {'tag': 2})
+        self.assertEqual([('one', None), ('two', None)],
+                         [(result.key, result.error) for result in results])
+        self.assertEqual([[['query1', {'tag': 1}], ['query2', {'tag': 2}]]],
+                         fluid.requests)
+
+    def testFlushWritesPartialBatch(self):
+        """L{BatchWriter.flush} writes the objects in a partial batch."""
+        fluid = FakeFluid()
+        writer = BatchWriter(fluid, batchSize=10)
+        writer.add('one', 'query1', {'tag': 1})
+        self.assertEqual(['one'], [result.key for result in writer.flush()])
+        self.assertEqual([[['query1', {'tag': 1}]]], fluid.requests)
+        self.assertEqual([], writer.flush())
+
+    def testFailedBatchFallsBackToSingleWrites(self):
+        """
+        If a batch fails, each object is written individually and only the
+        bad object has an error in its L{WriteResult}.
+        """
+        fluid = FakeFluid()
+        fluid.failures.add('bad')
+        writer = BatchWriter(fluid, batchSize=3)
+        writer.add('one', 'query1', {'tag': 1})
+        writer.add('bad', 'bad', {'tag': 2})
+        results = writer.add('three', 'query3', {'tag': 3})
+        self.assertEqual(['one', 'bad', 'three'],
+                         [result.key for result in results])
+        self.assertEqual(None, results[0].error)
+        self.assertTrue(isinstance(results[1].error, FluidError))
+        self.assertEqual(None, results[2].error)
+        self.assertEqual([[['query1', {'tag': 1}]], [['query3', {'tag': 3}]]],
+                         fluid.requests)
+
+    def testFailedBatchErrorsAreCounted(self):
+        """
+        Errors from a failed batch and from the single writes that follow it
+        are counted in the writer's L{Metrics}.
+        """
+        fluid = FakeFluid()
+        fluid.failures.add('bad')
+        metrics = Metrics()
+        writer = BatchWriter(fluid, batchSize=2, metrics=metrics)
+        writer.add('one', 'query1', {'tag': 1})
+        writer.add('bad', 'bad', {'tag': 2})
+        self.assertEqual({'Fluid400Error': 2}, metrics.errors)
+        self.assertEqual(3, metrics.histograms['put'].count)
+
+    def testBatchSizeGrowsWhenLatencyIsLow(self):
+        """
+        The batch size is doubled, up to C{maxBatchSize}, while batches are
+        written in less than half the target latency.
+        """
+        timeModule = FakeTimeModule()
+        fluid = FakeFluid(timeModule, latency=0.1)
+        writer = BatchWriter(fluid, batchSize=2, maxBatchSize=6,
+                             targetLatency=1.0, timeModule=timeModule)
+        for i in range(2):
+            writer.add(i, 'query', {})
+        self.assertEqual(4, writer.batchSize)
+        for i in range(4):
+            writer.add(i, 'query', {})
+        self.assertEqual(6, writer.batchSize)
+
+    def testBatchSizeShrinksWhenLatencyIsHigh(self):
+        """
+        The batch size is halved, down to C{minBatchSize}, when a batch takes
+        longer than the target latency.
+        """
+        timeModule = FakeTimeModule()
+        fluid = FakeFluid(timeModule, latency=5.0)
+        writer = BatchWriter(fluid, batchSize=4, maxBatchSize=8,
+                             targetLatency=1.0, timeModule=timeModule)
+        for i in range(4):
+            writer.add(i, 'query', {})
+        self.assertEqual(2, writer.batchSize)
+
+    def testBatchSizeIsFixedByDefault(self):
+        """
+        The batch size doesn't change unless a C{maxBatchSize} larger than
+        the initial size is given.
+        """
+        timeModule = FakeTimeModule()
+        fluid = FakeFluid(timeModule, latency=0.1)
+        writer = BatchWriter(fluid, batchSize=2, timeModule=timeModule)
+        for i in range(2):
+            writer.add(i, 'query', {})
+        self.assertEqual(2, writer.batchSize)
+
+
+class WriterPoolTest(TestCase):
+
+    def testResultsAreReturnedInSubmissionOrder(self):
+        """
+        L{WriterPool} returns results in the order tasks were submitted, even
+        if they complete in a different order.
+        """
+        event = Event()
+
+        def function(session, task):
+            if task == 'slow':
+                event.wait()
+            return task.upper()
+
+        pool = WriterPool(object, function, concurrency=2)
+        self.assertEqual([], pool.submit('slow'))
+        pool.submit('fast')
+        self.assertEqual([], pool.poll())
+        event.set()
+        self.assertEqual([('slow', 'SLOW', None), ('fast', 'FAST', None)],
+                         pool.close())
+
+    def testWait(self):
+        """
+        L{WriterPool.wait} returns the results of all submitted tasks,
+        without stopping the workers.
+        """
+        pool = WriterPool(object, lambda session, task: task, concurrency=2)
+        results = pool.submit('one') + pool.submit('two') + pool.wait()
+        self.assertEqual([('one', 'one', None), ('two', 'two', None)],
+                         results)
+        self.assertEqual([('three', 'three', None)],
+                         pool.submit('three') + pool.close())
+
+    def testSubmitBlocksWhenTooManyTasksArePending(self):
+        """
+        L{WriterPool.submit} waits for results when C{maxPending} tasks have
+        been submitted but not returned.
+        """
+        pool = WriterPool(object, lambda session, task: task, concurrency=1,
+                          maxPending=1)
+        self.assertEqual([('one', 'one', None)], pool.submit('one'))
+        self.assertEqual([('two', 'two', None)], pool.submit('two'))
+        self.assertEqual([], pool.close())
+
+    def testErrorsAreCaptured(self):
+        """
+        An exception raised by the function is returned with the result of
+        its task, and doesn't stop the pool.
+        """
+        def function(session, task):
+            if task == 'bad':
+                raise ValueError(task)
+            return task
+
+        pool = WriterPool(object, function, concurrency=1)
+        [bad, good] = pool.submit('bad') + pool.submit('good') + pool.close()
+        self.assertTrue(isinstance(bad[2], ValueError))
+        self.assertEqual(('good', 'good', None), good)
+
+    def testEachWorkerHasItsOwnSession(self):
+        """
+        Each worker in a L{WriterPool} creates its own session and only uses
+        that session.
+        """
+        sessions = {}
+
+        def function(session, task):
+            sessions.setdefault(current_thread().name, set()).add(session)
+
+        pool = WriterPool(object, function, concurrency=3)
+        for i in range(20):
+            pool.submit(i)
+        pool.close()
+        for threadSessions in sessions.itervalues():
+            self.assertEqual(1, len(threadSessions))
+        self.assertEqual(len(sessions),
+                         len(set.union(*sessions.values())))
+
+
+class ConcurrentBatchWriterTest(TestCase):
+
+    def testWrite(self):
+        """
+        L{ConcurrentBatchWriter} writes batches with sessions created by the
+        session factory, and returns results in the order objects were
+        added.
+        """
+        sessions = []
+
+        def sessionFactory():
+            fluid = FakeFluid()
+            fluid.failures.add('bad')
+            sessions.append(fluid)
+            return fluid
+
+        writer = ConcurrentBatchWriter(sessionFactory, concurrency=2,
+                                       batchSize=2)
+        results = []
+        for i in range(7):
+            query = 'bad' if i == 3 else 'query%d' % i
+            results.extend(writer.add(i, query, {'tag': i}))
+        results.extend(writer.close())
+        self.assertEqual(range(7), [result.key for result in results])
+        self.assertEqual([3], [result.key for result in results
+                               if result.error is not None])
+        written = sorted(values['tag']
+                         for fluid in sessions
+                         for request in fluid.requests
+                         for query, values in request)
+        self.assertEqual([0, 1, 2, 4, 5, 6], written)
+
+    def testSync(self):
+        """
+        L{ConcurrentBatchWriter.sync} writes a partial batch and returns the
+        results of all the objects added so far.
+        """
+        fluid = FakeFluid()
+        writer = ConcurrentBatchWriter(lambda: fluid, concurrency=2,
+                                       batchSize=2)
+        results = []
+        for i in range(3):
+            results.extend(writer.add(i, 'query%d' % i, {'tag': i}))
+        results.extend(writer.sync())
+        self.assertEqual(range(3), [result.key for result in results])
+        self.assertEqual([], writer.close())
@@ -0,0 +1,182 @@
+import gzip
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.follow import Follower, OffsetCheckpoint, getIdentity
+from peerindex.tests.doubles import FakeTimeModule
+
+
+class ScriptedTimeModule(FakeTimeModule):
+    """A fake C{time} module that runs a function each time it sleeps.
+
+    @param actions: A C{list} of functions, one is called by each call to
+        C{sleep}.
+    """
+
+    def __init__(self, actions):
+        super(ScriptedTimeModule, self).__init__()
+        self.actions = actions
+
+    def sleep(self, seconds):
+        """Run the next action."""
+        super(ScriptedTimeModule, self).sleep(seconds)
+        self.actions.pop(0)()
+
+
+class FollowerTest(TestCase):
+
+    def setUp(self):
+        super(FollowerTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'profiles.json')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(FollowerTest, self).tearDown()
+
+    def append(self, data, path=None):
+        """Append data to the followed file."""
+        with open(path or self.path, 'a') as outputFile:
+            outputFile.write(data)
+
+    def follow(self, actions, **kwargs):
+        """Follow the file, running an action each time it's idle.
+
+        The follower is stopped after the last action.
+        """
+        follower = Follower(self.path, timeModule=ScriptedTimeModule(
+            actions + [lambda: follower.stop()]), **kwargs)
+        return follower, list(follower.lines())
+
+    def testLines(self):
+        """
+        L{Follower.lines} yields the lines in the file, and then the lines
+        appended to it.
+        """
+        self.append('one\ntwo\n')
+        follower, lines = self.follow([lambda: self.append('three\n')])
+        self.assertEqual(['one\n', 'two\n', 'three\n'], lines)
+        self.assertEqual(getIdentity(self.path) + (14,), follower.position)
+
+    def testPartialLine(self):
+        """
+        A line without its trailing newline isn't yielded until the rest of
+        it is written.
+        """
+        self.append('one\ntw')
+        follower, lines = self.follow([lambda: None,
+                                       lambda: self.append('o\n')])
+        self.assertEqual(['one\n', 'two\n'], lines)
+
+    def testWaitsForFile(self):
+        """L{Follower.lines} waits for the file to be created."""
+        follower, lines = self.follow([lambda: self.append('one\n')])
+        self.assertEqual(['one\n'], lines)
+
+    def testRotation(self):
+        """
+        When the file is rotated, the rest of the rotated file is read before
+        the new file.
+        """
+        def rotate():
+            self.append('two\n')
+            os.rename(self.path, self.path + '.1')
+            self.append('three\n')
+
+        self.append('one\n')
+        follower, lines = self.follow([rotate])
+        self.assertEqual(['one\n', 'two\n', 'three\n'], lines)
+        self.assertEqual(getIdentity(self.path) + (6,), follower.position)
+
+    def testStartFromPosition(self):
+        """
+        L{Follower} starts from a saved position, even if the file has been
+        rotated since.
+        """
+        self.append('one\ntwo\n')
+        position = getIdentity(self.path) + (4,)
+        os.rename(self.path, self.path + '.1')
+        self.append('three\n')
+        follower, lines = self.follow([], position=position)
+        self.assertEqual(['two\n', 'three\n'], lines)
+
+    def testStartFromMissingFile(self):
+        """
+        If the file a saved position refers to no longer exists, reading
+        starts at the beginning of the oldest file.
+        """
+        self.append('one\n', self.path + '.1')
+        self.append('two\n')
+        follower, lines = self.follow([], position=(0, 0, 100))
+        self.assertEqual(['one\n', 'two\n'], lines)
+
+    def testOnIdle(self):
+        """
+        C{onIdle} is called with the current position when the end of the
+        file is reached after new lines have been read.
+        """
+        positions = []
+        self.append('one\n')
+        self.follow([lambda: None, lambda: self.append('two\n')],
+                    onIdle=positions.append)
+        identity = getIdentity(self.path)
+        self.assertEqual([identity + (4,), identity + (8,)], positions)
+
+    def testFileRenamedWhileListing(self):
+        """
+        A file that's renamed or removed between listing the files and
+        reading their identities is picked up at the next poll.
+        """
+        self.append('one\n')
+        gonePath = self.path + '.gone'
+
+        class RacingFollower(Follower):
+            races = 2
+
+            def _getOutputPaths(self):
+                paths = super(RacingFollower, self)._getOutputPaths()
+                if self.races:
+                    self.races -= 1
+                    paths.insert(0, gonePath)
+                return paths
+
+        follower = RacingFollower(self.path, timeModule=ScriptedTimeModule(
+            [lambda: None, lambda: self.append('two\n'),
+             lambda: follower.stop()]))
+        self.assertEqual(['one\n', 'two\n'], list(follower.lines()))
+        self.assertEqual(0, follower.races)
+
+    def testCompressedFile(self):
+        """L{Follower.lines} raises C{ValueError} for compressed files."""
+        outputFile = gzip.open(self.path, 'wb')
+        outputFile.write('one\n')
+        outputFile.close()
+        follower = Follower(self.path)
+        self.assertRaises(ValueError, list, follower.lines())
+
+
+class OffsetCheckpointTest(TestCase):
+
+    def setUp(self):
+        super(OffsetCheckpointTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'profiles.json.offset')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(OffsetCheckpointTest, self).tearDown()
+
+    def testLoadWithoutCheckpoint(self):
+        """
+        L{OffsetCheckpoint.load} returns C{None} if no position has been
+        saved.
+        """
+        self.assertEqual(None, OffsetCheckpoint(self.path).load())
+
+    def testSave(self):
+        """L{OffsetCheckpoint.save} saves a position to load later."""
+        OffsetCheckpoint(self.path).save((1, 2, 3))
+        self.assertEqual((1, 2, 3), OffsetCheckpoint(self.path).load())
+        self.assertEqual(['profiles.json.offset'], os.listdir(self.directory))
@@ -0,0 +1,225 @@
+from json import dumps
+from threading import Thread
+import time
+from unittest import TestCase
+
+from peerindex.client import (
+    CredentialsError, PeerIndex, RateLimitError, UnknownUserError,
+    getProfileURI)
+from peerindex.keypool import DAY, KeyPool, createPeerIndex
+from peerindex.tests.doubles import FakeHTTPClient, FakeTimeModule
+
+
+class InvalidKeyClient(object):
+    """
+    A fake HTTP client that rejects every API key, slowly enough for other
+    threads to wait for the key.
+    """
+
+    def request(self, uri, **kwargs):
+        """Reject the API key after a short delay."""
+        time.sleep(0.05)
+        return {'status': '400'}, dumps({'error': 'Invalid API key'})
+
+
+class KeyPoolTest(TestCase):
+
+    def setUp(self):
+        super(KeyPoolTest, self).setUp()
+        self.client = FakeHTTPClient()
+        self.timeModule = FakeTimeModule()
+
+    def createPool(self, keys=('one', 'two'), **kwargs):
+        """Create a L{KeyPool} that uses the fake client and time module."""
+        return KeyPool(list(keys), client=self.client,
+                       timeModule=self.timeModule, **kwargs)
+
+    def expect(self, key, name='user', status='200', content=None,
+               headers=None):
+        """Script a response to a call made with an API key."""
+        if content is None:
+            content = dumps({'twitter': name, 'key': key})
+        responseHeaders = {'status': status}
+        responseHeaders.update(headers or {})
+        self.client.expect(getProfileURI(name, key)).result(
+            responseHeaders, content)
+
+    def expectRateLimit(self, key, reset):
+        """Script a rate limit error for a call made with an API key."""
+        self.expect(key, status='403',
+                    content=dumps({'error': 'Rate limit exceeded'}),
+                    headers={'x-ratelimit-limit': '10000',
+                             'x-ratelimit-remaining': '0',
+                             'x-ratelimit-reset': str(reset)})
+
+    def testGet(self):
+        """L{KeyPool.get} fetches a profile with one of its keys."""
+        pool = self.createPool(keys=['one'])
+        self.expect('one')
+        self.assertEqual({'twitter': 'user', 'key': 'one'}, pool.get('user'))
+
+    def testGetUsesKeysInTurn(self):
+        """
+        L{KeyPool.get} uses the key that can make a call soonest, so calls
+        are spread between the keys without sleeping.
+        """
+        pool = self.createPool()
+        self.expect('one')
+        self.expect('two')
+        self.expect('one')
+        pool.get('user')
+        pool.get('user')
+        self.assertEqual(None, self.timeModule.lastSleep)
+        pool.get('user')
+        self.assertEqual(1.0, self.timeModule.lastSleep)
+        self.assertEqual([2, 1], [key.calls for key in pool.keys])
+
+    def testThroughputScalesWithKeys(self):
+        """
+        Each key makes one call per second, so N keys make N calls per
+        second.
+        """
+        pool = self.createPool(keys=['one', 'two', 'three', 'four'])
+        for i in range(10):
+            for key in ('one', 'two', 'three', 'four'):
+                self.expect(key)
+        for i in range(40):
+            pool.get('user')
+        self.assertEqual(109.0, self.timeModule.time())
+
+    def testRateLimitedKeyIsRetired(self):
+        """
+        A key that raises L{RateLimitError} is retired until its quota
+        resets, and the call is retried with another key.
+        """
+        pool = self.createPool()
+        self.expectRateLimit('one', reset=3700)
+        self.expect('two')
+        self.expect('two')
+        self.assertEqual('two', pool.get('user')['key'])
+        self.assertEqual(3700, pool.keys[0].retiredUntil)
+        self.timeModule.sleep(1)
+        self.assertEqual('two', pool.get('user')['key'])
+
+    def testBadKeyIsRetired(self):
+        """
+        A key that raises L{CredentialsError} is retired for a day, and the
+        call is retried with another key.
+        """
+        pool = self.createPool()
+        self.expect('one', status='400',
+                    content=dumps({'error': 'Invalid API key'}))
+        self.expect('two')
+        self.assertEqual('two', pool.get('user')['key'])
+        self.assertEqual(100.0 + DAY, pool.keys[0].retiredUntil)
+
+    def testAllKeysInvalid(self):
+        """
+        L{KeyPool.get} raises L{CredentialsError}, instead of pausing, when
+        all the keys are retired because PeerIndex rejected them.
+        """
+        pool = self.createPool()
+        self.expect('one', status='400',
+                    content=dumps({'error': 'Invalid API key'}))
+        self.expect('two', status='400',
+                    content=dumps({'error': 'Invalid API key'}))
+        self.assertRaises(CredentialsError, pool.get, 'user')
+        self.assertEqual(None, self.timeModule.lastSleep)
+
+    def testAllKeysInvalidWithWaitingThreads(self):
+        """
+        Every thread waiting for a key is woken and raises
+        L{CredentialsError} once all the keys are invalid, not just the
+        first one to wake.
+        """
+        pool = KeyPool(['one'], client=InvalidKeyClient(),
+                       timeModule=self.timeModule)
+        errors = []
+
+        def get():
+            try:
+                pool.get('user')
+            except CredentialsError as error:
+                errors.append(error)
+
+        threads = [Thread(target=get) for i in range(3)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([False, False, False],
+                         [thread.is_alive() for thread in threads])
+        self.assertEqual(3, len(errors))
+
+    def testPausesForValidKeys(self):
+        """
+        When some retired keys were rejected and others hit their quota,
+        L{KeyPool.get} pauses until a quota resets.
+        """
+        pool = self.createPool()
+        self.expect('one', status='400',
+                    content=dumps({'error': 'Invalid API key'}))
+        self.expectRateLimit('two', reset=3700)
+        self.expect('two')
+        self.assertEqual('two', pool.get('user')['key'])
+        self.assertEqual(3600.0, self.timeModule.lastSleep)
+
+    def testRetiredKeyIsUsedAfterReset(self):
+        """A retired key is used again once its quota resets."""
+        pool = self.createPool(keys=['one'])
+        self.expectRateLimit('one', reset=3700)
+        self.expect('one')
+        self.assertEqual('one', pool.get('user')['key'])
+        self.assertEqual(3600.0, self.timeModule.lastSleep)
+
+    def testAllKeysRetiredWithoutPause(self):
+        """
+        L{KeyPool.get} raises L{RateLimitError} when all the keys are
+        retired, if pausing is disabled.
+        """
+        pool = self.createPool(pause=False)
+        self.expectRateLimit('one', reset=3700)
+        self.expectRateLimit('two', reset=3700)
+        self.assertRaises(RateLimitError, pool.get, 'user')
+
+    def testOtherErrorsAreRaised(self):
+        """
+        L{KeyPool.get} raises errors for the user, such as
+        L{UnknownUserError}, without retiring the key.
+        """
+        pool = self.createPool()
+        self.expect('one', status='404', content='')
+        self.assertRaises(UnknownUserError, pool.get, 'user')
+        self.assertEqual(None, pool.keys[0].retiredUntil)
+        self.assertFalse(pool.keys[0].busy)
+
+    def testWithoutKeys(self):
+        """L{KeyPool} raises C{ValueError} if it isn't given any keys."""
+        self.assertRaises(ValueError, KeyPool, [])
+
+
+class CreatePeerIndexTest(TestCase):
+
+    def testSingleKey(self):
+        """L{createPeerIndex} returns a L{PeerIndex} for a single key."""
+        self.assertTrue(isinstance(createPeerIndex('one'), PeerIndex))
+
+    def testSeveralKeys(self):
+        """
+        L{createPeerIndex} returns a L{KeyPool} for several comma-separated
+        keys.
+        """
+        pool = createPeerIndex('one, two,')
+        self.assertTrue(isinstance(pool, KeyPool))
+        self.assertEqual(['one', 'two'], [key.key for key in pool.keys])
+
+    def testWithoutSpreading(self):
+        """
+        L{createPeerIndex} passes C{spread} to the L{QuotaScheduler} of
+        each key.
+        """
+        self.assertFalse(createPeerIndex('one', spread=False)._limiter._spread)
+        pool = createPeerIndex('one,two', spread=False)
+        self.assertEqual([False, False],
+                         [key.limiter._spread for key in pool.keys])
@@ -0,0 +1,165 @@
+from json import load
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.client import RateLimitError
+from peerindex.metrics import Histogram, Metrics, MetricsExporter
+from peerindex.tests.doubles import FakeTimeModule
+
+
+class HistogramTest(TestCase):
+
+    def testObserve(self):
+        """
+        L{Histogram.observe} counts a duration in the first bucket whose
+        upper bound isn't less than it.
+        """
+        histogram = Histogram(buckets=(1.0, 2.0, float('inf')))
+        for value in (0.5, 1.0, 1.5, 7.0):
+            histogram.observe(value)
+        self.assertEqual([2, 1, 1], histogram.counts)
+        self.assertEqual(4, histogram.count)
+        self.assertEqual(10.0, histogram.sum)
+        self.assertEqual(7.0, histogram.max)
+
+    def testGetPercentile(self):
+        """
+        L{Histogram.getPercentile} interpolates within the bucket the
+        percentile falls in.
+        """
+        histogram = Histogram(buckets=(1.0, 2.0, float('inf')))
+        for value in (0.5, 0.5, 1.5, 1.5):
+            histogram.observe(value)
+        self.assertEqual(1.0, histogram.getPercentile(0.5))
+        self.assertEqual(1.25, histogram.getPercentile(0.75))
+
+    def testGetPercentileInLastBucket(self):
+        """
+        L{Histogram.getPercentile} uses the largest observed duration as the
+        upper bound of the last bucket.
+        """
+        histogram = Histogram(buckets=(1.0, float('inf')))
+        histogram.observe(5.0)
+        self.assertEqual(5.0, histogram.getPercentile(1.0))
+
+    def testGetPercentileWithoutObservations(self):
+        """
+        L{Histogram.getPercentile} returns C{None} if nothing has been
+        observed.
+        """
+        self.assertEqual(None, Histogram().getPercentile(0.5))
+
+
+class MetricsTest(TestCase):
+
+    def testTime(self):
+        """L{Metrics.time} records the time spent running a block."""
+        timeModule = FakeTimeModule()
+        metrics = Metrics(timeModule)
+        with metrics.time('fetch'):
+            timeModule.sleep(2.0)
+        self.assertEqual(1, metrics.histograms['fetch'].count)
+        self.assertEqual(2.0, metrics.histograms['fetch'].sum)
+
+    def testTimeWithError(self):
+        """
+        L{Metrics.time} records the time spent running a block that raises
+        an exception.
+        """
+        metrics = Metrics(FakeTimeModule())
+
+        def fetch():
+            with metrics.time('fetch'):
+                raise ValueError()
+
+        self.assertRaises(ValueError, fetch)
+        self.assertEqual(1, metrics.histograms['fetch'].count)
+
+    def testCountError(self):
+        """L{Metrics.countError} counts errors by exception class."""
+        metrics = Metrics()
+        metrics.countError(RateLimitError())
+        metrics.countError(RateLimitError())
+        metrics.countError(ValueError())
+        self.assertEqual({'RateLimitError': 2, 'ValueError': 1},
+                         metrics.errors)
+
+    def testGetSnapshot(self):
+        """
+        L{Metrics.getSnapshot} returns a summary of each stage and the error
+        counts.
+        """
+        metrics = Metrics(FakeTimeModule(100.0))
+        metrics.observe('put', 0.5)
+        metrics.countError(ValueError())
+        snapshot = metrics.getSnapshot()
+        self.assertEqual(100.0, snapshot['time'])
+        self.assertEqual({'ValueError': 1}, snapshot['errors'])
+        self.assertEqual(1, snapshot['stages']['put']['count'])
+        self.assertEqual(0.5, snapshot['stages']['put']['max'])
+
+    def testGetPrometheusText(self):
+        """
+        L{Metrics.getPrometheusText} returns cumulative histogram buckets,
+        and error counts, in the Prometheus text format.
+        """
+        metrics = Metrics()
+        metrics.observe('fetch', 0.002)
+        metrics.observe('fetch', 0.003)
+        metrics.countError(RateLimitError())
+        lines = metrics.getPrometheusText().splitlines()
+        self.assertIn('peerindex_stage_seconds_bucket'
+                      '{stage="fetch",le="0.001"} 0', lines)
+        self.assertIn('peerindex_stage_seconds_bucket'
+                      '{stage="fetch",le="0.005"} 2', lines)
+        self.assertIn('peerindex_stage_seconds_bucket'
+                      '{stage="fetch",le="+Inf"} 2', lines)
+        self.assertIn('peerindex_stage_seconds_count{stage="fetch"} 2', lines)
+        self.assertIn('peerindex_errors_total{class="RateLimitError"} 1',
+                      lines)
+
+
+class MetricsExporterTest(TestCase):
+
+    def setUp(self):
+        super(MetricsExporterTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'metrics')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(MetricsExporterTest, self).tearDown()
+
+    def testExportJSON(self):
+        """L{MetricsExporter.export} writes a JSON snapshot."""
+        metrics = Metrics()
+        metrics.observe('fetch', 1.0)
+        MetricsExporter(metrics, self.path).export()
+        with open(self.path) as metricsFile:
+            snapshot = load(metricsFile)
+        self.assertEqual(1, snapshot['stages']['fetch']['count'])
+        self.assertEqual(['metrics'], os.listdir(self.directory))
+
+    def testExportPrometheus(self):
+        """
+        L{MetricsExporter.export} writes the Prometheus text format, if
+        requested.
+        """
+        metrics = Metrics()
+        MetricsExporter(metrics, self.path, format='prometheus').export()
+        with open(self.path) as metricsFile:
+            self.assertEqual(metrics.getPrometheusText(), metricsFile.read())
+
+    def testUnknownFormat(self):
+        """L{MetricsExporter} raises a C{ValueError} for unknown formats."""
+        self.assertRaises(ValueError, MetricsExporter, Metrics(), self.path,
+                          format='xml')
+
+    def testStop(self):
+        """L{MetricsExporter.stop} writes the final metrics."""
+        exporter = MetricsExporter(Metrics(), self.path, interval=3600)
+        exporter.start()
+        exporter.stop()
+        self.assertTrue(os.path.exists(self.path))
@@ -0,0 +1,133 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.names import (
+    BloomFilter, SeenSet, createSeenSet, normalizeName)
+
+
+class NormalizeNameTest(TestCase):
+
+    def testNormalizeName(self):
+        """
+        L{normalizeName} strips whitespace and a leading C{@} sign and
+        converts the name to lowercase.
+        """
+        self.assertEqual('terrycojones', normalizeName(' @TerryCoJones\n'))
+
+    def testNormalizeNameWithPlainName(self):
+        """L{normalizeName} returns a plain lowercase name unchanged."""
+        self.assertEqual('terrycojones', normalizeName('terrycojones'))
+
+
+class SeenSetTest(TestCase):
+
+    def testAdd(self):
+        """L{SeenSet.add} adds a name to the set."""
+        seen = SeenSet()
+        self.assertFalse('foo' in seen)
+        seen.add('foo')
+        self.assertTrue('foo' in seen)
+        self.assertFalse('bar' in seen)
+        self.assertEqual(0, seen.spilled)
+
+    def testSpill(self):
+        """
+        Names are moved to the database when more than C{maxMemory} are held
+        in memory, and are still found.
+        """
+        seen = SeenSet(maxMemory=2)
+        for name in ('one', 'two', 'three'):
+            seen.add(name)
+        self.assertEqual(2, seen.spilled)
+        for name in ('one', 'two', 'three'):
+            self.assertTrue(name in seen)
+        self.assertFalse('four' in seen)
+        seen.close()
+
+    def testPersistentDatabase(self):
+        """
+        A L{SeenSet} with a database path treats the names already in it as
+        seen.
+        """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        path = os.path.join(directory, 'seen.db')
+        seen = SeenSet(maxMemory=1, path=path)
+        seen.add(u'one')
+        seen.close()
+        seen = SeenSet(path=path)
+        self.assertTrue('one' in seen)
+        self.assertFalse('two' in seen)
+        seen.close()
+
+    def testCloseSpillsMemory(self):
+        """
+        L{SeenSet.close} moves the names still held in memory to a
+        persistent database, so they're seen when it's opened again.
+        """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        path = os.path.join(directory, 'seen.db')
+        seen = SeenSet(maxMemory=100, path=path)
+        seen.add(u'one')
+        seen.add(u'two')
+        seen.close()
+        self.assertEqual(2, seen.spilled)
+        seen = SeenSet(path=path)
+        self.assertTrue('one' in seen)
+        self.assertTrue('two' in seen)
+        seen.close()
+
+
+class BloomFilterTest(TestCase):
+
+    def testAdd(self):
+        """Names added to a L{BloomFilter} are always found."""
+        bloom = BloomFilter(1000)
+        names = ['user%d' % i for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+        self.assertTrue(all(name in bloom for name in names))
+
+    def testFalsePositiveRate(self):
+        """
+        A L{BloomFilter} at capacity reports about C{errorRate} of new names
+        as present.
+        """
+        bloom = BloomFilter(1000, errorRate=0.01)
+        for i in range(1000):
+            bloom.add('user%d' % i)
+        falsePositives = sum(1 for i in range(10000)
+                             if 'other%d' % i in bloom)
+        self.assertTrue(falsePositives < 300)
+
+    def testUnicode(self):
+        """L{BloomFilter} accepts C{unicode} names."""
+        bloom = BloomFilter(10)
+        bloom.add(u'caf\xe9')
+        self.assertTrue(u'caf\xe9' in bloom)
+
+    def testSize(self):
+        """
+        A L{BloomFilter} uses about 1.8 bytes per name at the default error
+        rate.
+        """
+        bloom = BloomFilter(1000000)
+        self.assertEqual(14377588, bloom.size)
+        self.assertEqual(10, bloom.hashes)
+
+
+class CreateSeenSetTest(TestCase):
+
+    def testSeenSet(self):
+        """L{createSeenSet} returns a L{SeenSet} by default."""
+        self.assertTrue(isinstance(createSeenSet(), SeenSet))
+
+    def testBloomFilter(self):
+        """
+        L{createSeenSet} returns a L{BloomFilter} if a capacity is given.
+        """
+        self.assertTrue(isinstance(createSeenSet(bloomCapacity=10),
+                                   BloomFilter))
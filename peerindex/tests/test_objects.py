@@ -0,0 +1,56 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.objects import WARM_QUERY, ObjectIndex, warmObjectIndex
+from peerindex.tests.doubles import FakeFluid
+
+
+class ObjectIndexTest(TestCase):
+
+    def setUp(self):
+        super(ObjectIndexTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'objects.db')
+        self.index = ObjectIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        rmtree(self.directory)
+        super(ObjectIndexTest, self).tearDown()
+
+    def testGetUnknown(self):
+        """L{ObjectIndex.get} returns C{None} for an unknown user."""
+        self.assertEqual(None, self.index.get('terrycojones'))
+
+    def testAdd(self):
+        """
+        L{ObjectIndex.add} records the object ID for a user, whatever the
+        case of the screen name.
+        """
+        self.index.add('TerryCoJones', 'id')
+        self.assertEqual('id', self.index.get('terrycojones'))
+
+    def testIdsArePersistent(self):
+        """IDs are available after the index is closed and reopened."""
+        self.index.add('terrycojones', 'id')
+        self.index.close()
+        self.index = ObjectIndex(self.path)
+        self.assertEqual('id', self.index.get('terrycojones'))
+
+
+class WarmObjectIndexTest(TestCase):
+
+    def testWarmObjectIndex(self):
+        """
+        L{warmObjectIndex} adds the IDs of the objects matching the query
+        and returns how many were added.
+        """
+        fluid = FakeFluid()
+        fluid.abouts = {'id1': '@one', 'id2': '@two'}
+        index = ObjectIndex(':memory:')
+        self.assertEqual(2, warmObjectIndex(fluid, index))
+        self.assertEqual([WARM_QUERY], fluid.queries)
+        self.assertEqual('id1', index.get('one'))
+        self.assertEqual('id2', index.get('two'))
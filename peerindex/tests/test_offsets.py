@@ -0,0 +1,154 @@
+import gzip
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.offsets import IndexedProfiles, OffsetIndex
+
+
+class OffsetIndexTest(TestCase):
+
+    def setUp(self):
+        super(OffsetIndexTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'profiles.json')
+        self.index = OffsetIndex(os.path.join(self.directory, 'index'))
+
+    def tearDown(self):
+        self.index.close()
+        rmtree(self.directory)
+        super(OffsetIndexTest, self).tearDown()
+
+    def append(self, data):
+        """Append data to the profiles file."""
+        with open(self.path, 'ab') as outputFile:
+            outputFile.write(data)
+
+    def testUpdate(self):
+        """
+        L{OffsetIndex.update} records the offset and length of each line,
+        by normalized screen name, and returns the number of lines indexed.
+        """
+        self.append('{"twitter": "One"}\n\n{"twitter": "two"}\n')
+        self.assertEqual(2, self.index.update(self.path))
+        self.assertEqual((0, 19), self.index.get('@one'))
+        self.assertEqual((20, 19), self.index.get('two'))
+        self.assertEqual(None, self.index.get('three'))
+        self.assertEqual(39, self.index.getSize())
+
+    def testUpdateReadsAppendedLines(self):
+        """
+        L{OffsetIndex.update} only reads the lines appended since the last
+        update, and indexes the last profile for a repeated user.
+        """
+        self.append('{"twitter": "one"}\n')
+        self.index.update(self.path)
+        self.append('{"twitter": "one"}\n{"twitter": "two"}\n')
+        self.assertEqual(2, self.index.update(self.path))
+        self.assertEqual((19, 19), self.index.get('one'))
+
+    def testUpdateSkipsPartialLine(self):
+        """A partial line at the end of the file isn't indexed."""
+        self.append('{"twitter": "one"}\n{"twitter"')
+        self.assertEqual(1, self.index.update(self.path))
+        self.append(': "two"}\n')
+        self.assertEqual(1, self.index.update(self.path))
+        self.assertEqual((19, 19), self.index.get('two'))
+
+    def testUpdateWithCompressedFile(self):
+        """L{OffsetIndex.update} raises C{ValueError} for compressed files."""
+        outputFile = gzip.open(self.path, 'wb')
+        outputFile.write('{"twitter": "one"}\n')
+        outputFile.close()
+        self.assertRaises(ValueError, self.index.update, self.path)
+
+    def testUpdateWithTruncatedFile(self):
+        """
+        L{OffsetIndex.update} raises C{ValueError} if the file is shorter
+        than the part already indexed.
+        """
+        self.append('{"twitter": "one"}\n')
+        self.index.update(self.path)
+        os.remove(self.path)
+        self.append('\n')
+        self.assertRaises(ValueError, self.index.update, self.path)
+
+    def testUpdateWithReplacedFile(self):
+        """
+        L{OffsetIndex.update} raises C{ValueError} if the start of the file
+        has changed since it was indexed, even if it's grown.
+        """
+        self.append('{"twitter": "one"}\n')
+        self.index.update(self.path)
+        os.remove(self.path)
+        self.append('{"twitter": "two"}\n{"twitter": "one"}\n')
+        self.assertRaises(ValueError, self.index.update, self.path)
+
+    def testClear(self):
+        """
+        L{OffsetIndex.clear} removes every entry, so the next update
+        indexes the whole file.
+        """
+        self.append('{"twitter": "one"}\n')
+        self.index.update(self.path)
+        os.remove(self.path)
+        self.append('{"twitter": "two"}\n{"twitter": "one"}\n')
+        self.index.clear()
+        self.assertEqual(0, self.index.getSize())
+        self.assertEqual(2, self.index.update(self.path))
+        self.assertEqual((19, 19), self.index.get('one'))
+
+
+class IndexedProfilesTest(TestCase):
+
+    def setUp(self):
+        super(IndexedProfilesTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'profiles.json')
+        with open(self.path, 'wb') as outputFile:
+            outputFile.write('{"twitter": "one", "peerindex": 1}\n'
+                             '{"twitter": "two", "peerindex": 2}\n')
+        self.index = OffsetIndex(':memory:')
+        self.index.update(self.path)
+        self.profiles = IndexedProfiles(self.path, self.index)
+
+    def tearDown(self):
+        self.profiles.close()
+        self.index.close()
+        rmtree(self.directory)
+        super(IndexedProfilesTest, self).tearDown()
+
+    def testGet(self):
+        """L{IndexedProfiles.get} returns the profile of a user."""
+        self.assertEqual({'twitter': 'two', 'peerindex': 2},
+                         self.profiles.get('Two'))
+        self.assertEqual(None, self.profiles.get('three'))
+
+    def testLookup(self):
+        """
+        L{IndexedProfiles.lookup} yields the profiles of the users it's
+        given, in order, skipping users that aren't in the index.
+        """
+        self.assertEqual(['two', 'one'],
+                         [profile['twitter'] for profile in
+                          self.profiles.lookup(['two', 'three', 'one'])])
+
+    def testReplacedFile(self):
+        """
+        L{IndexedProfiles} raises C{ValueError} if the file has been
+        replaced since it was indexed.
+        """
+        with open(self.path, 'wb') as outputFile:
+            outputFile.write('{"twitter": "two", "peerindex": 2}\n'
+                             '{"twitter": "one", "peerindex": 1}\n')
+        self.assertRaises(ValueError, IndexedProfiles, self.path, self.index)
+
+    def testGetChecksName(self):
+        """
+        L{IndexedProfiles.get} raises C{ValueError} if the indexed line is
+        another user's profile.
+        """
+        self.index._connection.execute(
+            "UPDATE offsets SET offset = 0 WHERE name = 'two'")
+        self.assertRaises(ValueError, self.profiles.get, 'two')
@@ -0,0 +1,178 @@
+from gzip import GzipFile
+from json import dumps, loads
+import os
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.output import (
+    ProfileWriter, getOutputPaths, readLines, readOutputLines)
+
+
+def compress(data):
+    """Compress data with C{gzip}."""
+    output = StringIO()
+    gzipFile = GzipFile(fileobj=output, mode='wb')
+    gzipFile.write(data)
+    gzipFile.close()
+    return output.getvalue()
+
+
+class ReadLinesTest(TestCase):
+
+    def testReadLines(self):
+        """L{readLines} reads lines from a plain file."""
+        self.assertEqual(['one\n', 'two\n', 'three'],
+                         list(readLines(StringIO('one\ntwo\nthree'))))
+
+    def testReadLinesWithEmptyFile(self):
+        """L{readLines} doesn't yield anything for an empty file."""
+        self.assertEqual([], list(readLines(StringIO(''))))
+
+    def testReadLinesWithPrefix(self):
+        """
+        L{readLines} includes data already read from the start of the file.
+        """
+        self.assertEqual(['one\n', 'two\n', 'three'],
+                         list(readLines(StringIO('o\nthree'),
+                                        prefix='one\ntw')))
+
+    def testReadLinesWithCompressedPrefix(self):
+        """
+        L{readLines} detects compressed data when the magic number is split
+        between the prefix and the file.
+        """
+        data = compress('one\ntwo\n')
+        self.assertEqual(['one\n', 'two\n'],
+                         list(readLines(StringIO(data[1:]),
+                                        prefix=data[:1])))
+
+    def testReadLinesWithCompressedFile(self):
+        """L{readLines} decompresses a C{gzip} compressed file."""
+        data = compress('one\ntwo\n')
+        self.assertEqual(['one\n', 'two\n'],
+                         list(readLines(StringIO(data), blockSize=3)))
+
+    def testReadLinesWithConcatenatedMembers(self):
+        """
+        L{readLines} reads all the members of a compressed file that has
+        been appended to.
+        """
+        data = compress('one\ntw') + compress('o\nthree\n')
+        self.assertEqual(['one\n', 'two\n', 'three\n'],
+                         list(readLines(StringIO(data))))
+
+    def testReadLinesWithTruncatedCompressedFile(self):
+        """
+        L{readLines} reads a truncated compressed file up to the point where
+        the data ends.
+        """
+        data = compress(''.join('line %d\n' % i for i in range(1000)))
+        lines = list(readLines(StringIO(data[:len(data) // 2])))
+        self.assertEqual(['line 0\n', 'line 1\n'], lines[:2])
+
+
+class ProfileWriterTest(TestCase):
+
+    def setUp(self):
+        super(ProfileWriterTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'profiles.json')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(ProfileWriterTest, self).tearDown()
+
+    def testWrite(self):
+        """
+        L{ProfileWriter.write} appends a profile to the output file as a line
+        of JSON.
+        """
+        with open(self.path, 'w') as outputFile:
+            outputFile.write(dumps({'twitter': 'one'}) + '\n')
+        writer = ProfileWriter(self.path)
+        writer.write({'twitter': 'two'})
+        writer.close()
+        self.assertEqual([{'twitter': 'one'}, {'twitter': 'two'}],
+                         [loads(line) for line in open(self.path)])
+
+    def testWriteFlushesPeriodically(self):
+        """
+        L{ProfileWriter} flushes its buffer every C{flushEvery} profiles and
+        calls the C{onFlush} function afterwards.
+        """
+        flushes = []
+
+        def onFlush():
+            flushes.append(len(open(self.path).readlines()))
+
+        writer = ProfileWriter(self.path, flushEvery=2, onFlush=onFlush)
+        for i in range(5):
+            writer.write({'twitter': 'user%d' % i})
+        self.assertEqual([2, 4], flushes)
+        writer.close()
+        self.assertEqual([2, 4, 5], flushes)
+
+    def testWriteCompressed(self):
+        """L{ProfileWriter} compresses its output if C{compress} is set."""
+        writer = ProfileWriter(self.path, compress=True)
+        writer.write({'twitter': 'one'})
+        writer.close()
+        with open(self.path, 'rb') as outputFile:
+            self.assertEqual('\x1f\x8b', outputFile.read(2))
+        self.assertEqual([{'twitter': 'one'}],
+                         [loads(line) for line in readOutputLines(self.path)])
+
+    def testCompressedFileIsRotatedWhenReopened(self):
+        """
+        An existing compressed output file is rotated instead of being
+        appended to.
+        """
+        for name in ('one', 'two'):
+            writer = ProfileWriter(self.path, compress=True)
+            writer.write({'twitter': name})
+            writer.close()
+        self.assertEqual([self.path + '.1', self.path],
+                         getOutputPaths(self.path))
+        self.assertEqual([{'twitter': 'one'}, {'twitter': 'two'}],
+                         [loads(line) for line in readOutputLines(self.path)])
+
+    def testRotateByRecords(self):
+        """
+        L{ProfileWriter} rotates its output file after C{maxRecords} profiles
+        have been written to it.
+        """
+        writer = ProfileWriter(self.path, maxRecords=2)
+        for i in range(5):
+            writer.write({'twitter': 'user%d' % i})
+        writer.close()
+        self.assertEqual([self.path + '.1', self.path + '.2', self.path],
+                         getOutputPaths(self.path))
+        self.assertEqual(1, len(open(self.path).readlines()))
+        self.assertEqual(['user%d' % i for i in range(5)],
+                         [loads(line)['twitter']
+                          for line in readOutputLines(self.path)])
+
+    def testRotateByBytes(self):
+        """
+        L{ProfileWriter} rotates its output file after C{maxBytes} bytes have
+        been written to it.
+        """
+        writer = ProfileWriter(self.path, maxBytes=30)
+        for i in range(3):
+            writer.write({'twitter': 'user%d' % i})
+        writer.close()
+        self.assertEqual([self.path + '.1', self.path],
+                         getOutputPaths(self.path))
+
+    def testGetOutputPathsOrdersNumerically(self):
+        """
+        L{getOutputPaths} returns rotated files in numeric order, ignoring
+        unrelated files.
+        """
+        for suffix in ('.10', '.2', '.1', '.bak'):
+            open(self.path + suffix, 'w').close()
+        self.assertEqual([self.path + '.1', self.path + '.2',
+                          self.path + '.10'],
+                         getOutputPaths(self.path))
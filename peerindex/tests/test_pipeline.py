@@ -0,0 +1,177 @@
+from json import dumps, loads
+import os
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.client import RateLimitError, UnknownUserError
+from peerindex.fluidinfo import BatchWriter
+from peerindex.names import SeenSet
+from peerindex.output import ProfileWriter
+from peerindex.pipeline import (
+    consume, dedup, fetchProfiles, getProfileName, mapTags, normalizeNames,
+    readNames, readProfiles, writeFluidinfo, writeJSONL)
+from peerindex.tests.doubles import FakeFluid
+
+
+class FakePeerIndex(object):
+    """A fake L{PeerIndex} client that returns a minimal profile."""
+
+    def __init__(self, unknown=(), exhausted=False):
+        self.calls = []
+        self._unknown = unknown
+        self._exhausted = exhausted
+
+    def get(self, name):
+        self.calls.append(name)
+        if self._exhausted:
+            raise RateLimitError(name)
+        if name in self._unknown:
+            raise UnknownUserError(name)
+        return {'twitter': name, 'peerindex': len(name)}
+
+
+class SourceTest(TestCase):
+
+    def testReadNames(self):
+        """L{readNames} yields stripped names and skips blank lines."""
+        self.assertEqual(['one', '@Two'],
+                         list(readNames(StringIO('one\n\n @Two \n'))))
+
+    def testReadProfiles(self):
+        """L{readProfiles} yields a C{dict} for each JSON line."""
+        data = '%s\n\n%s' % (dumps({'twitter': 'one'}),
+                             dumps({'twitter': 'two'}))
+        self.assertEqual([{'twitter': 'one'}, {'twitter': 'two'}],
+                         list(readProfiles(StringIO(data))))
+
+
+class TransformTest(TestCase):
+
+    def testNormalizeNames(self):
+        """L{normalizeNames} normalizes each name."""
+        self.assertEqual(['foo', 'bar'],
+                         list(normalizeNames(['@Foo', 'bar\n'])))
+
+    def testDedup(self):
+        """L{dedup} yields only the first occurrence of each item."""
+        self.assertEqual(['foo', 'bar'],
+                         list(dedup(['foo', 'bar', 'foo'])))
+
+    def testDedupWithSeen(self):
+        """
+        L{dedup} records values in C{seen}, if given, and skips the values
+        already in it.
+        """
+        seen = SeenSet(maxMemory=1)
+        seen.add('foo')
+        self.assertEqual(['bar'], list(dedup(['foo', 'bar', 'bar'],
+                                             seen=seen)))
+        self.assertTrue('bar' in seen)
+
+    def testDedupWithKey(self):
+        """L{dedup} compares the values returned by C{key}, if given."""
+        profiles = [{'twitter': 'Foo'}, {'twitter': '@foo'}]
+        self.assertEqual([{'twitter': 'Foo'}],
+                         list(dedup(profiles, key=getProfileName)))
+
+    def testMapTags(self):
+        """
+        L{mapTags} yields the screen name and Fluidinfo tag values for each
+        profile.
+        """
+        [(screenname, values)] = mapTags([{'twitter': 'foo', 'audience': 3}],
+                                         updatedAt=1.5)
+        self.assertEqual('foo', screenname)
+        self.assertEqual({'peerindex.com/updated-at': {'value': 1.5},
+                          'peerindex.com/audience': {'value': 3}}, values)
+
+
+class SinkTest(TestCase):
+
+    def setUp(self):
+        super(SinkTest, self).setUp()
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(SinkTest, self).tearDown()
+
+    def testFetchProfiles(self):
+        """
+        L{fetchProfiles} yields the profile for each name and skips unknown
+        users.
+        """
+        peerindex = FakePeerIndex(unknown=['bad'])
+        profiles = list(fetchProfiles(peerindex, ['one', 'bad', 'two']))
+        self.assertEqual(['one', 'two'],
+                         [profile['twitter'] for profile in profiles])
+        self.assertEqual(['one', 'bad', 'two'], peerindex.calls)
+
+    def testFetchProfilesWithRateLimitExceeded(self):
+        """
+        L{fetchProfiles} stops with a L{RateLimitError} if the quota is
+        exhausted.
+        """
+        profiles = fetchProfiles(FakePeerIndex(exhausted=True), ['one'])
+        self.assertRaises(RateLimitError, list, profiles)
+
+    def testFetchProfilesIsLazy(self):
+        """
+        L{fetchProfiles} only fetches a profile when the next stage asks for
+        it.
+        """
+        peerindex = FakePeerIndex()
+        profiles = fetchProfiles(peerindex, ['one', 'two'])
+        next(profiles)
+        self.assertEqual(['one'], peerindex.calls)
+
+    def testWriteJSONL(self):
+        """
+        L{writeJSONL} writes each profile and passes it on to the next
+        stage.
+        """
+        path = os.path.join(self.directory, 'profiles.json')
+        writer = ProfileWriter(path)
+        profiles = [{'twitter': 'one'}, {'twitter': 'two'}]
+        self.assertEqual(profiles, list(writeJSONL(writer, profiles)))
+        writer.close()
+        with open(path) as outputFile:
+            self.assertEqual(profiles, map(loads, outputFile))
+
+    def testWriteFluidinfo(self):
+        """
+        L{writeFluidinfo} writes tag values on the object about each user and
+        yields a L{WriteResult} for each.
+        """
+        fluid = FakeFluid()
+        writer = BatchWriter(fluid, batchSize=2)
+        items = [('one', {'tag': 1}), ('two', {'tag': 2}),
+                 ('three', {'tag': 3})]
+        results = list(writeFluidinfo(writer, items))
+        self.assertEqual(['one', 'two', 'three'],
+                         [result.key for result in results])
+        self.assertEqual(
+            [[['fluiddb/about="@one"', {'tag': 1}],
+              ['fluiddb/about="@two"', {'tag': 2}]],
+             [['fluiddb/about="@three"', {'tag': 3}]]], fluid.requests)
+
+    def testPipeline(self):
+        """
+        Stages can be chained to fetch, archive and write profiles in a
+        single pass, without fetching duplicate names.
+        """
+        path = os.path.join(self.directory, 'profiles.json')
+        peerindex = FakePeerIndex()
+        fluid = FakeFluid()
+        writer = ProfileWriter(path)
+        names = dedup(normalizeNames(readNames(StringIO('Foo\n@foo\nbar'))))
+        profiles = writeJSONL(writer, fetchProfiles(peerindex, names))
+        self.assertEqual(2, consume(writeFluidinfo(
+            BatchWriter(fluid, batchSize=1), mapTags(profiles))))
+        writer.close()
+        self.assertEqual(['foo', 'bar'], peerindex.calls)
+        self.assertEqual(2, len(fluid.requests))
+        with open(path) as outputFile:
+            self.assertEqual(2, len(outputFile.readlines()))
@@ -0,0 +1,146 @@
+import socket
+from unittest import TestCase
+
+from peerindex.pool import ConnectionPool, SessionAdapter, usePool
+from peerindex.tests.doubles import FakeHTTPClient, FakeTimeModule
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        super(ConnectionPoolTest, self).setUp()
+        self.client = FakeHTTPClient()
+        self.timeModule = FakeTimeModule()
+        self.pool = ConnectionPool(httpFactory=lambda: self.client,
+                                   timeModule=self.timeModule)
+
+    def expect(self, uri='http://example.com/path', **kwargs):
+        """Script a successful response for a request."""
+        response = self.client.expect(uri, **kwargs)
+        response.result({'status': '200'}, 'content')
+        return response
+
+    def testRequest(self):
+        """
+        L{ConnectionPool.request} makes the request on a new connection and
+        returns the result.
+        """
+        self.expect()
+        self.assertEqual(({'status': '200'}, 'content'),
+                         self.pool.request('http://example.com/path'))
+        self.assertEqual(1, self.pool.created)
+
+    def testRequestPassesArguments(self):
+        """
+        L{ConnectionPool.request} passes the method, body and headers to the
+        connection.
+        """
+        self.expect(method='PUT', body='body', headers={'a': 'b'})
+        self.pool.request('http://example.com/path', 'PUT', 'body',
+                          {'a': 'b'})
+
+    def testConnectionsAreReused(self):
+        """
+        L{ConnectionPool.request} reuses an idle connection to the same
+        host.
+        """
+        self.expect()
+        self.expect()
+        self.pool.request('http://example.com/path')
+        self.pool.request('http://example.com/path')
+        self.assertEqual(1, self.pool.created)
+        self.assertEqual(1, self.pool.reused)
+
+    def testConnectionsAreNotSharedBetweenHosts(self):
+        """Each host has its own connections."""
+        self.expect()
+        self.expect('http://example.org/path')
+        self.pool.request('http://example.com/path')
+        self.pool.request('http://example.org/path')
+        self.assertEqual(2, self.pool.created)
+
+    def testStaleConnectionIsRetried(self):
+        """
+        If a request fails on a reused connection, it's retried once on a
+        new connection.
+        """
+        self.expect()
+        self.client.expect('http://example.com/path').fail(
+            socket.error('Connection reset by peer'))
+        self.expect()
+        self.pool.request('http://example.com/path')
+        self.assertEqual(({'status': '200'}, 'content'),
+                         self.pool.request('http://example.com/path'))
+        self.assertEqual(1, self.pool.retried)
+        self.assertEqual(2, self.pool.created)
+
+    def testNewConnectionErrorIsRaised(self):
+        """
+        If a request fails on a new connection the error is raised, since
+        the server isn't reachable.
+        """
+        self.client.expect('http://example.com/path').fail(
+            socket.error('Connection refused'))
+        self.assertRaises(socket.error, self.pool.request,
+                          'http://example.com/path')
+        self.assertEqual(0, self.pool.retried)
+
+    def testIdleConnectionsExpire(self):
+        """
+        Connections idle for longer than C{maxIdle} seconds are discarded
+        instead of reused.
+        """
+        pool = ConnectionPool(maxIdle=30, httpFactory=lambda: self.client,
+                              timeModule=self.timeModule)
+        self.expect()
+        self.expect()
+        self.expect()
+        pool.request('http://example.com/path')
+        self.timeModule.sleep(10)
+        pool.request('http://example.com/path')
+        self.timeModule.sleep(60)
+        pool.request('http://example.com/path')
+        self.assertEqual(2, pool.created)
+        self.assertEqual(1, pool.reused)
+
+
+class FakeDatabase(object):
+    """A fake C{fom.db.FluidDB} with a C{session} attribute."""
+
+    session = None
+
+
+class FakeSession(object):
+    """A fake C{fom.session.Fluid} with a C{db} attribute."""
+
+    def __init__(self):
+        self.db = FakeDatabase()
+
+
+class SessionAdapterTest(TestCase):
+
+    def testRequest(self):
+        """
+        L{SessionAdapter.request} makes the request through the pool and
+        returns a C{requests}-style response.
+        """
+        client = FakeHTTPClient()
+        client.expect('http://fluiddb/objects', method='POST', body='{}',
+                      headers={'content-type': 'application/json'}).result(
+            {'status': '201', 'content-type': 'application/json'}, '{"id": 1}')
+        adapter = SessionAdapter(ConnectionPool(httpFactory=lambda: client))
+        response = adapter.request(
+            'POST', 'http://fluiddb/objects', data='{}',
+            headers={'content-type': 'application/json'})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual('application/json', response.headers['content-type'])
+        self.assertEqual('{"id": 1}', response.text)
+
+    def testUsePool(self):
+        """
+        L{usePool} replaces the C{requests} session of a C{fom} session with
+        a L{SessionAdapter}.
+        """
+        fdb = FakeSession()
+        self.assertTrue(usePool(fdb, ConnectionPool()) is fdb)
+        self.assertTrue(isinstance(fdb.db.session, SessionAdapter))
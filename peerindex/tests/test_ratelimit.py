@@ -0,0 +1,249 @@
+from unittest import TestCase
+
+from peerindex.ratelimit import QuotaScheduler, QuotaTracker, TokenBucket
+from peerindex.tests.doubles import FakeTimeModule
+
+
+class TokenBucketTest(TestCase):
+
+    def testReserveWithTokensAvailable(self):
+        """
+        L{TokenBucket.reserve} returns C{0.0} while the bucket has tokens, to
+        allow a burst of calls.
+        """
+        timeModule = FakeTimeModule()
+        bucket = TokenBucket(rate=1.0, capacity=3, timeModule=timeModule)
+        self.assertEqual([0.0, 0.0, 0.0],
+                         [bucket.reserve() for i in range(3)])
+
+    def testReserveWithEmptyBucket(self):
+        """
+        L{TokenBucket.reserve} returns the number of seconds until the next
+        token is available when the bucket is empty.  Tokens reserved in
+        advance are accounted for.
+        """
+        timeModule = FakeTimeModule()
+        bucket = TokenBucket(rate=2.0, capacity=1, timeModule=timeModule)
+        self.assertEqual(0.0, bucket.reserve())
+        self.assertEqual(0.5, bucket.reserve())
+        self.assertEqual(1.0, bucket.reserve())
+
+    def testPeek(self):
+        """
+        L{TokenBucket.peek} returns the delay L{TokenBucket.reserve} would
+        return, without taking a token.
+        """
+        timeModule = FakeTimeModule()
+        bucket = TokenBucket(rate=2.0, timeModule=timeModule)
+        self.assertEqual(0.0, bucket.peek())
+        bucket.reserve()
+        self.assertEqual(0.5, bucket.peek())
+        self.assertEqual(0.5, bucket.peek())
+        timeModule.currentTime += 0.25
+        self.assertEqual(0.25, bucket.peek())
+
+    def testPostpone(self):
+        """
+        L{TokenBucket.postpone} moves the last reserved call to a later time,
+        so the next token is only available a full interval after it.
+        """
+        timeModule = FakeTimeModule()
+        bucket = TokenBucket(rate=1.0, timeModule=timeModule)
+        bucket.reserve()
+        bucket.postpone(200.0)
+        timeModule.currentTime = 200.0
+        self.assertEqual(1.0, bucket.reserve())
+
+    def testWaitSleepsUntilTokenIsAvailable(self):
+        """L{TokenBucket.wait} sleeps until a token is available."""
+        timeModule = FakeTimeModule()
+        bucket = TokenBucket(timeModule=timeModule)
+        bucket.wait()
+        self.assertEqual(None, timeModule.lastSleep)
+        timeModule.currentTime += 0.25
+        self.assertEqual(0.75, bucket.wait())
+        self.assertEqual(0.75, timeModule.lastSleep)
+
+    def testBucketRefillsUpToCapacity(self):
+        """
+        Tokens are added to a L{TokenBucket} over time, but never beyond its
+        capacity.
+        """
+        timeModule = FakeTimeModule()
+        bucket = TokenBucket(rate=1.0, capacity=2, timeModule=timeModule)
+        bucket.reserve()
+        bucket.reserve()
+        timeModule.currentTime += 10
+        self.assertEqual([0.0, 0.0, 1.0],
+                         [bucket.reserve() for i in range(3)])
+
+
+class QuotaTrackerTest(TestCase):
+
+    def testUpdate(self):
+        """
+        L{QuotaTracker.update} reads the quota from the rate limit headers
+        returned by the PeerIndex API.
+        """
+        tracker = QuotaTracker()
+        tracker.update({'status': '200', 'x-ratelimit-remaining': '9998',
+                        'x-ratelimit-limit': '10000',
+                        'x-ratelimit-reset': '1316386800'})
+        self.assertEqual(10000, tracker.limit)
+        self.assertEqual(9998, tracker.remaining)
+        self.assertEqual(1316386800, tracker.reset)
+
+    def testUpdateWithoutHeaders(self):
+        """
+        L{QuotaTracker.update} ignores responses without rate limit headers.
+        """
+        tracker = QuotaTracker()
+        tracker.update({'status': '200', 'x-ratelimit-remaining': '9998',
+                        'x-ratelimit-limit': '10000',
+                        'x-ratelimit-reset': '1316386800'})
+        tracker.update({'status': '403'})
+        self.assertEqual(9998, tracker.remaining)
+
+    def testRenew(self):
+        """
+        L{QuotaTracker.renew} restores the full quota and forgets the reset
+        time.
+        """
+        tracker = QuotaTracker()
+        tracker.update({'x-ratelimit-remaining': '0',
+                        'x-ratelimit-limit': '10000',
+                        'x-ratelimit-reset': '1316386800'})
+        tracker.renew()
+        self.assertEqual(10000, tracker.remaining)
+        self.assertEqual(None, tracker.reset)
+
+
+class QuotaSchedulerTest(TestCase):
+
+    def headers(self, remaining, reset):
+        """Get response headers reporting the specified quota."""
+        return {'status': '200', 'x-ratelimit-limit': '10000',
+                'x-ratelimit-remaining': str(remaining),
+                'x-ratelimit-reset': str(reset)}
+
+    def testReserveWithUnknownQuota(self):
+        """
+        L{QuotaScheduler.reserve} only applies the per second limit until
+        the server has reported the quota.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(timeModule=timeModule)
+        self.assertEqual(0.0, scheduler.reserve())
+        self.assertEqual(1.0, scheduler.reserve())
+
+    def testReserveSpreadsRemainingQuota(self):
+        """
+        L{QuotaScheduler.reserve} spaces calls evenly so the remaining quota
+        lasts until it resets.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(timeModule=timeModule)
+        scheduler.update(self.headers(10, 200.0))
+        self.assertEqual(0.0, scheduler.reserve())
+        self.assertEqual(10.0, scheduler.reserve())
+        self.assertEqual(20.0, scheduler.reserve())
+
+    def testReserveWithoutSpreading(self):
+        """
+        L{QuotaScheduler.reserve} only applies the per second limit while
+        quota remains if spreading is turned off, and still pauses until
+        the quota resets once it's exhausted.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(spread=False, timeModule=timeModule)
+        scheduler.update(self.headers(2, 200.0))
+        self.assertEqual(0.0, scheduler.reserve())
+        self.assertEqual(1.0, scheduler.peek())
+        self.assertEqual(1.0, scheduler.reserve())
+        self.assertEqual(0, scheduler.tracker.remaining)
+        self.assertEqual(100.0, scheduler.reserve())
+
+    def testReserveNeverExceedsPerSecondLimit(self):
+        """
+        L{QuotaScheduler.reserve} never schedules calls faster than its
+        L{TokenBucket} allows, even if plenty of quota remains.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(timeModule=timeModule)
+        scheduler.update(self.headers(9998, 200.0))
+        self.assertEqual(0.0, scheduler.reserve())
+        self.assertEqual(1.0, scheduler.reserve())
+
+    def testPeek(self):
+        """
+        L{QuotaScheduler.peek} returns the delay until the next call slot
+        that honours the quota, without reserving it.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(timeModule=timeModule)
+        scheduler.update(self.headers(10, 200.0))
+        scheduler.reserve()
+        self.assertEqual(10.0, scheduler.peek())
+        self.assertEqual(10.0, scheduler.reserve())
+
+    def testPeekWithExhaustedQuota(self):
+        """
+        L{QuotaScheduler.peek} returns the time until the quota resets if
+        it's exhausted and pausing is enabled.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(timeModule=timeModule)
+        scheduler.update(self.headers(0, 3700.0))
+        self.assertEqual(3600.0, scheduler.peek())
+
+    def testReservePausesUntilQuotaResets(self):
+        """
+        L{QuotaScheduler.wait} sleeps until the quota resets when it has been
+        exhausted.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(timeModule=timeModule)
+        scheduler.update(self.headers(0, 3700.0))
+        scheduler.wait()
+        self.assertEqual(3600.0, timeModule.lastSleep)
+        self.assertEqual(9999, scheduler.tracker.remaining)
+
+    def testReserveAfterQuotaResets(self):
+        """
+        The call made when the quota resets counts against the per second
+        limit, so the next call isn't made straight after it.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(timeModule=timeModule)
+        scheduler.update(self.headers(0, 3700.0))
+        scheduler.wait()
+        scheduler.update(self.headers(9999, 90100.0))
+        self.assertTrue(scheduler.reserve() >= 1.0)
+
+    def testExhausted(self):
+        """
+        L{QuotaScheduler.exhausted} returns C{True} if the reset time of the
+        exhausted quota is known, so the call can be retried after pausing.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(timeModule=timeModule)
+        scheduler.update(self.headers(5, 3700.0))
+        self.assertTrue(scheduler.exhausted())
+        self.assertEqual(0, scheduler.tracker.remaining)
+
+    def testExhaustedWithUnknownResetTime(self):
+        """
+        L{QuotaScheduler.exhausted} returns C{False} if the reset time of the
+        quota isn't known.
+        """
+        scheduler = QuotaScheduler(timeModule=FakeTimeModule())
+        self.assertFalse(scheduler.exhausted())
+
+    def testExhaustedWithoutPause(self):
+        """
+        L{QuotaScheduler.exhausted} returns C{False} if pausing is disabled.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = QuotaScheduler(pause=False, timeModule=timeModule)
+        scheduler.update(self.headers(5, 3700.0))
+        self.assertFalse(scheduler.exhausted())
@@ -0,0 +1,142 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.refresh import DAY, RefreshIndex
+
+
+class RefreshIndexTest(TestCase):
+
+    def setUp(self):
+        super(RefreshIndexTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'refresh.db')
+        self.index = RefreshIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        rmtree(self.directory)
+        super(RefreshIndexTest, self).tearDown()
+
+    def testTrack(self):
+        """
+        L{RefreshIndex.track} adds normalized names and returns the number
+        that weren't tracked before.
+        """
+        self.assertEqual(2, self.index.track(['@Foo', 'bar']))
+        self.assertEqual(1, self.index.track(['foo', 'baz']))
+        self.assertEqual(['bar', 'baz', 'foo'],
+                         self.index.getWorkList(10, 1000.0))
+
+    def testNeverRefreshedFirst(self):
+        """Users that have never been refreshed come first."""
+        self.index.record('old', 0.0)
+        self.index.track(['new'])
+        self.assertEqual(['new', 'old'], self.index.getWorkList(10, 1000.0))
+
+    def testStalestFirst(self):
+        """Users refreshed longest ago come first."""
+        self.index.record('recent', 900.0)
+        self.index.record('stale', 100.0)
+        self.assertEqual(['stale', 'recent'],
+                         self.index.getWorkList(10, 1000.0))
+
+    def testHigherScoresFirst(self):
+        """
+        A higher C{peerindex} score raises a user's priority, so a slightly
+        less stale user with a high score comes first.
+        """
+        self.index.record('low', 100.0, score=10)
+        self.index.record('high', 200.0, score=90)
+        self.assertEqual(['high', 'low'], self.index.getWorkList(10, 1000.0))
+        self.assertEqual(['low', 'high'],
+                         self.index.getWorkList(10, 1000.0, weight=0))
+
+    def testLimit(self):
+        """L{RefreshIndex.getWorkList} returns at most C{limit} users."""
+        self.index.track(['one', 'two', 'three'])
+        self.assertEqual(2, len(self.index.getWorkList(2, 1000.0)))
+
+    def testMinAge(self):
+        """Users refreshed less than C{minAge} seconds ago are skipped."""
+        self.index.record('recent', 900.0)
+        self.index.record('stale', 100.0)
+        self.assertEqual(['stale'],
+                         self.index.getWorkList(10, 1000.0, minAge=500))
+
+    def testRecordKeepsScore(self):
+        """
+        L{RefreshIndex.record} keeps the last score if no new one is given.
+        """
+        self.index.record('high', 100.0, score=90)
+        self.index.record('low', 100.0, score=10)
+        self.index.record('high', 200.0)
+        self.assertEqual(['high', 'low'], self.index.getWorkList(10, 1000.0))
+
+    def testRecordProfile(self):
+        """
+        L{RefreshIndex.recordProfile} records the name and score from a
+        profile.
+        """
+        self.index.recordProfile({'twitter': 'High', 'peerindex': 90}, 200.0)
+        self.index.record('low', 100.0, score=10)
+        self.assertEqual(['high', 'low'], self.index.getWorkList(10, 1000.0))
+
+    def testGetRemainingQuota(self):
+        """
+        L{RefreshIndex.getRemainingQuota} subtracts the refreshes recorded
+        in the last day from the quota.
+        """
+        now = 10 * DAY
+        self.index.record('yesterday', now - DAY - 1)
+        self.index.record('today', now - 60)
+        self.index.track(['never'])
+        self.assertEqual(9, self.index.getRemainingQuota(10, now))
+        self.assertEqual(0, self.index.getRemainingQuota(1, now))
+
+    def testRecordFailure(self):
+        """
+        Users recorded with L{RefreshIndex.recordFailure} are left out of
+        work lists until the retry delay has passed.
+        """
+        self.index.track(['unknown', 'other'])
+        self.index.recordFailure('Unknown', 1000.0)
+        self.assertEqual(['other'], self.index.getWorkList(10, 1000.0))
+        self.assertEqual(['other', 'unknown'],
+                         self.index.getWorkList(10, 1000.0 + DAY))
+
+    def testRetryDelayDoubles(self):
+        """
+        The retry delay doubles with each consecutive failure, up to the
+        maximum, and a refresh resets it.
+        """
+        self.index = RefreshIndex(':memory:', retryDelay=100,
+                                  maxRetryDelay=300)
+        self.index.recordFailure('one', 1000.0)
+        self.index.recordFailure('one', 1100.0)
+        self.assertEqual([], self.index.getWorkList(10, 1299.0))
+        self.assertEqual(['one'], self.index.getWorkList(10, 1300.0))
+        self.index.recordFailure('one', 1300.0)
+        self.assertEqual(['one'], self.index.getWorkList(10, 1600.0))
+        self.index.record('one', 1600.0)
+        self.index.recordFailure('one', 1700.0)
+        self.assertEqual(['one'], self.index.getWorkList(10, 1800.0))
+
+    def testGetRemainingQuotaCountsFailures(self):
+        """
+        L{RefreshIndex.getRemainingQuota} counts the failures recorded in
+        the last day as spent calls.
+        """
+        now = 10 * DAY
+        self.index.recordFailure('unknown', now - 60)
+        self.index.recordFailure('old', now - DAY - 1)
+        self.assertEqual(9, self.index.getRemainingQuota(10, now))
+
+    def testPersistence(self):
+        """Recorded refreshes are kept when the index is reopened."""
+        self.index.record('one', 100.0)
+        self.index.close()
+        self.index = RefreshIndex(self.path)
+        self.assertEqual([], self.index.getWorkList(10, 1000.0, minAge=DAY))
+        self.assertEqual(['one'], self.index.getWorkList(10, 1000.0))
@@ -0,0 +1,183 @@
+from json import dumps
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.output import ProfileWriter
+from peerindex.resume import (
+    Checkpoint, getProfileName, loadCompletedNames, repairOutput)
+
+
+class ResumeTestCase(TestCase):
+
+    def setUp(self):
+        super(ResumeTestCase, self).setUp()
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(ResumeTestCase, self).tearDown()
+
+    def write(self, name, data):
+        """Write data to a file in the temporary directory."""
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write(data)
+        return path
+
+
+class GetProfileNameTest(ResumeTestCase):
+
+    def testGetProfileName(self):
+        """
+        L{getProfileName} returns the normalized Twitter name in a line of
+        JSON output.
+        """
+        line = dumps({'twitter': 'TerryCoJones', 'peerindex': 52})
+        self.assertEqual('terrycojones', getProfileName(line))
+
+    def testGetProfileNameWithCompactJSON(self):
+        """
+        L{getProfileName} decodes the line if the name can't be found with a
+        regular expression.
+        """
+        line = dumps({'twitter': 'terrycojones'}, separators=(',', ':'))
+        self.assertEqual('terrycojones', getProfileName(line))
+
+    def testGetProfileNameWithPartialLine(self):
+        """L{getProfileName} returns C{None} for a truncated line."""
+        self.assertEqual(None, getProfileName('{"peerindex": 5'))
+
+
+class LoadCompletedNamesTest(ResumeTestCase):
+
+    def testLoadCompletedNamesFromOutput(self):
+        """
+        L{loadCompletedNames} returns the names of the profiles in the output
+        file.
+        """
+        path = self.write('output.json',
+                          dumps({'twitter': 'one'}) + '\n' +
+                          dumps({'twitter': 'Two'}) + '\n')
+        self.assertEqual(set(['one', 'two']), loadCompletedNames(path))
+
+    def testLoadCompletedNamesFromCheckpoint(self):
+        """
+        L{loadCompletedNames} reads the checkpoint file instead of the output
+        file, if it exists.  A partial trailing line is ignored.
+        """
+        outputPath = self.write('output.json',
+                                dumps({'twitter': 'one'}) + '\n')
+        checkpointPath = self.write('checkpoint', 'two\nthree\nfou')
+        self.assertEqual(set(['two', 'three']),
+                         loadCompletedNames(outputPath, checkpointPath))
+
+    def testLoadCompletedNamesWithFailures(self):
+        """
+        L{loadCompletedNames} includes the users recorded in the checkpoint
+        as failing permanently, so they aren't fetched again.
+        """
+        outputPath = self.write('output.json', '')
+        checkpointPath = self.write('checkpoint', 'one\n!two\n')
+        self.assertEqual(set(['one', 'two']),
+                         loadCompletedNames(outputPath, checkpointPath))
+
+    def testLoadCompletedNamesWithEmptyCheckpoint(self):
+        """
+        L{loadCompletedNames} reads the output file if the checkpoint file
+        is empty, since the download stopped before its first flush.
+        """
+        outputPath = self.write('output.json',
+                                dumps({'twitter': 'one'}) + '\n')
+        checkpointPath = self.write('checkpoint', '')
+        self.assertEqual(set(['one']),
+                         loadCompletedNames(outputPath, checkpointPath))
+
+    def testLoadCompletedNamesFromRotatedOutput(self):
+        """
+        L{loadCompletedNames} reads rotated and compressed output files.
+        """
+        path = os.path.join(self.directory, 'output.json')
+        writer = ProfileWriter(path, compress=True, maxRecords=1)
+        writer.write({'twitter': 'one'})
+        writer.write({'twitter': 'two'})
+        writer.close()
+        self.assertEqual(set(['one', 'two']), loadCompletedNames(path))
+
+    def testLoadCompletedNamesWithMissingFiles(self):
+        """
+        L{loadCompletedNames} returns an empty C{set} if nothing has been
+        downloaded yet.
+        """
+        path = os.path.join(self.directory, 'output.json')
+        self.assertEqual(set(), loadCompletedNames(path, path + '.cp'))
+
+
+class RepairOutputTest(ResumeTestCase):
+
+    def testRepairOutput(self):
+        """L{repairOutput} removes a partial trailing line."""
+        path = self.write('output.json', 'one\ntwo\nthr')
+        self.assertEqual(3, repairOutput(path))
+        self.assertEqual('one\ntwo\n', open(path).read())
+
+    def testRepairOutputWithCompleteFile(self):
+        """L{repairOutput} doesn't change a file ending in a newline."""
+        path = self.write('output.json', 'one\ntwo\n')
+        self.assertEqual(0, repairOutput(path))
+        self.assertEqual('one\ntwo\n', open(path).read())
+
+    def testRepairOutputWithLongPartialLine(self):
+        """
+        L{repairOutput} removes a partial trailing line that's longer than
+        the block size it reads.
+        """
+        path = self.write('output.json', 'one\n' + 'x' * 10000)
+        repairOutput(path)
+        self.assertEqual('one\n', open(path).read())
+
+
+class CheckpointTest(ResumeTestCase):
+
+    def testAdd(self):
+        """
+        L{Checkpoint.add} records a normalized name, which is appended to the
+        file when L{Checkpoint.flush} is called.
+        """
+        path = self.write('checkpoint', 'one\n')
+        checkpoint = Checkpoint(path)
+        checkpoint.add('@Two')
+        self.assertEqual('one\n', open(path).read())
+        checkpoint.flush()
+        checkpoint.close()
+        self.assertEqual('one\ntwo\n', open(path).read())
+
+    def testAddFailure(self):
+        """
+        L{Checkpoint.addFailure} records a normalized name on a marked line,
+        which is appended to the file when L{Checkpoint.flush} is called.
+        """
+        path = self.write('checkpoint', 'one\n')
+        checkpoint = Checkpoint(path)
+        checkpoint.addFailure('@Two')
+        checkpoint.flush()
+        checkpoint.close()
+        self.assertEqual('one\n!two\n', open(path).read())
+
+    def testSeed(self):
+        """
+        A new L{Checkpoint} is seeded with the names already completed, so
+        the next resume doesn't need to scan the output.
+        """
+        path = os.path.join(self.directory, 'checkpoint')
+        Checkpoint(path, ['one', 'two']).close()
+        self.assertEqual('one\ntwo\n', open(path).read())
+
+    def testSeedExistingCheckpoint(self):
+        """
+        A L{Checkpoint} that already lists names isn't seeded again.
+        """
+        path = self.write('checkpoint', 'one\n')
+        Checkpoint(path, ['one']).close()
+        self.assertEqual('one\n', open(path).read())
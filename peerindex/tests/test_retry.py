@@ -0,0 +1,233 @@
+import os
+import socket
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.client import (
+    CredentialsError, PeerIndexError, RateLimitError, UnknownUserError)
+from peerindex.retry import (
+    DeadLetters, RetryScheduler, fetchWithRetries, getErrorKind)
+from peerindex.tests.doubles import FakeTimeModule
+
+
+class FakeRandomModule(object):
+    """A fake C{random} module that always returns the same value."""
+
+    def __init__(self, value=0.0):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class ScriptedPeerIndex(object):
+    """A fake L{PeerIndex} client that fails as scripted for each user.
+
+    @param failures: A C{dict} mapping screen names to a C{list} of the
+        exceptions to raise for successive calls.  Calls after the
+        exceptions run out succeed.
+    """
+
+    def __init__(self, failures):
+        self.calls = []
+        self._failures = failures
+
+    def get(self, name):
+        self.calls.append(name)
+        failures = self._failures.get(name)
+        if failures:
+            raise failures.pop(0)
+        return {'twitter': name}
+
+
+class GetErrorKindTest(TestCase):
+
+    def testGetErrorKind(self):
+        """L{getErrorKind} classifies the errors raised by calls."""
+        self.assertEqual('fatal', getErrorKind(RateLimitError()))
+        self.assertEqual('fatal', getErrorKind(CredentialsError()))
+        self.assertEqual('permanent', getErrorKind(UnknownUserError()))
+        self.assertEqual('retryable', getErrorKind(PeerIndexError()))
+        self.assertEqual('retryable', getErrorKind(socket.error()))
+        self.assertEqual(None, getErrorKind(KeyError()))
+
+
+class RetrySchedulerTest(TestCase):
+
+    def testGetDelay(self):
+        """
+        L{RetryScheduler.getDelay} doubles the delay after each attempt, up
+        to C{maxDelay}, and replaces half of it with jitter.
+        """
+        scheduler = RetryScheduler(baseDelay=2.0, maxDelay=10.0,
+                                   randomModule=FakeRandomModule(0.0))
+        self.assertEqual([1.0, 2.0, 4.0, 5.0],
+                         [scheduler.getDelay(attempts)
+                          for attempts in (1, 2, 3, 4)])
+        scheduler = RetryScheduler(baseDelay=2.0,
+                                   randomModule=FakeRandomModule(0.5))
+        self.assertEqual(1.5, scheduler.getDelay(1))
+
+    def testPop(self):
+        """
+        L{RetryScheduler.pop} returns queued users once their delay has
+        passed, soonest first.
+        """
+        timeModule = FakeTimeModule()
+        scheduler = RetryScheduler(baseDelay=2.0, timeModule=timeModule,
+                                   randomModule=FakeRandomModule(0.0))
+        scheduler.schedule('later', 2)
+        scheduler.schedule('sooner', 1)
+        self.assertEqual(None, scheduler.pop())
+        timeModule.sleep(1.0)
+        self.assertEqual(('sooner', 1), scheduler.pop())
+        self.assertEqual(None, scheduler.pop())
+        self.assertEqual(1.0, scheduler.wait())
+        self.assertEqual(('later', 2), scheduler.pop())
+
+    def testScheduleAfterLastAttempt(self):
+        """
+        L{RetryScheduler.schedule} returns C{False} and doesn't queue a user
+        that has used up its attempts.
+        """
+        scheduler = RetryScheduler(maxAttempts=2)
+        self.assertTrue(scheduler.schedule('user', 1))
+        self.assertFalse(scheduler.schedule('user', 2))
+        self.assertEqual(1, len(scheduler))
+
+    def testDrain(self):
+        """L{RetryScheduler.drain} removes and returns the queued users."""
+        scheduler = RetryScheduler()
+        scheduler.schedule('one', 1)
+        self.assertEqual(['one'], scheduler.drain())
+        self.assertEqual(0, len(scheduler))
+
+
+class FetchWithRetriesTest(TestCase):
+
+    def setUp(self):
+        super(FetchWithRetriesTest, self).setUp()
+        self.timeModule = FakeTimeModule()
+        self.scheduler = RetryScheduler(
+            maxAttempts=3, baseDelay=2.0, timeModule=self.timeModule,
+            randomModule=FakeRandomModule(0.0))
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'failed.txt')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(FetchWithRetriesTest, self).tearDown()
+
+    def testRetriesAreInterleavedWithFreshUsers(self):
+        """
+        A user whose call fails is retried after its backoff delay, while
+        fresh users are fetched in the meantime.
+        """
+        peerindex = ScriptedPeerIndex({'one': [PeerIndexError()]})
+
+        def names():
+            for name in ('one', 'two', 'three'):
+                yield name
+                self.timeModule.sleep(1.0)
+
+        profiles = list(fetchWithRetries(peerindex, names(), self.scheduler))
+        self.assertEqual(['one', 'two', 'one', 'three'], peerindex.calls)
+        self.assertEqual(['two', 'one', 'three'],
+                         [profile['twitter'] for profile in profiles])
+
+    def testWaitsForRetriesAtEnd(self):
+        """
+        When there are no fresh users left, L{fetchWithRetries} sleeps
+        until the next retry is due.
+        """
+        peerindex = ScriptedPeerIndex(
+            {'one': [PeerIndexError(), socket.error()]})
+        profiles = list(fetchWithRetries(peerindex, ['one'], self.scheduler))
+        self.assertEqual([{'twitter': 'one'}], profiles)
+        self.assertEqual(103.0, self.timeModule.time())
+
+    def testPermanentErrorsAreNotRetried(self):
+        """Users unknown to PeerIndex aren't retried."""
+        peerindex = ScriptedPeerIndex({'one': [UnknownUserError()]})
+        deadLetters = DeadLetters(self.path)
+        self.assertEqual([], list(fetchWithRetries(
+            peerindex, ['one'], self.scheduler, deadLetters)))
+        self.assertEqual(['one'], peerindex.calls)
+        self.assertEqual(0, deadLetters.count)
+
+    def testExhaustedUsersAreDeadLettered(self):
+        """
+        Users that fail on every attempt are written to the dead-letter
+        file.
+        """
+        peerindex = ScriptedPeerIndex({'one': [PeerIndexError()] * 3})
+        deadLetters = DeadLetters(self.path)
+        self.assertEqual([{'twitter': 'two'}], list(fetchWithRetries(
+            peerindex, ['one', 'two'], self.scheduler, deadLetters)))
+        deadLetters.close()
+        self.assertEqual(['one', 'two', 'one', 'one'], peerindex.calls)
+        with open(self.path) as deadLettersFile:
+            self.assertEqual('one\n', deadLettersFile.read())
+
+    def testOnFailure(self):
+        """
+        L{fetchWithRetries} calls C{onFailure} with each user that can't be
+        fetched, but not with users that are retried.
+        """
+        peerindex = ScriptedPeerIndex({'one': [PeerIndexError()] * 3,
+                                       'two': [UnknownUserError()],
+                                       'three': [PeerIndexError()]})
+        failed = []
+        self.assertEqual([{'twitter': 'three'}], list(fetchWithRetries(
+            peerindex, ['one', 'two', 'three'], self.scheduler,
+            onFailure=failed.append)))
+        self.assertEqual(['two', 'one'], failed)
+
+    def testOnPermanentFailure(self):
+        """
+        L{fetchWithRetries} calls C{onPermanentFailure} with each user that
+        fails with a permanent error, but not with users that fail after
+        their last attempt.
+        """
+        peerindex = ScriptedPeerIndex({'one': [PeerIndexError()] * 3,
+                                       'two': [UnknownUserError()]})
+        failed = []
+        self.assertEqual([], list(fetchWithRetries(
+            peerindex, ['one', 'two'], self.scheduler,
+            onPermanentFailure=failed.append)))
+        self.assertEqual(['two'], failed)
+
+    def testFatalErrorsAreRaised(self):
+        """
+        Fatal errors stop fetching, and users waiting to be retried are
+        written to the dead-letter file.
+        """
+        peerindex = ScriptedPeerIndex({'one': [PeerIndexError()],
+                                       'two': [RateLimitError()]})
+        deadLetters = DeadLetters(self.path)
+        self.assertRaises(RateLimitError, list, fetchWithRetries(
+            peerindex, ['one', 'two'], self.scheduler, deadLetters))
+        deadLetters.close()
+        with open(self.path) as deadLettersFile:
+            self.assertEqual('one\n', deadLettersFile.read())
+        self.assertEqual(0, len(self.scheduler))
+
+
+class DeadLettersTest(TestCase):
+
+    def testAdd(self):
+        """
+        L{DeadLetters.add} appends a screen name to the file, so it can be
+        read back as input.
+        """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        path = os.path.join(directory, 'failed.txt')
+        with open(path, 'w') as deadLettersFile:
+            deadLettersFile.write('old\n')
+        deadLetters = DeadLetters(path)
+        deadLetters.add(u'caf\xe9')
+        deadLetters.close()
+        with open(path) as deadLettersFile:
+            self.assertEqual('old\ncaf\xc3\xa9\n', deadLettersFile.read())
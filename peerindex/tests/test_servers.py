@@ -0,0 +1,37 @@
+from httplib import HTTPConnection
+from json import dumps, loads
+from unittest import TestCase
+
+from benchmarks.servers import FluidinfoHandler, startServer
+
+
+class FluidinfoHandlerTest(TestCase):
+
+    def setUp(self):
+        super(FluidinfoHandlerTest, self).setUp()
+        self.server = startServer(FluidinfoHandler)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(FluidinfoHandlerTest, self).tearDown()
+
+    def post(self, body):
+        """Post an object to the stand-in and return the response."""
+        connection = HTTPConnection(*self.server.server_address)
+        connection.request('POST', '/objects', dumps(body),
+                           {'content-type': 'application/json'})
+        response = connection.getresponse()
+        result = response.status, loads(response.read())
+        connection.close()
+        return result
+
+    def testPostObject(self):
+        """
+        A C{POST} to C{/objects} returns the same ID for the same about
+        value, including non-ASCII ones.
+        """
+        status, body = self.post({'about': u'@caf\xe9'})
+        self.assertEqual(201, status)
+        self.assertEqual(body, self.post({'about': u'@caf\xe9'})[1])
+        self.assertNotEqual(body, self.post({'about': u'@cafe'})[1])
@@ -0,0 +1,111 @@
+from argparse import ArgumentTypeError
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.output import ProfileWriter
+from peerindex.pipeline import getProfileName
+from peerindex.shard import (
+    filterShard, getShard, getShardPath, mergeShards, parseShard)
+
+
+class ParseShardTest(TestCase):
+
+    def testParseShard(self):
+        """L{parseShard} returns the index and count of a shard."""
+        self.assertEqual((2, 4), parseShard('2/4'))
+
+    def testParseShardWithBadValue(self):
+        """
+        L{parseShard} raises C{ArgumentTypeError} for values that aren't of
+        the form C{i/N}.
+        """
+        self.assertRaises(ArgumentTypeError, parseShard, '2')
+        self.assertRaises(ArgumentTypeError, parseShard, 'a/b')
+
+    def testParseShardWithIndexOutOfRange(self):
+        """
+        L{parseShard} raises C{ArgumentTypeError} for indexes outside 1 to
+        C{N}.
+        """
+        self.assertRaises(ArgumentTypeError, parseShard, '0/4')
+        self.assertRaises(ArgumentTypeError, parseShard, '5/4')
+
+
+class GetShardTest(TestCase):
+
+    def testGetShard(self):
+        """
+        L{getShard} returns a stable shard index for a name, so separate
+        processes agree on the partition.
+        """
+        self.assertEqual([3, 4, 2, 1],
+                         [getShard(name, 4) for name in
+                          ('terrycojones', 'foo', 'bar', u'caf\xe9')])
+
+    def testFilterShard(self):
+        """
+        L{filterShard} splits names into disjoint shards that together
+        include every name.
+        """
+        names = ['user%d' % i for i in range(100)]
+        shards = [list(filterShard(names, index, 3))
+                  for index in (1, 2, 3)]
+        self.assertEqual(sorted(names), sorted(sum(shards, [])))
+        self.assertTrue(all(shard for shard in shards))
+
+    def testFilterShardWithKey(self):
+        """L{filterShard} gets the name for each item with C{key}."""
+        profiles = [{'twitter': 'TerryCoJones'}, {'twitter': 'foo'}]
+        self.assertEqual([{'twitter': 'TerryCoJones'}],
+                         list(filterShard(profiles, 3, 4,
+                                          key=getProfileName)))
+
+    def testGetShardPath(self):
+        """L{getShardPath} adds the shard to the path."""
+        self.assertEqual('profiles.json.shard-2-of-4',
+                         getShardPath('profiles.json', 2, 4))
+
+
+class MergeShardsTest(TestCase):
+
+    def setUp(self):
+        super(MergeShardsTest, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'profiles.json')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(MergeShardsTest, self).tearDown()
+
+    def writeShard(self, index, count, names, **kwargs):
+        """Write profiles for the named users to a shard's output."""
+        writer = ProfileWriter(getShardPath(self.path, index, count),
+                               **kwargs)
+        for name in names:
+            writer.write({'twitter': name})
+        writer.close()
+
+    def testMergeShards(self):
+        """
+        L{mergeShards} yields the profiles from each shard in turn,
+        including rotated files, and skips repeated users.
+        """
+        self.writeShard(1, 2, ['one', 'two', 'three'], maxRecords=2)
+        self.writeShard(2, 2, ['four', 'One'])
+        self.assertEqual(['one', 'two', 'three', 'four'],
+                         [profile['twitter'] for profile in
+                          mergeShards(self.path, 2)])
+
+    def testMergeShardsWithMissingShard(self):
+        """L{mergeShards} skips shards that haven't written anything."""
+        self.writeShard(2, 2, ['one'])
+        self.assertEqual([{'twitter': 'one'}],
+                         list(mergeShards(self.path, 2)))
+
+    def testMergeShardsWithCompressedOutput(self):
+        """L{mergeShards} reads compressed shard outputs."""
+        self.writeShard(1, 1, ['one'], compress=True)
+        self.assertEqual([{'twitter': 'one'}],
+                         list(mergeShards(self.path, 1)))
@@ -0,0 +1,163 @@
+import random
+import socket
+from unittest import TestCase
+
+from peerindex.client import (
+    PeerIndex, PeerIndexError, RateLimitError, UnknownUserError)
+from peerindex.ratelimit import QuotaScheduler, TokenBucket
+from peerindex.retry import RetryScheduler, fetchWithRetries
+from peerindex.tests.doubles import FakeTimeModule
+from peerindex.tests.simulator import (
+    DAY, SimulatedPeerIndex, constantLatency, exponentialLatency,
+    logNormalLatency, uniformLatency)
+
+
+class LatencyTest(TestCase):
+
+    def testDistributions(self):
+        """
+        The latency distributions return non-negative latencies around the
+        requested values.
+        """
+        generator = random.Random(0)
+        self.assertEqual(0.5, constantLatency(0.5)(generator))
+        samples = [uniformLatency(1.0, 2.0)(generator) for i in range(100)]
+        self.assertTrue(all(1.0 <= sample <= 2.0 for sample in samples))
+        for distribution in (exponentialLatency(1.0), logNormalLatency(1.0)):
+            samples = [distribution(generator) for i in range(1000)]
+            self.assertTrue(min(samples) >= 0.0)
+            self.assertTrue(0.7 < sum(samples) / len(samples) < 1.5)
+
+
+class SimulatedPeerIndexTest(TestCase):
+
+    def setUp(self):
+        super(SimulatedPeerIndexTest, self).setUp()
+        self.timeModule = FakeTimeModule()
+
+    def createClient(self, server, key='key'):
+        """Create a L{PeerIndex} client for a simulated server."""
+        return PeerIndex(key, client=server, timeModule=self.timeModule,
+                         limiter=TokenBucket(timeModule=self.timeModule))
+
+    def testGet(self):
+        """
+        A call for a known user returns a profile after the simulated
+        latency, and reports the remaining quota in its headers.
+        """
+        server = SimulatedPeerIndex(self.timeModule, quota=10,
+                                    latency=constantLatency(0.25))
+        peerindex = self.createClient(server)
+        self.assertEqual('terrycojones',
+                         peerindex.get('terrycojones')['twitter'])
+        self.assertEqual(100.25, self.timeModule.time())
+        headers, content = server.request(
+            'http://api/1/profile/show.json?id=one&api_key=key')
+        self.assertEqual('200', headers['status'])
+        self.assertEqual('8', headers['x-ratelimit-remaining'])
+        self.assertEqual(str(100 + DAY), headers['x-ratelimit-reset'])
+
+    def testRateLimit(self):
+        """
+        Calls made once the quota is exhausted get a C{403} rate limit
+        error, until the quota resets.
+        """
+        server = SimulatedPeerIndex(self.timeModule, quota=2,
+                                    resetInterval=60)
+        peerindex = self.createClient(server)
+        peerindex.get('one')
+        peerindex.get('two')
+        self.assertRaises(RateLimitError, peerindex.get, 'three')
+        self.assertEqual(1, server.rateLimited)
+        self.timeModule.sleep(60)
+        peerindex.get('three')
+        self.assertEqual(1, server.resets)
+
+    def testQuotaIsPerKey(self):
+        """Each API key has its own quota."""
+        server = SimulatedPeerIndex(self.timeModule, quota=1)
+        self.createClient(server, 'one').get('user')
+        self.createClient(server, 'two').get('user')
+        self.assertEqual(2, server.profiles)
+
+    def testUnknownUser(self):
+        """
+        Unknown users get a C{200} response with a C{404 Not Found} body.
+        """
+        server = SimulatedPeerIndex(self.timeModule, unknownRate=1.0)
+        headers, content = server.request(
+            'http://api/1/profile/show.json?id=one&api_key=key')
+        self.assertEqual('200', headers['status'])
+        self.assertRaises(UnknownUserError,
+                          self.createClient(server).get, 'two')
+        self.assertEqual(2, server.unknown)
+
+    def testUnknownRate(self):
+        """
+        About C{unknownRate} of users are unknown, and the same users are
+        always unknown.
+        """
+        server = SimulatedPeerIndex(self.timeModule, unknownRate=0.25)
+        names = ['user%d' % i for i in range(1000)]
+        unknown = [name for name in names if server.isUnknown(name)]
+        self.assertTrue(200 < len(unknown) < 300)
+        self.assertEqual(unknown,
+                         [name for name in names if server.isUnknown(name)])
+
+    def testServerError(self):
+        """
+        Calls can fail with a C{5xx} response, which doesn't use up the
+        quota.
+        """
+        server = SimulatedPeerIndex(self.timeModule, quota=1,
+                                    serverErrorRate=1.0)
+        peerindex = self.createClient(server)
+        self.assertRaises(PeerIndexError, peerindex.get, 'one')
+        headers, content = server.request(
+            'http://api/1/profile/show.json?id=one&api_key=key')
+        self.assertIn(headers['status'], ['500', '502', '503'])
+        self.assertEqual('1', headers['x-ratelimit-remaining'])
+        self.assertEqual(2, server.serverErrors)
+
+    def testConnectionError(self):
+        """Calls can fail with a C{socket.error}."""
+        server = SimulatedPeerIndex(self.timeModule, connectionErrorRate=1.0)
+        self.assertRaises(socket.error, self.createClient(server).get, 'one')
+        self.assertEqual(1, server.connectionErrors)
+
+    def testViolations(self):
+        """
+        Calls made with the same key less than C{minInterval} seconds apart
+        are counted as violations.
+        """
+        server = SimulatedPeerIndex(self.timeModule)
+        uri = 'http://api/1/profile/show.json?id=one&api_key=key'
+        server.request(uri)
+        server.request(uri)
+        self.timeModule.sleep(1.0)
+        server.request(uri)
+        self.assertEqual(1, server.violations)
+
+    def testSimulatedDays(self):
+        """
+        A L{QuotaScheduler} and a L{RetryScheduler} fetch every user over
+        several simulated days, without exceeding the rate limit or the
+        quota, despite transient errors.
+        """
+        server = SimulatedPeerIndex(
+            self.timeModule, quota=2000, latency=exponentialLatency(0.3),
+            unknownRate=0.02, serverErrorRate=0.05,
+            connectionErrorRate=0.01)
+        peerindex = PeerIndex(
+            'key', client=server, timeModule=self.timeModule,
+            limiter=QuotaScheduler(timeModule=self.timeModule))
+        retries = RetryScheduler(timeModule=self.timeModule,
+                                 randomModule=random.Random(0))
+        names = ['user%d' % i for i in range(5000)]
+        profiles = list(fetchWithRetries(peerindex, names, retries))
+        expected = [name for name in names if not server.isUnknown(name)]
+        self.assertEqual(len(expected), len(profiles))
+        self.assertEqual(0, server.violations)
+        self.assertEqual(0, server.rateLimited)
+        self.assertEqual(2, server.resets)
+        self.assertTrue(self.timeModule.time() > 2 * DAY)
@@ -0,0 +1,148 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from peerindex.fluidinfo import BatchWriter
+from peerindex.store import ChangedValuesWriter, ValueStore
+from peerindex.tests.doubles import FakeFluid, FakeTimeModule
+
+
+class ValueStoreTest(TestCase):
+
+    def setUp(self):
+        super(ValueStoreTest, self).setUp()
+        self.values = {'peerindex.com/updated-at': {'value': 1000.0},
+                       'peerindex.com/peerindex': {'value': 52},
+                       'peerindex.com/topics': {'value': ['writing']}}
+
+    def testGetChangedValuesForUnknownUser(self):
+        """
+        L{ValueStore.getChangedValues} returns all the values for a user that
+        hasn't been recorded.
+        """
+        store = ValueStore(':memory:')
+        self.assertEqual(self.values,
+                         store.getChangedValues('terrycojones', self.values,
+                                                1000.0))
+
+    def testGetChangedValuesWithUnchangedValues(self):
+        """
+        L{ValueStore.getChangedValues} returns an empty C{dict} if none of
+        the values have changed, ignoring C{peerindex.com/updated-at}.
+        """
+        store = ValueStore(':memory:')
+        store.record('terrycojones', self.values, 1000.0)
+        self.values['peerindex.com/updated-at'] = {'value': 2000.0}
+        self.assertEqual({}, store.getChangedValues('@TerryCoJones',
+                                                    self.values, 2000.0))
+
+    def testGetChangedValuesWithChangedValue(self):
+        """
+        L{ValueStore.getChangedValues} returns the changed values along with
+        C{peerindex.com/updated-at}.
+        """
+        store = ValueStore(':memory:')
+        store.record('terrycojones', self.values, 1000.0)
+        self.values['peerindex.com/peerindex'] = {'value': 53}
+        self.assertEqual(
+            {'peerindex.com/updated-at': {'value': 1000.0},
+             'peerindex.com/peerindex': {'value': 53}},
+            store.getChangedValues('terrycojones', self.values, 2000.0))
+
+    def testGetChangedValuesRefreshesUpdatedAt(self):
+        """
+        L{ValueStore.getChangedValues} returns C{peerindex.com/updated-at} on
+        its own if it was last written more than C{refreshAfter} seconds ago.
+        """
+        store = ValueStore(':memory:', refreshAfter=500)
+        store.record('terrycojones', self.values, 1000.0)
+        self.assertEqual({}, store.getChangedValues('terrycojones',
+                                                    self.values, 1499.0))
+        self.assertEqual(
+            {'peerindex.com/updated-at': {'value': 1000.0}},
+            store.getChangedValues('terrycojones', self.values, 1500.0))
+
+    def testRecordMergesValues(self):
+        """
+        L{ValueStore.record} updates the hashes of the written tags and keeps
+        the hashes of the others.
+        """
+        store = ValueStore(':memory:')
+        store.record('terrycojones', self.values, 1000.0)
+        store.record('terrycojones',
+                     {'peerindex.com/peerindex': {'value': 53}}, 2000.0)
+        self.values['peerindex.com/peerindex'] = {'value': 53}
+        self.assertEqual({}, store.getChangedValues('terrycojones',
+                                                    self.values, 2000.0))
+
+    def testValuesArePersistent(self):
+        """Values recorded by L{ValueStore} are available after reopening."""
+        directory = mkdtemp()
+        try:
+            path = os.path.join(directory, 'values.db')
+            store = ValueStore(path)
+            store.record('terrycojones', self.values, 1000.0)
+            store.close()
+            store = ValueStore(path)
+            self.assertEqual({}, store.getChangedValues('terrycojones',
+                                                        self.values, 1000.0))
+            store.close()
+        finally:
+            rmtree(directory)
+
+
+class ChangedValuesWriterTest(TestCase):
+
+    def testAddSkipsUnchangedObjects(self):
+        """
+        L{ChangedValuesWriter.add} only writes changed values, and skips
+        objects that haven't changed since they were last written.
+        """
+        fluid = FakeFluid()
+        store = ValueStore(':memory:')
+        writer = ChangedValuesWriter(BatchWriter(fluid, batchSize=1), store,
+                                     timeModule=FakeTimeModule())
+        writer.add('one', 'query1', {'peerindex.com/peerindex': {'value': 1}})
+        writer.add('one', 'query1', {'peerindex.com/peerindex': {'value': 1},
+                                     'peerindex.com/name': {'value': 'One'}})
+        writer.add('one', 'query1', {'peerindex.com/peerindex': {'value': 1},
+                                     'peerindex.com/name': {'value': 'One'}})
+        writer.close()
+        self.assertEqual(
+            [[['query1', {'peerindex.com/peerindex': {'value': 1}}]],
+             [['query1', {'peerindex.com/name': {'value': 'One'}}]]],
+            fluid.requests)
+        self.assertEqual(1, writer.skipped)
+
+    def testFailedWritesAreNotRecorded(self):
+        """
+        Values that couldn't be written aren't recorded, so they're written
+        again next time.
+        """
+        fluid = FakeFluid()
+        fluid.failures.add('query1')
+        store = ValueStore(':memory:')
+        writer = ChangedValuesWriter(BatchWriter(fluid, batchSize=2), store,
+                                     timeModule=FakeTimeModule())
+        values = {'peerindex.com/peerindex': {'value': 1}}
+        writer.add('one', 'query1', values)
+        writer.add('two', 'query2', values)
+        writer.close()
+        self.assertEqual(values, store.getChangedValues('one', values, 100.0))
+        self.assertEqual({}, store.getChangedValues('two', values, 100.0))
+
+    def testSync(self):
+        """
+        L{ChangedValuesWriter.sync} writes the current batch and records the
+        written values.
+        """
+        fluid = FakeFluid()
+        store = ValueStore(':memory:')
+        writer = ChangedValuesWriter(BatchWriter(fluid, batchSize=10), store,
+                                     timeModule=FakeTimeModule())
+        values = {'peerindex.com/peerindex': {'value': 1}}
+        writer.add('one', 'query1', values)
+        self.assertEqual(['one'], [result.key for result in writer.sync()])
+        self.assertEqual([[['query1', values]]], fluid.requests)
+        self.assertEqual({}, store.getChangedValues('one', values, 100.0))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# See README.markdown for usage instructions.
+
+from argparse import ArgumentParser
+import logging
+import os
+import sys
+
+from fom.db import BASE_URL
+from fom.session import Fluid
+
+from peerindex.bundles import BundleWriter
+from peerindex.client import BASE_URL as PEERINDEX_URL, RateLimitError
+from peerindex.fluidinfo import BatchWriter, ConcurrentBatchWriter
+from peerindex.keypool import createPeerIndex
+from peerindex.names import createSeenSet
+from peerindex.output import ProfileWriter
+from peerindex.pipeline import (
+    dedup, fetchProfiles, getProfileName, mapTags, normalizeNames,
+    readNames, readPaths, readProfiles, writeFluidinfo, writeJSONL)
+from peerindex.pool import ConnectionPool, usePool
+from peerindex.store import ChangedValuesWriter, ValueStore
+
+
+def createFluidinfoWriter(args, connections):
+    """Create the writer for the Fluidinfo sink.
+
+    @param args: The parsed command line arguments.
+    @param connections: The L{ConnectionPool} to make requests with.
+    @return: A C{(writer, store)} 2-tuple.  C{writer} is a L{BatchWriter},
+        L{ConcurrentBatchWriter} or L{ChangedValuesWriter}.  C{store} is
+        the L{ValueStore} used by the L{ChangedValuesWriter}, or C{None}.
+    """
+    password = os.environ['FLUIDINFO_PEERINDEX_PASSWORD']
+    assert password, 'Please set FLUIDINFO_PEERINDEX_PASSWORD in your env.'
+
+    def createSession():
+        fdb = usePool(Fluid(os.environ.get('FLUIDINFO_URL', BASE_URL)),
+                      connections)
+        fdb.login('peerindex.com', password)
+        return fdb
+
+    if args.concurrency > 1:
+        writer = ConcurrentBatchWriter(createSession, args.concurrency,
+                                       batchSize=args.batch_size)
+    else:
+        writer = BatchWriter(createSession(), batchSize=args.batch_size)
+    store = None
+    if args.storePath is not None:
+        store = ValueStore(args.storePath,
+                           refreshAfter=args.refresh_updated_at)
+        writer = ChangedValuesWriter(writer, store)
+    return writer, store
+
+
+def logError(item):
+    """Log the error of a write, if it failed.
+
+    @param item: A L{WriteResult}, or a profile when nothing is written.
+    @return: C{True} if the write failed, otherwise C{False}.
+    """
+    error = getattr(item, 'error', None)
+    if error is None:
+        return False
+    logging.error('Error writing %s: %s'
+                  % (item.key, getattr(error, 'response', error)))
+    return True
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Stream Twitter screen names or JSON PeerIndex profiles '
+                    'to PeerIndex, a JSON archive and Fluidinfo in one pass.')
+    parser.add_argument('paths', metavar='PATH', nargs='*',
+                        help='Files to read, instead of stdin.')
+    parser.add_argument('--profiles', action='store_true',
+                        help='Read JSON profiles instead of screen names, '
+                             'and skip fetching them from PeerIndex.')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Skip repeated users.')
+    parser.add_argument('--dedup-memory', type=int, default=1000000,
+                        help='The number of users to remember in memory '
+                             'before spilling to disk.')
+    parser.add_argument('--bloom', type=int, metavar='CAPACITY',
+                        help='Skip repeated users with a Bloom filter sized '
+                             'for this many users, which may also skip a '
+                             'few unique ones.')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='The number of PeerIndex calls to make per '
+                             'second with each key.')
+    parser.add_argument('--no-spread', dest='spread', action='store_false',
+                        help="Make calls as fast as --rate allows instead "
+                             "of spreading the daily quota until it resets, "
+                             "for runs that don't need all of it.")
+    parser.add_argument('--output', dest='outputPath',
+                        help='A file to append JSON profiles to.')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Compress the output with gzip.')
+    parser.add_argument('--fluidinfo', action='store_true',
+                        help='Write the profiles to Fluidinfo.')
+    parser.add_argument('--bundles', dest='bundlesPath', metavar='DIR',
+                        help='Save the Fluidinfo writes to bundles in DIR, '
+                             'for replay-bundles.py, instead of making '
+                             'them.')
+    parser.add_argument('--bundle-size', type=int, default=100,
+                        help='The number of profiles per bundle.')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='The number of profiles to write per request.')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='The number of batches to write at once.')
+    parser.add_argument('--store', dest='storePath',
+                        help='A database of the values last written, used '
+                             'to only write values that have changed.')
+    parser.add_argument('--refresh-updated-at', type=float,
+                        help='Rewrite peerindex.com/updated-at for unchanged '
+                             'profiles after this many seconds.')
+    args = parser.parse_args()
+    if (args.outputPath is None and not args.fluidinfo and
+            args.bundlesPath is None):
+        parser.error('At least one of --output, --fluidinfo and --bundles '
+                     'is needed.')
+    if args.bundlesPath is not None and args.fluidinfo:
+        parser.error("--bundles and --fluidinfo can't be used together.")
+    if args.bundlesPath is not None and args.storePath is not None:
+        parser.error("--store can't be used with --bundles, since values "
+                     "aren't written until the bundles are replayed.")
+    logging.basicConfig(format='%(asctime)s %(levelname)8s  %(message)s',
+                        level=logging.INFO)
+
+    connections = ConnectionPool(maxPerHost=args.concurrency)
+    seen = createSeenSet(args.dedup_memory, args.bloom)
+    if args.profiles:
+        profiles = readPaths(args.paths, readProfiles)
+        if args.dedup:
+            profiles = dedup(profiles, key=getProfileName, seen=seen)
+    else:
+        apikey = os.environ['PEERINDEX_API_KEY']
+        assert apikey, 'Please set PEERINDEX_API_KEY in your env.'
+        names = normalizeNames(readPaths(args.paths, readNames))
+        if args.dedup:
+            names = dedup(names, seen=seen)
+        peerindex = createPeerIndex(
+            apikey, rate=args.rate, spread=args.spread, client=connections,
+            baseURL=os.environ.get('PEERINDEX_API_URL', PEERINDEX_URL))
+        profiles = fetchProfiles(peerindex, names)
+
+    outputWriter = None
+    if args.outputPath is not None:
+        outputWriter = ProfileWriter(args.outputPath, flushEvery=100,
+                                     compress=args.gzip)
+        profiles = writeJSONL(outputWriter, profiles)
+    fluidinfoWriter = store = None
+    if args.fluidinfo:
+        fluidinfoWriter, store = createFluidinfoWriter(args, connections)
+    elif args.bundlesPath is not None:
+        fluidinfoWriter = BundleWriter(args.bundlesPath,
+                                       bundleSize=args.bundle_size)
+    if fluidinfoWriter is not None:
+        stream = writeFluidinfo(fluidinfoWriter, mapTags(profiles))
+    else:
+        stream = profiles
+
+    count = errors = 0
+    try:
+        try:
+            for item in stream:
+                count += 1
+                errors += logError(item)
+        finally:
+            # writeFluidinfo only closes the writer when the stream is
+            # exhausted, so close it here too, in case it was interrupted.
+            # Closing it again has no further effect.
+            if fluidinfoWriter is not None:
+                for item in fluidinfoWriter.close():
+                    count += 1
+                    errors += logError(item)
+    except (RateLimitError, KeyboardInterrupt) as e:
+        print >>sys.stderr, 'Stopping: %r' % e
+    finally:
+        seen.close()
+        if store is not None:
+            store.close()
+        if outputWriter is not None:
+            outputWriter.close()
+    logging.info('Processed %d profiles with %d errors' % (count, errors))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+# See README.markdown for usage instructions.
+
+from argparse import ArgumentParser
+import logging
+import sys
+import time
+
+from peerindex.pipeline import readNames, readPaths
+from peerindex.refresh import RefreshIndex
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Print the Twitter users most in need of a refresh, as '
+                    'many as the remaining daily quota allows.')
+    parser.add_argument('indexPath', metavar='INDEX_PATH',
+                        help='The refresh index, as used with '
+                             '--refresh-index.')
+    parser.add_argument('--track', dest='trackPaths', metavar='PATH',
+                        action='append', default=[],
+                        help='A file of Twitter users, one per line, to add '
+                             'to the index.  Can be repeated.')
+    parser.add_argument('--quota', type=int, default=10000,
+                        help='The number of calls allowed per day, over all '
+                             'API keys.')
+    parser.add_argument('--limit', type=int,
+                        help='The number of users to print, instead of the '
+                             'remaining quota.')
+    parser.add_argument('--min-age', type=float, default=0,
+                        help='Skip users refreshed less than this many '
+                             'seconds ago.')
+    parser.add_argument('--weight', type=float, default=1.0,
+                        help='How strongly a higher peerindex score raises a '
+                             'user\'s priority.  0 orders users by '
+                             'staleness alone.')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)8s  %(message)s',
+                        level=logging.INFO)
+
+    index = RefreshIndex(args.indexPath)
+    if args.trackPaths:
+        count = index.track(readPaths(args.trackPaths, readNames))
+        logging.info('Tracking %d new users' % count)
+    now = time.time()
+    limit = args.limit
+    if limit is None:
+        limit = index.getRemainingQuota(args.quota, now)
+    names = index.getWorkList(limit, now, minAge=args.min_age,
+                              weight=args.weight)
+    index.close()
+    for name in names:
+        sys.stdout.write(name.encode('utf-8') + '\n')
+    logging.info('Listed %d users' % len(names))
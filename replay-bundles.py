@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# See README.markdown for usage instructions.
+
+from argparse import ArgumentParser
+import logging
+import os
+import sys
+
+from fom.db import BASE_URL
+from fom.session import Fluid
+
+from peerindex.bundles import (
+    ReplayLog, getBundlePaths, replayBundles, writeBundle)
+from peerindex.fluidinfo import WriterPool
+from peerindex.pool import ConnectionPool, usePool
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Write bundles saved by pipeline.py --bundles to '
+                    'Fluidinfo.')
+    parser.add_argument('directory', metavar='DIR',
+                        help='The directory of bundles to write.')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='The number of bundles to write at once, each '
+                             'with its own Fluidinfo session.')
+    parser.add_argument('--log', dest='logPath',
+                        help='The file listing the bundles written, so they '
+                             'are skipped when the replay is run again.  '
+                             'Defaults to DIR/replayed.log.')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)8s  %(message)s',
+                        level=logging.INFO)
+
+    password = os.environ['FLUIDINFO_PEERINDEX_PASSWORD']
+    assert password, 'Please set FLUIDINFO_PEERINDEX_PASSWORD in your env.'
+
+    connections = ConnectionPool(maxPerHost=args.concurrency)
+
+    def createSession():
+        fdb = usePool(Fluid(os.environ.get('FLUIDINFO_URL', BASE_URL)),
+                      connections)
+        fdb.login('peerindex.com', password)
+        return fdb
+
+    log = ReplayLog(args.logPath or
+                    os.path.join(args.directory, 'replayed.log'))
+    pool = WriterPool(createSession, writeBundle,
+                      concurrency=args.concurrency)
+    bundles = objects = errors = 0
+    try:
+        for path, count, error in replayBundles(
+                pool, getBundlePaths(args.directory), log):
+            if error is not None:
+                errors += 1
+                logging.error('Error writing %s: %s'
+                              % (path, getattr(error, 'response', error)))
+                continue
+            bundles += 1
+            objects += count
+            logging.info('Wrote %s (%d objects)' % (path, count))
+    except KeyboardInterrupt as e:
+        print >>sys.stderr, 'Stopping: %r' % e
+    finally:
+        log.close()
+    logging.info('Wrote %d bundles with %d objects, %d bundles failed'
+                 % (bundles, objects, errors))